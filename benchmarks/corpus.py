@@ -0,0 +1,174 @@
+"""
+Generate synthetic projects for benchmarking django-unasyncify
+
+The generated projects try to look like a real Django-sized codebase:
+lots of modules spread over nested packages, most of which never use
+the unasync decorators, a handful of modules with decorated functions
+(IS_ASYNC branches, async for/with, nested awaits), and a few very large
+ORM-style classes in the spirit of django/db/models/query.py.
+"""
+
+import random
+from dataclasses import dataclass
+from pathlib import Path
+from textwrap import dedent, indent
+
+PACKAGE_NAME = "corpus_pkg"
+
+
+@dataclass
+class CorpusSpec:
+    # total number of modules to generate
+    modules: int = 1000
+    # share of modules that contain @generate_unasynced functions
+    marked_share: float = 0.05
+    # how many package levels modules get nested in
+    depth: int = 4
+    # number of large ORM-style modules (counted within `modules`)
+    large_modules: int = 2
+    # methods on each class of a large module
+    large_module_methods: int = 100
+    seed: int = 0
+
+
+PYPROJECT = f"""\
+[tool.django_unasyncify]
+unasync_helpers_path = "{PACKAGE_NAME}/_codegen.py"
+unasync_helpers_import_path = "{PACKAGE_NAME}._codegen"
+"""
+
+MODULE_HEADER = f"""\
+import itertools
+from collections import defaultdict
+
+from {PACKAGE_NAME}._codegen import IS_ASYNC, generate_unasynced
+"""
+
+
+def plain_function(rng: random.Random, index: int) -> str:
+    return dedent(f"""
+        def helper_{index}(items, key=None):
+            \"\"\"
+            Group some items, the way that lots of utility code does.
+            \"\"\"
+            grouped = defaultdict(list)
+            for item in items:
+                grouped[key(item) if key else item].append(item)
+            return {{k: len(v) * {rng.randint(1, 9)} for k, v in grouped.items()}}
+        """)
+
+
+def plain_class(rng: random.Random, index: int) -> str:
+    methods = "".join(
+        indent(
+            dedent(f"""
+                def method_{m}(self, value):
+                    if value > {rng.randint(0, 100)}:
+                        return [self.base + v for v in range(value)]
+                    return list(itertools.islice(self.values, value))
+                """),
+            "    ",
+        )
+        for m in range(rng.randint(2, 8))
+    )
+    return f"\n\nclass Plain{index}:\n    base = {index}\n    values = ()\n{methods}"
+
+
+def marked_method(rng: random.Random, name: str, nesting: int) -> str:
+    """
+    An async method covering the constructs the transform cares about
+    """
+    body = dedent(f"""\
+        result = {{"used_async": IS_ASYNC}}
+        if IS_ASYNC:
+            result["rows"] = await self._afetch_rows({rng.randint(1, 50)})
+        elif self.readonly:
+            result["rows"] = []
+        else:
+            result["rows"] = self._fetch_rows_blocking()
+        async with self.aconnection.cursor() as cursor:
+            async for row in cursor.aiterate(result["rows"]):
+                await self.ahandle(row)
+        values = [await self.aresolve(v) async for v in self.avalues()]
+        """)
+    # deep nesting, as seen in real world code
+    for level in range(nesting):
+        body = (
+            f"for item_{level} in range(self.limit):\n"
+            f"    if item_{level} % {level + 2}:\n"
+            + indent(body, "        ")
+            + f"    else:\n        await self.askip(item_{level})\n"
+        )
+    body += "return await self.aget(pk=values[0]) if values else None\n"
+    return (
+        "@generate_unasynced\n"
+        f"async def a{name}(self):\n"
+        '    """A generated docstring, kept in both variants."""\n'
+        + indent(body, "    ")
+    )
+
+
+def marked_class(rng: random.Random, index: int, methods: int) -> str:
+    parts = [f"\n\nclass QuerySet{index}:\n    readonly = False\n    limit = 10\n"]
+    for m in range(methods):
+        if rng.random() < 0.3:
+            method = marked_method(rng, f"operation_{m}", nesting=rng.randint(0, 3))
+        else:
+            method = dedent(f"""\
+                def plain_operation_{m}(self, *args, **kwargs):
+                    clone = self._chain()
+                    clone.query.add_q(args, kwargs, {m})
+                    return clone
+                """)
+        parts.append("\n" + indent(method, "    "))
+    return "".join(parts)
+
+
+def regular_module(rng: random.Random, index: int, marked: bool) -> str:
+    parts = [MODULE_HEADER]
+    for f in range(rng.randint(3, 12)):
+        parts.append(plain_function(rng, f))
+    for c in range(rng.randint(1, 4)):
+        parts.append(plain_class(rng, c))
+    if marked:
+        parts.append(marked_class(rng, index, methods=rng.randint(2, 10)))
+    return "\n".join(parts)
+
+
+def large_module(rng: random.Random, index: int, methods: int) -> str:
+    parts = [MODULE_HEADER]
+    for c in range(3):
+        parts.append(marked_class(rng, index * 10 + c, methods=methods))
+    return "\n".join(parts)
+
+
+def generate_corpus(target: Path, spec: CorpusSpec) -> Path:
+    """
+    Write out a project following the spec in target, returning its location
+    """
+    rng = random.Random(spec.seed)
+    target.mkdir(parents=True, exist_ok=True)
+    (target / "pyproject.toml").write_text(PYPROJECT)
+
+    package_root = target / PACKAGE_NAME
+    package_root.mkdir(exist_ok=True)
+    (package_root / "__init__.py").write_text("")
+
+    for index in range(spec.modules):
+        # spread modules out over nested packages
+        package = package_root
+        for level in range(rng.randint(0, spec.depth)):
+            package = package / f"sub{level}_{rng.randint(0, 3)}"
+            if not package.exists():
+                package.mkdir()
+                (package / "__init__.py").write_text("")
+
+        if index < spec.large_modules:
+            contents = large_module(rng, index, spec.large_module_methods)
+            name = f"query_{index}.py"
+        else:
+            marked = rng.random() < spec.marked_share
+            contents = regular_module(rng, index, marked)
+            name = f"module_{index}.py"
+        (package / name).write_text(contents)
+    return target
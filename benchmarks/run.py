@@ -0,0 +1,240 @@
+"""
+Benchmarks for django-unasyncify
+
+Generates a synthetic project (see corpus.py), then times:
+
+- full runs of ``cmd.main``, both from scratch and when nothing changed
+- ``UnasyncifyMethodCommand`` on each file that has decorated functions
+- ``UnasyncifyMethod`` on each decorated function
+
+Run from the repository root with::
+
+    python -m benchmarks.run
+    python -m benchmarks.run --modules 5000 --save-baseline
+
+Results are compared against ``benchmarks/baseline.json`` (if present),
+and the run fails when a measurement regresses past the tolerance.
+Baselines are machine-specific, so record one on the machine you are
+comparing against.
+"""
+
+import contextlib
+import io
+import json
+import shutil
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from collections.abc import Callable
+from dataclasses import asdict
+from functools import partial
+from pathlib import Path
+
+import libcst as cst
+from libcst.codemod import CodemodContext
+
+from django_unasyncify.cmd import main as cli_main
+from django_unasyncify.codemod import UnasyncifyMethodCommand
+from django_unasyncify.config import Config
+from django_unasyncify.discovery import gather_python_files, has_unasync_markers
+from django_unasyncify.transform import UnasyncifyMethod
+
+from .corpus import CorpusSpec, generate_corpus
+
+BASELINE_PATH = Path(__file__).parent / "baseline.json"
+
+
+def timed(f: Callable[[], object]) -> float:
+    start = time.perf_counter()
+    f()
+    return time.perf_counter() - start
+
+
+def best_of(repeat: int, f: Callable[[], object]) -> float:
+    return min(timed(f) for _ in range(repeat))
+
+
+def quietly(f: Callable[[], object]) -> Callable[[], object]:
+    def wrapper():
+        with (
+            contextlib.redirect_stdout(io.StringIO()),
+            contextlib.redirect_stderr(io.StringIO()),
+        ):
+            return f()
+
+    return wrapper
+
+
+def bench_cli(corpus: Path, workdir: Path, repeat: int) -> dict[str, float]:
+    results: dict[str, float] = {}
+
+    def fresh_copy() -> Config:
+        project = workdir / "project"
+        if project.exists():
+            shutil.rmtree(project)
+        shutil.copytree(corpus, project)
+        return Config.from_project_path(project)
+
+    cold_times = []
+    for _ in range(repeat):
+        config = fresh_copy()
+        cold_times.append(timed(quietly(partial(cli_main, config))))
+    results["cmd.main/cold"] = min(cold_times)
+
+    # the project from the last cold run is now fully generated
+    results["cmd.main/noop_cached"] = best_of(repeat, quietly(lambda: cli_main(config)))
+    results["cmd.main/noop_uncached"] = best_of(
+        repeat, quietly(lambda: cli_main(config, ["--no-cache"]))
+    )
+    return results
+
+
+def bench_files(corpus: Path, repeat: int, top: int) -> dict[str, float]:
+    """
+    Time the codemod on every file with decorated functions
+    """
+    config = Config.from_project_path(corpus)
+    files = [
+        f for f in gather_python_files(config.paths_to_visit) if has_unasync_markers(f)
+    ]
+
+    per_file: dict[str, float] = {}
+    functions: list[cst.FunctionDef] = []
+    parse_total = 0.0
+    for filename in files:
+        with open(filename, "rb") as f:
+            code = f.read()
+
+        parse_total += best_of(repeat, partial(cst.parse_module, code))
+        module = cst.parse_module(code)
+        functions.extend(collect_decorated_functions(module))
+        per_file[filename] = best_of(
+            repeat, partial(transform_module, config, filename, module)
+        )
+
+    results = {
+        "files/count": float(len(files)),
+        "files/parse_total": parse_total,
+        "UnasyncifyMethodCommand/total": sum(per_file.values()),
+        "UnasyncifyMethodCommand/max_per_file": max(per_file.values(), default=0.0),
+    }
+    slowest = sorted(per_file.items(), key=lambda item: item[1], reverse=True)
+    for filename, duration in slowest[:top]:
+        print(f"  {duration * 1000:8.2f}ms  {Path(filename).relative_to(corpus)}")
+
+    def transform_functions():
+        for function in functions:
+            function.visit(UnasyncifyMethod(config))
+
+    results["functions/count"] = float(len(functions))
+    results["UnasyncifyMethod/total"] = best_of(repeat, transform_functions)
+    return results
+
+
+def transform_module(config: Config, filename: str, module: cst.Module) -> str:
+    codemod = UnasyncifyMethodCommand(
+        config=config, context=CodemodContext(filename=filename)
+    )
+    return codemod.transform_module(module).code
+
+
+def collect_decorated_functions(module: cst.Module) -> list[cst.FunctionDef]:
+    class Collector(cst.CSTVisitor):
+        def __init__(self):
+            self.functions = []
+
+        def visit_FunctionDef(self, node):
+            if node.decorators and has_unasync_markers_in(node):
+                self.functions.append(node)
+
+    collector = Collector()
+    module.visit(collector)
+    return collector.functions
+
+
+def has_unasync_markers_in(node: cst.FunctionDef) -> bool:
+    decorator = node.decorators[0].decorator
+    if isinstance(decorator, cst.Call):
+        decorator = decorator.func
+    return isinstance(decorator, cst.Name) and decorator.value == "generate_unasynced"
+
+
+def compare_to_baseline(
+    results: dict[str, float], baseline: dict[str, float], tolerance: float
+) -> list[str]:
+    regressions = []
+    for name, value in results.items():
+        if name.endswith("/count") or name not in baseline:
+            continue
+        reference = baseline[name]
+        ratio = value / reference if reference else 1.0
+        marker = ""
+        if ratio > 1 + tolerance:
+            marker = "  <-- REGRESSION"
+            regressions.append(name)
+        print(
+            f"{name:40} {value:9.4f}s  (baseline {reference:9.4f}s, x{ratio:.2f}){marker}"
+        )
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = ArgumentParser(description="Benchmark django-unasyncify")
+    parser.add_argument("--modules", type=int, default=CorpusSpec.modules)
+    parser.add_argument("--marked-share", type=float, default=CorpusSpec.marked_share)
+    parser.add_argument("--depth", type=int, default=CorpusSpec.depth)
+    parser.add_argument("--large-modules", type=int, default=CorpusSpec.large_modules)
+    parser.add_argument("--seed", type=int, default=CorpusSpec.seed)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--top", type=int, default=5, help="Slowest files to show")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--output", type=Path, help="Write results as JSON here")
+    args = parser.parse_args(argv)
+
+    spec = CorpusSpec(
+        modules=args.modules,
+        marked_share=args.marked_share,
+        depth=args.depth,
+        large_modules=args.large_modules,
+        seed=args.seed,
+    )
+    with tempfile.TemporaryDirectory() as tmpdir:
+        corpus = generate_corpus(Path(tmpdir) / "corpus", spec)
+        print(f"Generated corpus: {asdict(spec)}")
+        print("Slowest files:")
+        results = bench_files(corpus, args.repeat, args.top)
+        results.update(bench_cli(corpus, Path(tmpdir), args.repeat))
+
+    report = {"spec": asdict(spec), "results": results}
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2, sort_keys=True))
+
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(report, indent=2, sort_keys=True) + "\n")
+        print(f"Saved baseline to {args.baseline}")
+        return 0
+
+    baseline = None
+    if args.baseline.exists():
+        baseline = json.loads(args.baseline.read_text())
+        if baseline["spec"] != asdict(spec):
+            print("Baseline was recorded with a different corpus, not comparing.")
+            baseline = None
+
+    if baseline is None:
+        for name, value in results.items():
+            print(f"{name:40} {value:9.4f}")
+        return 0
+
+    regressions = compare_to_baseline(results, baseline["results"], args.tolerance)
+    if regressions:
+        print(f"{len(regressions)} measurement(s) regressed: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
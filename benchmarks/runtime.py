@@ -0,0 +1,339 @@
+"""
+Runtime benchmarks for generated code
+
+The code generated by django-unasyncify is meant to cost nothing at
+runtime: the sync variant is plain sync code. This measures it, by running
+the decorated functions of a small ORM-like stand-in for Django (backed by
+an in-memory SQLite database) three ways:
+
+- ``sync``: the generated sync variant
+- ``async_to_sync``: a hand-written ``async_to_sync(self.afunc)()``
+  wrapper, the way sync variants are usually written by hand (needs
+  asgiref, skipped otherwise)
+- ``async``: the async original, awaited from within a running event loop
+
+and reporting the time each call takes, along with the peak memory
+allocated during a call (as seen by tracemalloc).
+
+Run from the repository root with::
+
+    python -m benchmarks.runtime
+    python -m benchmarks.runtime --rows 10000 --calls 500
+"""
+
+import asyncio
+import json
+import sqlite3
+import sys
+import time
+import tracemalloc
+from argparse import ArgumentParser
+from collections.abc import Callable
+from functools import partial
+from pathlib import Path
+from types import ModuleType
+from typing import Any
+
+from django_unasyncify.api import unasyncify_source
+from django_unasyncify.config import Config
+from django_unasyncify.index import sync_function_name
+
+# the unasync helpers, as found in a project's codegen file
+HELPERS_IMPORT_PATH = "django_unasyncify._codegen"
+
+STAND_IN = f"""\
+from {HELPERS_IMPORT_PATH} import from_codegen, generate_unasynced
+
+
+class Connection:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def execute(self, sql, params=()):
+        return self.connection.execute(sql, params)
+
+    async def aexecute(self, sql, params=()):
+        # Django's async ORM hands queries over to a thread, the stand-in
+        # runs them right away so that we only measure the calling overhead
+        return self.connection.execute(sql, params)
+
+
+class QuerySet:
+    def __init__(self, connection, where="1", params=()):
+        self.connection = connection
+        self.where = where
+        self.params = params
+
+    # like with Django querysets, `async for row in queryset` becomes
+    # `for row in queryset` in sync variants
+    def __iter__(self):
+        return self.iterator()
+
+    def __aiter__(self):
+        return self.aiterator()
+
+    def filter(self, **lookups):
+        where = " AND ".join(f"{{name}} = ?" for name in lookups)
+        return QuerySet(
+            self.connection,
+            f"({{self.where}}) AND {{where}}",
+            self.params + tuple(lookups.values()),
+        )
+
+    @generate_unasynced
+    async def acount(self):
+        cursor = await self.connection.aexecute(
+            f"SELECT COUNT(*) FROM rows WHERE {{self.where}}", self.params
+        )
+        return cursor.fetchone()[0]
+
+    @generate_unasynced
+    async def aexists(self):
+        cursor = await self.connection.aexecute(
+            f"SELECT 1 FROM rows WHERE {{self.where}} LIMIT 1", self.params
+        )
+        return cursor.fetchone() is not None
+
+    @generate_unasynced
+    async def aget(self, pk):
+        cursor = await self.filter(id=pk).aexecute_query()
+        row = cursor.fetchone()
+        if row is None:
+            raise LookupError(pk)
+        return Row(*row)
+
+    @generate_unasynced
+    async def aexecute_query(self, limit=-1):
+        return await self.connection.aexecute(
+            f"SELECT id, name, value FROM rows WHERE {{self.where}} LIMIT ?",
+            self.params + (limit,),
+        )
+
+    @generate_unasynced
+    async def aiterator(self, chunk_size=100):
+        cursor = await self.aexecute_query()
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                return
+            for row in rows:
+                yield Row(*row)
+
+    @generate_unasynced
+    async def aall(self, limit=100):
+        rows = []
+        async for row in self:
+            if len(rows) == limit:
+                break
+            rows.append(row)
+        return rows
+
+    @generate_unasynced
+    async def atotal(self):
+        total = 0
+        async for row in self:
+            total += row.value
+        return total
+
+
+class Row:
+    __slots__ = ("id", "name", "value")
+
+    def __init__(self, id, name, value):
+        self.id = id
+        self.name = name
+        self.value = value
+
+    def __eq__(self, other):
+        return (self.id, self.name, self.value) == (other.id, other.name, other.value)
+"""
+
+# async function -> arguments, for every function we measure
+CASES: dict[str, tuple[Any, ...]] = {
+    "acount": (),
+    "aexists": (),
+    "aget": (42,),
+    "aall": (100,),
+    "atotal": (),
+}
+
+
+def load_stand_in() -> ModuleType:
+    """
+    Generate the sync variants of the stand-in, and import the result
+    """
+    code = unasyncify_source(
+        STAND_IN, Config(unasync_helpers_import_path=HELPERS_IMPORT_PATH)
+    )
+    module = ModuleType("runtime_stand_in")
+    exec(compile(code, "<runtime_stand_in>", "exec"), module.__dict__)
+    return module
+
+
+def create_database(rows: int) -> sqlite3.Connection:
+    connection = sqlite3.connect(":memory:", check_same_thread=False)
+    connection.execute(
+        "CREATE TABLE rows (id INTEGER PRIMARY KEY, name TEXT, value INTEGER)"
+    )
+    connection.executemany(
+        "INSERT INTO rows VALUES (?, ?, ?)",
+        ((i, f"row {i}", i % 7) for i in range(1, rows + 1)),
+    )
+    return connection
+
+
+def measure_sync(
+    call: Callable[[], object], calls: int, repeat: int
+) -> tuple[float, int]:
+    """
+    (seconds per call, peak bytes allocated during a call)
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(calls):
+            call()
+        best = min(best, (time.perf_counter() - start) / calls)
+    tracemalloc.start()
+    try:
+        peak = 0
+        for _ in range(min(calls, 10)):
+            tracemalloc.reset_peak()
+            baseline, _ = tracemalloc.get_traced_memory()
+            call()
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - baseline)
+    finally:
+        tracemalloc.stop()
+    return best, peak
+
+
+def measure_async(
+    call: Callable[[], Any], calls: int, repeat: int
+) -> tuple[float, int]:
+    """
+    Like measure_sync, for a coroutine function awaited within an event loop
+    """
+
+    async def measure() -> tuple[float, int]:
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for _ in range(calls):
+                await call()
+            best = min(best, (time.perf_counter() - start) / calls)
+        tracemalloc.start()
+        try:
+            peak = 0
+            for _ in range(min(calls, 10)):
+                tracemalloc.reset_peak()
+                baseline, _ = tracemalloc.get_traced_memory()
+                await call()
+                peak = max(peak, tracemalloc.get_traced_memory()[1] - baseline)
+        finally:
+            tracemalloc.stop()
+        return best, peak
+
+    return asyncio.run(measure())
+
+
+def async_to_sync_wrapper() -> (
+    Callable[[Callable[..., Any]], Callable[..., Any]] | None
+):
+    try:
+        from asgiref.sync import async_to_sync
+    except ImportError:
+        return None
+    return async_to_sync
+
+
+def call_through(
+    async_to_sync: Callable[[Callable[..., Any]], Callable[..., Any]],
+    async_function: Callable[..., Any],
+    *args: Any,
+) -> Any:
+    return async_to_sync(async_function)(*args)
+
+
+def run_benchmarks(rows: int, calls: int, repeat: int) -> dict[str, dict[str, Any]]:
+    """
+    Measure every case, returning {function: {variant: {"seconds", "peak_bytes"}}}
+    """
+    module = load_stand_in()
+    queryset = module.QuerySet(module.Connection(create_database(rows)))
+    async_to_sync = async_to_sync_wrapper()
+
+    results: dict[str, dict[str, Any]] = {}
+    for name, args in CASES.items():
+        sync_name = sync_function_name(name)
+        assert sync_name is not None, name
+        async_function = getattr(queryset, name)
+        sync_function = getattr(queryset, sync_name)
+        # both variants have to agree before we compare them
+        expected = asyncio.run(async_function(*args))
+        assert sync_function(*args) == expected, name
+
+        variants: dict[str, Any] = {}
+        seconds, peak = measure_sync(partial(sync_function, *args), calls, repeat)
+        variants["sync"] = {"seconds": seconds, "peak_bytes": peak}
+        if async_to_sync is not None:
+            # hand-written sync variants wrap the async function on every call
+            seconds, peak = measure_sync(
+                partial(call_through, async_to_sync, async_function, *args),
+                calls,
+                repeat,
+            )
+            variants["async_to_sync"] = {"seconds": seconds, "peak_bytes": peak}
+        seconds, peak = measure_async(partial(async_function, *args), calls, repeat)
+        variants["async"] = {"seconds": seconds, "peak_bytes": peak}
+        results[name] = variants
+    return results
+
+
+def print_results(results: dict[str, dict[str, Any]]) -> None:
+    variants = ["sync", "async_to_sync", "async"]
+    header = f"{'function':12}" + "".join(f"{variant:>26}" for variant in variants)
+    print(header)
+    for name, measured in results.items():
+        cells = []
+        for variant in variants:
+            if variant not in measured:
+                cells.append(f"{'skipped':>26}")
+                continue
+            seconds = measured[variant]["seconds"]
+            peak = measured[variant]["peak_bytes"]
+            ratio = seconds / measured["sync"]["seconds"]
+            cells.append(f"{seconds * 1e6:9.1f}us x{ratio:5.2f} {peak / 1024:6.1f}KiB")
+        print(f"{name:12}" + "".join(cells))
+    print(
+        "Times are per call (best of the repeats), relative to the generated "
+        "sync variant. Memory is the peak allocated during a call."
+    )
+    if not any("async_to_sync" in measured for measured in results.values()):
+        print("async_to_sync was skipped, install asgiref to measure it.")
+
+
+def main(argv=None) -> int:
+    parser = ArgumentParser(
+        description="Compare generated sync code to async_to_sync wrappers"
+    )
+    parser.add_argument("--rows", type=int, default=1000, help="Rows in the table")
+    parser.add_argument("--calls", type=int, default=1000, help="Calls per repeat")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", type=Path, help="Write results as JSON here")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.rows, args.calls, args.repeat)
+    print_results(results)
+    if args.output:
+        report = {
+            "rows": args.rows,
+            "calls": args.calls,
+            "python": sys.version.split()[0],
+            "results": results,
+        }
+        args.output.write_text(json.dumps(report, indent=2, sort_keys=True))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
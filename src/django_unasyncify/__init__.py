@@ -2,19 +2,26 @@ def hello() -> str:
     return "Hello from django-unasyncify!"
 
 
-def from_codegen(f):
+def from_codegen(f=None, src_hash=None):
     """
     This indicates that the function was gotten from codegen, and
     should not be directly modified
+
+    src_hash is a fingerprint of the code it was generated from
     """
+    # @from_codegen(src_hash=...)
+    if f is None:
+        return lambda f: f
     return f
 
 
-def generate_unasynced(async_unsafe=False):
+def generate_unasynced(async_unsafe=False, internal=False):
     """
     This indicates we should unasync this function/method
 
-    async_unsafe indicates whether to add the async_unsafe decorator
+    async_unsafe indicates whether to add the async_unsafe decorator,
+    internal marks functions only called from other generated code,
+    that don't need the decorator of their own
     """
 
     def wrapper(f):
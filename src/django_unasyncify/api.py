@@ -0,0 +1,71 @@
+"""
+Transforming source code in memory
+
+Unlike the command line, nothing here touches the filesystem (the unasync
+helpers file isn't written out, the cache isn't used) or starts up any
+processes, so this is meant to be embedded in other tools, like build
+hooks or test fixtures.
+"""
+
+from collections.abc import Iterable, Iterator
+
+import libcst as cst
+from libcst.codemod import CodemodContext
+
+from .codemod import UnasyncifyMethodCommand
+from .config import Config
+from .discovery import contains_marker
+from .index import SymbolIndex
+
+
+class SourceTransformer:
+    """
+    Transforms source code, reusing the same codemod between calls
+    """
+
+    codemod: UnasyncifyMethodCommand
+
+    def __init__(
+        self, config: Config | None = None, symbol_index: SymbolIndex | None = None
+    ) -> None:
+        self.codemod = UnasyncifyMethodCommand(
+            context=CodemodContext(),
+            config=config if config is not None else Config(),
+            symbol_index=symbol_index,
+        )
+
+    def transform(self, code: str, filename: str | None = None) -> str:
+        # like when running over a project, code without our
+        # decorators doesn't even need to be parsed
+        if not contains_marker(code.encode("utf-8")):
+            return code
+        self.codemod.context = CodemodContext(filename=filename)
+        return self.codemod.transform_module(cst.parse_module(code)).code
+
+
+def unasyncify_source(
+    code: str,
+    config: Config | None = None,
+    symbol_index: SymbolIndex | None = None,
+) -> str:
+    """
+    Return code, with sync variants of its @generate_unasynced functions
+    (re)generated
+
+    Raises libcst.ParserSyntaxError if code can't be parsed.
+    """
+    return SourceTransformer(config, symbol_index).transform(code)
+
+
+def unasyncify_many(
+    sources: Iterable[str],
+    config: Config | None = None,
+    symbol_index: SymbolIndex | None = None,
+) -> Iterator[str]:
+    """
+    Transform many pieces of source code (see unasyncify_source), yielding
+    the results in order
+    """
+    transformer = SourceTransformer(config, symbol_index)
+    for code in sources:
+        yield transformer.transform(code)
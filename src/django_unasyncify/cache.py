@@ -0,0 +1,152 @@
+"""
+A persistent record of files that are already up to date
+
+After a successful run, every transformed file holds exactly what
+django-unasyncify would generate for it. We remember a hash of
+those contents, so that the next run can skip any file that
+hasn't been touched since.
+"""
+
+import hashlib
+import json
+import os
+import functools
+from pathlib import Path
+
+from .config import Config
+
+CACHE_FILENAME = "files.json"
+
+
+@functools.cache
+def tool_fingerprint() -> str:
+    """
+    A digest of django-unasyncify's own code
+
+    Unlike the package version, this also changes when working off of a
+    development checkout. (It's also much quicker to get than the version,
+    as importlib.metadata takes a while to import.)
+    """
+    package_dir = Path(__file__).parent
+    digest = hashlib.sha256()
+    for source in sorted(package_dir.glob("*.py")):
+        digest.update(source.name.encode("utf-8"))
+        digest.update(source.read_bytes())
+    return digest.hexdigest()
+
+
+def content_digest(contents: bytes) -> str:
+    return hashlib.sha256(contents).hexdigest()
+
+
+def file_digest(filename: str) -> str:
+    with open(filename, "rb") as f:
+        return content_digest(f.read())
+
+
+def project_entry_name(filename: str, project_base: str) -> str:
+    """
+    The path of filename relative to (the absolute) project_base
+
+    We store paths relative to the project, so that things stay
+    valid if the project is moved around.
+    """
+    absolute = os.path.abspath(filename)
+    # os.path.relpath is slow enough to show up when checking whole projects
+    if absolute.startswith(project_base + os.sep):
+        return absolute[len(project_base) + 1 :]
+    return os.path.relpath(absolute, project_base)
+
+
+class TransformCache:
+    """
+    Maps files to the digest of their contents as of the last run
+
+    The cache is only valid for a single config fingerprint and version
+    of django-unasyncify. If either of those change, we start over from scratch.
+    """
+
+    cache_dir: Path
+    project_base: Path
+    key: str
+    entries: dict[str, str]
+    # whether entries changed since they were loaded
+    modified: bool
+
+    def __init__(self, cache_dir: Path, project_base: Path, key: str) -> None:
+        self.cache_dir = cache_dir
+        self.project_base = project_base
+        self.key = key
+        self.entries = {}
+        self.modified = False
+        self._absolute_base = str(project_base.absolute())
+
+    @classmethod
+    def for_config(cls, config: Config) -> "TransformCache":
+        key = f"{tool_fingerprint()}:{config.fingerprint()}"
+        cache = cls(config.cache_path(), config.project_base, key)
+        cache.load()
+        return cache
+
+    @property
+    def cache_file(self) -> Path:
+        return self.cache_dir / CACHE_FILENAME
+
+    def load(self) -> None:
+        try:
+            with self.cache_file.open("rb") as f:
+                data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            # no cache (or a corrupted one), so nothing is known
+            # to be up to date
+            return
+        if data.get("key") == self.key:
+            self.entries = data.get("files", {})
+
+    def _entry_name(self, filename: str) -> str:
+        return project_entry_name(filename, self._absolute_base)
+
+    def is_up_to_date(self, filename: str, digest: str | None = None) -> bool:
+        recorded = self.entries.get(self._entry_name(filename))
+        if recorded is None:
+            return False
+        if digest is None:
+            try:
+                digest = file_digest(filename)
+            except FileNotFoundError:
+                return False
+        return recorded == digest
+
+    def record(self, filename: str, digest: str | None = None) -> None:
+        if digest is None:
+            digest = file_digest(filename)
+        entry = self._entry_name(filename)
+        if self.entries.get(entry) != digest:
+            self.entries[entry] = digest
+            self.modified = True
+
+    def forget(self, filename: str) -> None:
+        if self.entries.pop(self._entry_name(filename), None) is not None:
+            self.modified = True
+
+    def save(self) -> None:
+        if not self.modified and self.cache_file.exists():
+            return
+        # drop entries for files that no longer exist
+        self.entries = {
+            name: digest
+            for name, digest in self.entries.items()
+            if (self.project_base / name).exists()
+        }
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        gitignore = self.cache_dir / ".gitignore"
+        if not gitignore.exists():
+            gitignore.write_text("# created by django-unasyncify\n*\n")
+
+        # write to a temporary file first, so that an interrupted
+        # run never leaves a half-written cache behind
+        tmp_file = self.cache_file.with_suffix(".tmp")
+        with tmp_file.open("w") as f:
+            json.dump({"key": self.key, "files": self.entries}, f, sort_keys=True)
+        os.replace(tmp_file, self.cache_file)
+        self.modified = False
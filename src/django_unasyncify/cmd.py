@@ -1,40 +1,459 @@
-from argparse import ArgumentParser
+import os
+import time
+from argparse import ArgumentParser, Namespace
+from collections.abc import Sequence
+from dataclasses import dataclass, replace
+from typing import TYPE_CHECKING
 
-from django_unasyncify.codemod import UnasyncifyMethodCommand
-from django_unasyncify.scaffolding import ensure_codegen_template
-from .config import Config
-
-from libcst.codemod import (
-    CodemodContext,
-    parallel_exec_transform_with_prettyprint,
-    gather_files,
+from django_unasyncify.cache import TransformCache
+from django_unasyncify.discovery import (
+    Exclusions,
+    filter_marked_files,
+    gather_python_files,
+    git_changed_files,
+    restrict_to_paths,
+)
+from django_unasyncify.index import SymbolIndex
+from django_unasyncify.progress import Progress
+from django_unasyncify.profiling import (
+    PhaseTimer,
+    build_report,
+    merge_profile_stats,
+    write_report,
 )
+from django_unasyncify.scaffolding import (
+    codegen_template_is_current,
+    ensure_codegen_template,
+)
+from .config import Config, find_project_paths
+
+# Note that libcst (and so, anything importing it) is only imported once we
+# know there's work to do, as importing it makes up most of the time spent
+# when everything is already up to date.
+if TYPE_CHECKING:
+    from django_unasyncify.runner import FileResult
 
 parser = ArgumentParser(
     prog="django-unasyncify",
     description="Unasyncify some of your code",
 )
 
-parser.add_argument("-p", "--project", required=True)
+parser.add_argument(
+    "files",
+    nargs="*",
+    metavar="FILE",
+    help="Only transform these files (files outside of paths_to_visit are ignored)",
+)
+parser.add_argument(
+    "-p",
+    "--project",
+    dest="projects",
+    action="append",
+    metavar="PATH",
+    help="The directory holding the project's pyproject.toml (defaults to the "
+    "current directory), can be repeated to run over several projects at once",
+)
+parser.add_argument(
+    "--all-projects",
+    metavar="ROOT",
+    help="Run over every project (with a [tool.django_unasyncify] section in "
+    "its pyproject.toml) found under ROOT",
+)
+parser.add_argument(
+    "-j",
+    "--jobs",
+    type=int,
+    metavar="N",
+    help="How many worker processes to use (defaults to the number of CPUs)",
+)
+parser.add_argument(
+    "--since",
+    metavar="REV",
+    help="Only transform files changed since this git revision, or not committed yet",
+)
+parser.add_argument(
+    "--engine",
+    choices=("libcst", "fast"),
+    default="libcst",
+    help="How to transform files: libcst parses whole files, fast only the "
+    "decorated functions in them (falling back to libcst when needed)",
+)
+parser.add_argument(
+    "--timeout",
+    type=float,
+    metavar="SECONDS",
+    help="Skip (and report) files that take longer than this to transform",
+)
+parser.add_argument(
+    "--progress",
+    action="store_true",
+    help="Report progress even when not running in a terminal",
+)
+parser.add_argument(
+    "--no-cache",
+    action="store_true",
+    help="Transform every file, even the ones known to be up to date",
+)
+parser.add_argument(
+    "--watch",
+    action="store_true",
+    help="Keep running, regenerating code whenever a file is saved",
+)
+parser.add_argument(
+    "--server",
+    action="store_true",
+    help="Keep running, answering JSON-RPC transform requests (one per line) "
+    "on stdin, without writing anything",
+)
+parser.add_argument(
+    "--check",
+    action="store_true",
+    help="Don't write anything, but exit with an error if any file would change",
+)
+parser.add_argument(
+    "--report-redundant-guards",
+    action="store_true",
+    help="List generated functions whose async_unsafe guard is already "
+    "checked by all of their callers",
+)
+parser.add_argument(
+    "--profile",
+    metavar="REPORT_PATH",
+    help="Write a JSON report of where time was spent during the run",
+)
+parser.add_argument(
+    "--profile-top",
+    metavar="N",
+    type=int,
+    default=10,
+    help="How many of the slowest files to list in the profiling report",
+)
+parser.add_argument(
+    "--cprofile",
+    metavar="STATS_PATH",
+    help="Run under cProfile, and write the (pstats-compatible) results here",
+)
 
 
-def main(config: Config | None = None):
+def report_out_of_date(configs: Sequence[Config], results: list["FileResult"]) -> bool:
+    """
+    Tell the user about files that would change (for --check)
+
+    Returns whether anything is out of date
+    """
+    out_of_date = [result.filename for result in results if result.changed]
+    for config in reversed(configs):
+        if not codegen_template_is_current(config.codegen_template_path()):
+            out_of_date.insert(0, str(config.codegen_template_path()))
+
+    for filename in out_of_date:
+        print(f"Would regenerate {filename}")
+    if out_of_date:
+        print(
+            f"{len(out_of_date)} file(s) are out of date. "
+            "Run django-unasyncify to update them."
+        )
+    return bool(out_of_date)
+
+
+def report_redundant_guards(config: Config) -> None:
+    """
+    Tell the user about async_unsafe guards that could be dropped
+    (for --report-redundant-guards)
+    """
+    from django_unasyncify.guards import find_redundant_guards
+
+    redundant = find_redundant_guards(
+        gather_python_files(config.paths_to_visit, Exclusions.for_config(config))
+    )
+    for guard in redundant:
+        print(
+            f"{guard.filename}:{guard.line}: {guard.function} is only called "
+            f"from guarded functions ({', '.join(guard.callers)})"
+        )
+    if redundant:
+        print(
+            f"{len(redundant)} guard(s) are redundant. Mark the functions "
+            "generating them with @generate_unasynced(async_unsafe=True, "
+            "internal=True), unless they are called from outside of the project."
+        )
+    else:
+        print("No redundant guards found.")
+
+
+@dataclass
+class ProjectRun:
+    """
+    One of the projects taking part in a run
+    """
+
+    config: Config
+    cache: TransformCache | None
+    symbol_index: SymbolIndex
+    files_to_visit: list[str]
+    changed: int = 0
+    failed: int = 0
+
+
+def load_configs(args: Namespace) -> list[Config]:
+    """
+    The configs of every project we were asked to run over
+    """
+    project_paths = list(args.projects or [])
+    if args.all_projects is not None:
+        found = find_project_paths(args.all_projects)
+        if not found:
+            parser.error(f"No projects found under {args.all_projects}")
+        project_paths += [str(path) for path in found]
+    if not project_paths:
+        project_paths = ["."]
+    # the same project can be found more than once
+    unique_paths = {os.path.realpath(path): path for path in project_paths}
+    return [Config.from_project_path(path) for path in unique_paths.values()]
+
+
+def prepare_project(config: Config, args: Namespace, timer: PhaseTimer) -> ProjectRun:
+    """
+    Find the files of a project that need transforming
+    """
+    if not args.check:
+        # place the codegen template
+        ensure_codegen_template(config.codegen_template_path())
+
+    cache = None if args.no_cache else TransformCache.for_config(config)
+    with timer.phase("discovery"):
+        exclusions = Exclusions.for_config(config)
+        # the files we were asked to look at, if any
+        selected_files: list[str] | None = None
+        if args.files or args.since:
+            selected_files = list(args.files)
+            if args.since:
+                try:
+                    selected_files += git_changed_files(
+                        str(config.project_base), args.since
+                    )
+                except ValueError as e:
+                    parser.error(str(e))
+            selected_files = restrict_to_paths(
+                selected_files, config.paths_to_visit, exclusions
+            )
+            python_files = selected_files
+        else:
+            python_files = gather_python_files(config.paths_to_visit, exclusions)
+    with timer.phase("indexing"):
+        symbol_index = SymbolIndex.for_config(config, persist=cache is not None)
+        if selected_files is not None and symbol_index.files:
+            # assume the rest of the project is still as we last saw it,
+            # a full run will pick up anything we missed
+            changed_names = symbol_index.update(selected_files)
+        elif selected_files is not None:
+            changed_names = symbol_index.refresh(
+                gather_python_files(config.paths_to_visit, exclusions)
+            )
+        else:
+            changed_names = symbol_index.refresh(python_files)
+        if cache is not None:
+            # files awaiting a function whose sync counterpart changed
+            # need to be regenerated, even if they were not touched
+            for filename in symbol_index.referencing(changed_names):
+                cache.forget(filename)
+    with timer.phase("discovery"):
+        # most files don't use our decorators at all, and those can be
+        # skipped without ever parsing them
+        files_to_visit = filter_marked_files(python_files)
+        if cache is not None:
+            files_to_visit = [f for f in files_to_visit if not cache.is_up_to_date(f)]
+    return ProjectRun(config, cache, symbol_index, files_to_visit)
+
+
+def assign_files(projects: list[ProjectRun]) -> None:
+    """
+    Make sure that every file only gets transformed once
+
+    When projects are nested in one another, files are left to the
+    innermost project they belong to.
+    """
+    owners: dict[str, ProjectRun] = {}
+    for project in projects:
+        depth = len(project.config.project_base.resolve().parts)
+        for filename in project.files_to_visit:
+            key = os.path.realpath(filename)
+            owner = owners.get(key)
+            if owner is None or depth > len(owner.config.project_base.resolve().parts):
+                owners[key] = project
+    for project in projects:
+        project.files_to_visit = [
+            filename
+            for filename in project.files_to_visit
+            if owners[os.path.realpath(filename)] is project
+        ]
+
+
+def main(
+    config: Config | Sequence[Config] | None = None,
+    argv: Sequence[str] | None = None,
+) -> int:
     """
     Run django-unasyncify
 
-    If config is not provided, parse from the command line
+    If config (or a list of configs, to run over several projects at
+    once) is not provided, parse from the command line
     """
-    if not config:
-        args = parser.parse_args()
-        config = Config.from_project_path(args.project)
+    if config is not None and argv is None:
+        # we were called programmatically, don't look at sys.argv
+        argv = []
+    args = parser.parse_args(argv)
+    if args.check and args.watch:
+        parser.error("--check and --watch can't be used together")
+    if args.jobs is not None and args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    if args.timeout is not None and args.timeout <= 0:
+        parser.error("--timeout must be positive")
+    if config is None:
+        configs = load_configs(args)
+    elif isinstance(config, Config):
+        configs = [config]
+    else:
+        configs = list(config)
+    if args.watch and len(configs) > 1:
+        parser.error("--watch only works with a single project")
+    if args.server:
+        if args.check or args.watch or len(configs) > 1:
+            parser.error("--server only works with a single project, on its own")
+        from django_unasyncify.server import serve
 
-    # place the codegen template
-    ensure_codegen_template(config.codegen_template_path())
-    codemod = UnasyncifyMethodCommand(config=config, context=CodemodContext())
+        (config,) = configs
+        # the index is loaded from the cache, but never saved
+        symbol_index = SymbolIndex.for_config(config)
+        symbol_index.refresh(
+            gather_python_files(config.paths_to_visit, Exclusions.for_config(config))
+        )
+        serve(config, symbol_index)
+        return 0
 
+    start_time = time.perf_counter()
+    timer = PhaseTimer()
     print("About to run transform...")
-    files_to_visit = gather_files(config.paths_to_visit)
-    parallel_exec_transform_with_prettyprint(
-        codemod, files_to_visit, repo_root=str(config.project_base)
-    )
+    projects = [prepare_project(config, args, timer) for config in configs]
+    if len(projects) > 1:
+        assign_files(projects)
+    files_to_visit = [f for project in projects for f in project.files_to_visit]
+    if not args.no_cache:
+        print(f"{len(files_to_visit)} file(s) to transform.")
+
+    results: list[FileResult] = []
+    failures = 0
+    if files_to_visit:
+        from django_unasyncify.runner import (
+            ProjectBatch,
+            RunOptions,
+            report_result,
+            run_batches,
+        )
+
+        options = RunOptions(
+            write=not args.check,
+            profile=args.profile is not None,
+            cprofile=args.cprofile is not None,
+            timeout=args.timeout,
+            engine=args.engine,
+        )
+        batches = [
+            ProjectBatch(
+                project.config,
+                project.files_to_visit,
+                replace(options, repo_root=str(project.config.project_base)),
+                project.symbol_index,
+            )
+            for project in projects
+        ]
+        owners = {
+            filename: project
+            for project in projects
+            for filename in project.files_to_visit
+        }
+        progress = Progress(len(files_to_visit), log=args.progress)
+        # every project shares the same workers
+        for result in run_batches(batches, jobs=args.jobs):
+            # results are only held on to when we need them at the end
+            if options.profile or options.cprofile or (args.check and result.changed):
+                results.append(result)
+            # in check mode, report_out_of_date lists changed files at the end
+            if (result.changed and options.write) or result.error is not None:
+                progress.clear()
+                report_result(result)
+            progress.advance()
+            project = owners[result.filename]
+            cache = project.cache
+            if result.error is not None:
+                failures += 1
+                project.failed += 1
+                if cache is not None:
+                    cache.forget(result.filename)
+            else:
+                project.changed += result.changed
+                if cache is not None and (options.write or not result.changed):
+                    # the file now holds exactly what we would generate
+                    cache.record(result.filename)
+        progress.finish()
+
+    for project in projects:
+        # --check doesn't write anything, the cache included
+        if project.cache is not None and not args.check:
+            project.cache.save()
+            # only once the cache is saved, so that an interrupted run
+            # doesn't lose track of the files that need to be regenerated
+            project.symbol_index.save()
+    if len(projects) > 1:
+        for project in projects:
+            print(
+                f"{project.config.project_base}: "
+                f"{len(project.files_to_visit)} file(s) transformed, "
+                f"{project.changed} changed, {project.failed} failed"
+            )
+
+    if args.profile is not None:
+        report = build_report(
+            results,
+            timer.timings,
+            wall_time=time.perf_counter() - start_time,
+            top=args.profile_top,
+        )
+        write_report(report, args.profile)
+        print(f"Wrote profiling report to {args.profile}")
+    if args.cprofile is not None:
+        stats = merge_profile_stats(
+            [r.profile_stats for r in results if r.profile_stats is not None]
+        )
+        if stats is not None:
+            stats.dump_stats(args.cprofile)
+            print(f"Wrote cProfile data to {args.cprofile}")
+
+    if args.report_redundant_guards:
+        for config in configs:
+            report_redundant_guards(config)
+
+    if args.check:
+        out_of_date = report_out_of_date(configs, results)
+        return 1 if (out_of_date or failures) else 0
     print("Done.")
+
+    if args.watch:
+        from libcst.codemod import CodemodContext
+
+        from django_unasyncify.codemod import UnasyncifyMethodCommand
+        from django_unasyncify.watch import Watcher
+
+        (project,) = projects
+        codemod = UnasyncifyMethodCommand(
+            config=project.config,
+            context=CodemodContext(),
+            symbol_index=project.symbol_index,
+        )
+        Watcher(
+            project.config,
+            codemod,
+            cache=project.cache,
+            symbol_index=project.symbol_index,
+        ).run()
+    return 1 if failures else 0
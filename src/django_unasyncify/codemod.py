@@ -1,7 +1,10 @@
 from libcst import EmptyLine, FunctionDef, Name, Decorator
 from libcst.helpers import get_full_name_for_node
 
+import hashlib
 from collections import namedtuple
+from collections.abc import Iterator, Sequence
+from contextlib import AbstractContextManager, nullcontext
 from typing import cast
 
 import libcst as cst
@@ -10,25 +13,275 @@ from libcst.codemod import CodemodContext, VisitorBasedCodemodCommand
 from libcst.codemod.visitors import AddImportsVisitor
 
 from django_unasyncify.config import Config
-from .transform import UnasyncifyMethod
+from .cache import tool_fingerprint
+from .index import SymbolIndex, sync_function_name
+from .profiling import PhaseTimer
+from .transform import UnasyncifyMethod, is_indexed_call
 
-DecoratorInfo = namedtuple("DecoratorInfo", ["from_codegen", "unasync", "async_unsafe"])
+DecoratorInfo = namedtuple(
+    "DecoratorInfo", ["from_codegen", "unasync", "async_unsafe", "internal"]
+)
+
+# the keyword arguments generate_unasynced accepts (all of them flags)
+GENERATE_UNASYNCED_KEYWORDS = ("async_unsafe", "internal")
+
+# how many hex digits of the source fingerprint go in @from_codegen(src_hash=...)
+SRC_HASH_LENGTH = 16
+
+# the nodes that can hold statements (and so, function definitions)
+STATEMENT_CONTAINERS = (
+    cst.BaseCompoundStatement,
+    cst.BaseSuite,
+    cst.Else,
+    cst.ExceptHandler,
+    cst.ExceptStarHandler,
+    cst.Finally,
+    cst.MatchCase,
+)
+
+
+def nested_blocks(node: cst.CSTNode) -> Iterator[cst.CSTNode]:
+    """
+    The statements and blocks held directly by a node
+    """
+    for attr in ("body", "handlers", "orelse", "finalbody", "cases"):
+        value = getattr(node, attr, None)
+        if isinstance(value, Sequence):
+            yield from value
+        elif value is not None:
+            yield value
+
+
+def is_marked_function(node: FunctionDef) -> bool:
+    """
+    Whether this function is one we act on (see decorator_info)
+    """
+    if not node.decorators:
+        return False
+    decorator = node.decorators[0].decorator
+    if isinstance(decorator, cst.Call):
+        decorator = decorator.func
+    return isinstance(decorator, Name) and decorator.value in (
+        "generate_unasynced",
+        "from_codegen",
+    )
+
+
+def is_from_codegen(decorator: Decorator) -> bool:
+    """
+    Whether this is @from_codegen (or @from_codegen(src_hash=...))
+    """
+    node = decorator.decorator
+    if isinstance(node, cst.Call):
+        node = node.func
+    return isinstance(node, Name) and node.value == "from_codegen"
+
+
+def stored_src_hash(node: FunctionDef) -> str | None:
+    """
+    The fingerprint recorded on a generated function, if any
+    """
+    for decorator in node.decorators:
+        if is_from_codegen(decorator) and isinstance(decorator.decorator, cst.Call):
+            for arg in decorator.decorator.args:
+                if (
+                    arg.keyword is not None
+                    and arg.keyword.value == "src_hash"
+                    and isinstance(arg.value, cst.SimpleString)
+                ):
+                    value = arg.value.evaluated_value
+                    return value if isinstance(value, str) else None
+    return None
+
+
+def find_existing_imports(module: cst.Module) -> dict[str, set[str | None]]:
+    """
+    Find the names imported by top-level (non-aliased) `from x import y`
+    statements in a module, with `import x` statements recorded as None
+    """
+    imports: dict[str, set[str | None]] = {}
+    for statement in module.body:
+        if not isinstance(statement, cst.SimpleStatementLine):
+            continue
+        for small_statement in statement.body:
+            if isinstance(small_statement, cst.Import):
+                for alias in small_statement.names:
+                    if alias.asname is None:
+                        imports.setdefault(alias.evaluated_name, set()).add(None)
+                continue
+            if (
+                not isinstance(small_statement, cst.ImportFrom)
+                or small_statement.relative
+                or small_statement.module is None
+                or isinstance(small_statement.names, cst.ImportStar)
+            ):
+                continue
+            module_name = get_full_name_for_node(small_statement.module)
+            if module_name is None:
+                continue
+            imports.setdefault(module_name, set()).update(
+                alias.evaluated_name
+                for alias in small_statement.names
+                if alias.asname is None
+            )
+    return imports
+
+
+class ReferencedNames(cst.CSTVisitor):
+    """
+    The names (dotted ones included, like `time.sleep`) used in a tree
+    """
+
+    names: set[str]
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.names = set()
+
+    def visit_Name(self, node: cst.Name) -> None:
+        self.names.add(node.value)
+
+    def visit_Attribute(self, node: cst.Attribute) -> None:
+        name = get_full_name_for_node(node)
+        if name is not None:
+            self.names.add(name)
+
+
+def referenced_names(node: cst.CSTNode) -> set[str]:
+    visitor = ReferencedNames()
+    node.visit(visitor)
+    return visitor.names
+
+
+class IndexedCalls(cst.CSTVisitor):
+    """
+    The names of the functions awaited in a tree that the transform
+    looks up in the symbol index
+    """
+
+    names: set[str]
+    await_depth: int
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.names = set()
+        self.await_depth = 0
+
+    def visit_Await(self, node: cst.Await) -> None:
+        self.await_depth += 1
+
+    def leave_Await(self, original_node: cst.Await) -> None:
+        self.await_depth -= 1
+
+    def visit_Call(self, node: cst.Call) -> None:
+        if self.await_depth == 0 or not is_indexed_call(node.func):
+            return
+        if isinstance(node.func, cst.Attribute):
+            self.names.add(node.func.attr.value)
+        elif isinstance(node.func, cst.Name):
+            self.names.add(node.func.value)
+
+
+def find_marked_subtrees(node: cst.CSTNode, found: set[int]) -> bool:
+    """
+    Collect (the ids of) every statement or block that is, or contains,
+    a marked function. Returns whether node is one of them.
+
+    We only look at statements, without ever going into expressions, so
+    this is much cheaper than a full walk of the tree.
+    """
+    contains_marked = False
+    for child in nested_blocks(node):
+        if isinstance(child, STATEMENT_CONTAINERS):
+            contains_marked |= find_marked_subtrees(child, found)
+    if isinstance(node, FunctionDef) and is_marked_function(node):
+        contains_marked = True
+    if contains_marked:
+        found.add(id(node))
+    return contains_marked
 
 
 class UnasyncifyMethodCommand(VisitorBasedCodemodCommand):
     DESCRIPTION = "Transform async methods to sync ones"
 
     config: Config
+    # set when someone wants to know where time is being spent
+    timer: PhaseTimer | None = None
+    # how many sync variants we generated in the current module
+    functions_generated: int = 0
+    # and how many generated functions were up to date (see function_fingerprints)
+    functions_reused: int = 0
+    # (ids of) statements holding marked functions in the current module
+    marked_subtrees: set[int]
+    # names already imported at the top of the current module, by module
+    existing_imports: dict[str, set[str | None]]
+    symbol_index: SymbolIndex | None
+    # when running over pieces of a module (see splice.py), the imports of
+    # the whole module, and the ones found missing from it (which we can't
+    # add from here)
+    module_imports: dict[str, set[str | None]] | None = None
+    missing_imports: set[tuple[str, str | None]]
 
-    def __init__(self, context: CodemodContext, config: Config) -> None:
+    def __init__(
+        self,
+        context: CodemodContext,
+        config: Config,
+        symbol_index: SymbolIndex | None = None,
+    ) -> None:
         self.config = config
+        self.symbol_index = symbol_index
+        self.marked_subtrees = set()
+        self.existing_imports = {}
+        self.missing_imports = set()
         super().__init__(context)
 
+    def phase(self, name: str) -> AbstractContextManager[None]:
+        if self.timer is None:
+            return nullcontext()
+        return self.timer.phase(name)
+
+    def _instantiate_and_run(self, transform, tree: cst.Module) -> cst.Module:
+        # this is where libcst runs AddImportsVisitor
+        with self.phase("imports"):
+            return super()._instantiate_and_run(transform, tree)
+
+    def require_import(self, module: str, name: str | None = None) -> None:
+        # AddImportsVisitor does a full pass over the module, so we only
+        # ask for it when there's actually something missing
+        if name in self.existing_imports.get(module, ()):
+            return
+        if self.module_imports is not None:
+            self.missing_imports.add((module, name))
+        else:
+            AddImportsVisitor.add_needed_import(self.context, module, name)
+
     def add_codegen_imports(self, *names):
         for name in names:
-            AddImportsVisitor.add_needed_import(
-                self.context, self.config.unasync_helpers_import_path, name
-            )
+            self.require_import(self.config.unasync_helpers_import_path, name)
+
+    def require_reused_imports(
+        self, node: FunctionDef, generated: FunctionDef, decorator_info: DecoratorInfo
+    ) -> None:
+        """
+        Ask for the imports a reused generated function needs, the same
+        ones regenerating it would have asked for (they might have been
+        removed since it was generated)
+        """
+        self.add_codegen_imports("from_codegen", "generate_unasynced")
+        if decorator_info.async_unsafe and not decorator_info.internal:
+            self.require_import("django.utils.asyncio", "async_unsafe")
+        if "IS_ASYNC" in referenced_names(node.body):
+            self.add_codegen_imports("IS_ASYNC")
+        generated_names = referenced_names(generated.body)
+        modules = set()
+        for lowering in self.config.lowerings.values():
+            if lowering == "sleep" and "time.sleep" in generated_names:
+                modules.add("time")
+            module, _, _ = lowering.rpartition(".")
+            if module and lowering in generated_names:
+                modules.add(module)
+        for module in sorted(modules):
+            self.require_import(module)
 
     def label_as_codegen(self, node: FunctionDef, async_unsafe: bool) -> FunctionDef:
         from_codegen_marker = Decorator(decorator=Name("from_codegen"))
@@ -37,21 +290,83 @@ class UnasyncifyMethodCommand(VisitorBasedCodemodCommand):
         decorators_to_add = [from_codegen_marker]
         if async_unsafe:
             async_unsafe_marker = Decorator(decorator=Name("async_unsafe"))
-            AddImportsVisitor.add_needed_import(
-                self.context, "django.utils.asyncio", "async_unsafe"
-            )
+            self.require_import("django.utils.asyncio", "async_unsafe")
             decorators_to_add.append(async_unsafe_marker)
         # we remove generate_unasynced_codegen
         return node.with_changes(decorators=[*decorators_to_add, *node.decorators[1:]])
 
     def codegenned_func(self, node: FunctionDef) -> bool:
-        for decorator in node.decorators:
-            if (
-                isinstance(decorator.decorator, Name)
-                and decorator.decorator.value == "from_codegen"
-            ):
-                return True
-        return False
+        return any(is_from_codegen(decorator) for decorator in node.decorators)
+
+    def source_fingerprint(
+        self, async_node: FunctionDef, generated: FunctionDef
+    ) -> str:
+        """
+        A digest of an async function, and of the sync function generated
+        from it (minus its @from_codegen marker), along with everything
+        influencing the transform
+
+        This changes when the async function changes, but also when the
+        generated code gets edited by hand (or when a function it awaits
+        gets paired up with a different counterpart in the symbol index).
+        """
+        generated = generated.with_changes(
+            leading_lines=(),
+            decorators=[d for d in generated.decorators if not is_from_codegen(d)],
+        )
+        digest = hashlib.sha256()
+        for part in (
+            tool_fingerprint(),
+            self.config.fingerprint(),
+            self.module.code_for_node(async_node.with_changes(leading_lines=())),
+            self.module.code_for_node(generated),
+            self.index_resolutions(async_node),
+        ):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()[:SRC_HASH_LENGTH]
+
+    def index_resolutions(self, async_node: FunctionDef) -> str:
+        """
+        The counterparts the symbol index gives to the functions awaited
+        in async_node
+        """
+        if self.symbol_index is None:
+            return ""
+        visitor = IndexedCalls()
+        async_node.body.visit(visitor)
+        return "\n".join(
+            f"{name} {self.symbol_index[name]}"
+            for name in sorted(visitor.names)
+            if name in self.symbol_index
+        )
+
+    def with_src_hash(self, async_node: FunctionDef, generated: FunctionDef):
+        """
+        Record the source fingerprint on the @from_codegen marker
+        """
+        src_hash = self.source_fingerprint(async_node, generated)
+        marker = Decorator(
+            decorator=cst.Call(
+                func=Name("from_codegen"),
+                args=[
+                    cst.Arg(
+                        keyword=Name("src_hash"),
+                        value=cst.SimpleString(f'"{src_hash}"'),
+                        equal=cst.AssignEqual(
+                            whitespace_before=cst.SimpleWhitespace(""),
+                            whitespace_after=cst.SimpleWhitespace(""),
+                        ),
+                    )
+                ],
+            )
+        )
+        return generated.with_changes(
+            decorators=[
+                marker if is_from_codegen(decorator) else decorator
+                for decorator in generated.decorators
+            ]
+        )
 
     unasynced_name = m.Name(value="generate_unasynced")
     generate_unasynced_pattern = unasynced_name | m.Call(func=unasynced_name)
@@ -60,46 +375,43 @@ class UnasyncifyMethodCommand(VisitorBasedCodemodCommand):
     )
 
     generated_keyword_pattern = m.Arg(
-        keyword=m.Name(value="async_unsafe"),
-        value=m.Name(value="True"),
+        keyword=m.Name(),
+        value=m.Name(value="True") | m.Name(value="False"),
     )
 
     def decorator_info(self, node: FunctionDef) -> DecoratorInfo:
         from_codegen = False
         unasync = False
-        async_unsafe = False
+        flags = dict.fromkeys(GENERATE_UNASYNCED_KEYWORDS, False)
 
         # we only consider the top decorator, and will copy everything else
         if node.decorators:
             decorator = node.decorators[0]
             if m.matches(decorator.decorator, self.generate_unasynced_pattern):
                 # raw call @generate_unasynced
-                if isinstance(decorator.decorator, Name):
-                    unasync = True
-                    async_unsafe = False
-                else:
+                unasync = True
+                if isinstance(decorator.decorator, cst.Call):
                     # Safety: m.matches call above
                     call: cst.Call = cast(cst.Call, decorator.decorator)
-                    unasync = True
-                    args = call.args
-                    if len(args) == 0:
-                        async_unsafe = False
-                    elif len(args) == 1:
-                        # assert that it's async_unsafe, our only supported
-                        # keyword for now
-                        assert m.matches(
-                            args[0], self.generated_keyword_pattern
-                        ), f"We only support async_unsafe=True as a keyword argument, got {args}"
-                        async_unsafe = True
-                    else:
-                        raise ValueError(
-                            "generate_unasynced only supports 0 or 1 arguments"
-                        )
-            elif isinstance(decorator.decorator, cst.Name):
-                if decorator.decorator.value == "from_codegen":
-                    from_codegen = True
-
-        return DecoratorInfo(from_codegen, unasync, async_unsafe)
+                    for arg in call.args:
+                        if not m.matches(arg, self.generated_keyword_pattern):
+                            raise ValueError(
+                                "generate_unasynced only supports keyword "
+                                f"arguments set to True or False, got {arg}"
+                            )
+                        keyword = cast(cst.Name, arg.keyword).value
+                        if keyword not in flags:
+                            raise ValueError(
+                                f"Unknown generate_unasynced argument {keyword}"
+                                f" (expected one of {GENERATE_UNASYNCED_KEYWORDS})"
+                            )
+                        flags[keyword] = cast(cst.Name, arg.value).value == "True"
+            elif is_from_codegen(decorator):
+                from_codegen = True
+
+        return DecoratorInfo(
+            from_codegen, unasync, flags["async_unsafe"], flags["internal"]
+        )
 
     def decorator_names(self, node: FunctionDef) -> list[str]:
         # get the names of the decorators on this function
@@ -111,51 +423,108 @@ class UnasyncifyMethodCommand(VisitorBasedCodemodCommand):
         ]
 
     def calculate_new_name(self, old_name):
-        if old_name.startswith("test_async_"):
-            # test_async_foo -> test_foo
-            return old_name.replace("test_async_", "test_", 1)
-        if old_name.startswith("_a"):
-            # _ainsert -> _insert
-            return old_name.replace("_a", "_", 1)
-        if old_name.startswith("a"):
-            # aget -> get
-            return old_name[1:]
+        new_name = sync_function_name(old_name)
+        if new_name is not None:
+            return new_name
         raise ValueError(
             f"""
             Unknown name replacement pasttern for {old_name}
             """
         )
 
+    def visit_Module(self, node: cst.Module) -> None:
+        self.functions_generated = 0
+        self.functions_reused = 0
+        self.marked_subtrees = set()
+        find_marked_subtrees(node, self.marked_subtrees)
+        self.existing_imports = (
+            self.module_imports
+            if self.module_imports is not None
+            else find_existing_imports(node)
+        )
+        # the codegen functions we have removed (by name), so that their
+        # replacements end up laid out the same way (or, when they are
+        # still up to date, so that we can put them back as-is)
+        self.removed_codegen: dict[str, FunctionDef] = {}
+
+    def on_visit(self, node: cst.CSTNode) -> bool:
+        should_visit_children = super().on_visit(node)
+        # We only ever act on marked functions, and copy them over as-is,
+        # so there's no need to look inside of a statement unless it has
+        # marked functions nested inside of it.
+        if isinstance(node, cst.BaseStatement) and not any(
+            id(child) in self.marked_subtrees for child in nested_blocks(node)
+        ):
+            return False
+        return should_visit_children
+
     def leave_FunctionDef(self, original_node: FunctionDef, updated_node: FunctionDef):
+        with self.phase("leave_FunctionDef"):
+            return self.unasyncify_function(updated_node)
+
+    def unasyncify_function(self, updated_node: FunctionDef):
         decorator_info = self.decorator_info(updated_node)
         # if we are looking at something that's already codegen, drop it
         # (it will get regenerated)
         if decorator_info.from_codegen:
+            self.removed_codegen[updated_node.name.value] = updated_node
             return cst.RemovalSentinel.REMOVE
 
         if decorator_info.unasync:
             new_name = self.calculate_new_name(
                 get_full_name_for_node(updated_node.name)
             )
+            removed = self.removed_codegen.pop(new_name, None)
+            leading_lines = (
+                removed.leading_lines
+                if removed is not None
+                else updated_node.leading_lines
+            )
+            if not updated_node.leading_lines:
+                # keep some space between the two versions
+                updated_node = updated_node.with_changes(leading_lines=[EmptyLine()])
+
+            if (
+                self.config.function_fingerprints
+                and removed is not None
+                and stored_src_hash(removed)
+                == self.source_fingerprint(updated_node, removed)
+            ):
+                # neither the async function nor the generated code changed
+                # since the last run, there's nothing to regenerate
+                self.require_reused_imports(updated_node, removed, decorator_info)
+                self.functions_reused += 1
+                return cst.FlattenSentinel([removed, updated_node])
 
             unasynced_func = updated_node.with_changes(
                 name=Name(new_name),
                 asynchronous=None,
+                leading_lines=leading_lines,
             )
             unasynced_func = self.label_as_codegen(
-                unasynced_func, async_unsafe=decorator_info.async_unsafe
+                unasynced_func,
+                # internal functions are only called from other generated
+                # code, the guard at the public entry point covers them
+                async_unsafe=decorator_info.async_unsafe
+                and not decorator_info.internal,
             )
-            transformer = UnasyncifyMethod(self.config)
+            transformer = UnasyncifyMethod(self.config, self.symbol_index)
 
             transformed_unasynced_func = unasynced_func.visit(transformer)
 
             if transformer.is_async_seen:
                 self.add_codegen_imports("IS_ASYNC")
+            for module in sorted(transformer.needed_imports):
+                self.require_import(module)
+            self.functions_generated += 1
+            if self.config.function_fingerprints:
+                assert isinstance(transformed_unasynced_func, FunctionDef)
+                transformed_unasynced_func = self.with_src_hash(
+                    updated_node, transformed_unasynced_func
+                )
 
             # while here the async version is the canonical version, we place
             # the unasync version up on top
-            return cst.FlattenSentinel(
-                [transformed_unasynced_func, EmptyLine(), updated_node]
-            )
+            return cst.FlattenSentinel([transformed_unasynced_func, updated_node])
         else:
             return updated_node
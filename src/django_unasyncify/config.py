@@ -2,18 +2,54 @@ from dataclasses import dataclass, field
 
 from pathlib import Path
 from textwrap import dedent
+import hashlib
+import json
+import os
 import tomllib
 
+# how the sync variant does what an awaited call does, either:
+# - a function to call instead (dotted names get imported)
+# - "tuple": gather the arguments into a tuple
+# - "unwrap": use the first argument as is
+# - "sleep": drop sleep(0), call time.sleep otherwise
+LOWERING_STRATEGIES = ("tuple", "unwrap", "sleep")
+DEFAULT_LOWERINGS = {
+    "asyncio.gather": "tuple",
+    "asyncio.wait_for": "unwrap",
+    "asyncio.sleep": "sleep",
+    "anext": "next",
+    "aiter": "iter",
+}
+# directories that don't hold projects of their own (besides hidden ones),
+# skipped when looking for projects
+SKIPPED_DIRECTORIES = {"__pycache__", "node_modules", "site-packages"}
+
 
 @dataclass
 class Config:
     project_base: Path = Path(".")
     paths_to_visit: list[str] = field(default_factory=lambda: [])
+    # glob patterns of files and directories to leave alone
+    exclude: list[str] = field(default_factory=lambda: [])
+    # also leave alone whatever git ignores
+    respect_gitignore: bool = False
     attribute_renames: dict[str, str] = field(default_factory=lambda: {})
+    # names (or dotted paths) with a known value in sync code, that get
+    # folded away like IS_ASYNC
+    constants: dict[str, bool] = field(default_factory=lambda: {})
+    # calls (to asyncio combinators and the like) to replace with their
+    # sync equivalent, see LOWERING_STRATEGIES
+    lowerings: dict[str, str] = field(default_factory=lambda: dict(DEFAULT_LOWERINGS))
+    # record a fingerprint of the code on generated functions, so that
+    # up to date functions don't need to be regenerated
+    function_fingerprints: bool = False
     # XXX maybe rename this one
     unasync_helpers_import_path: str = "MISSING_IMPORT_PATH"
     # XXX rename this one as well, and not include the defaults here
     unasync_helpers_path: str = "MISSING"
+    # where we keep track of files that are known to be up to date
+    # (relative to the project base)
+    cache_dir: str = ".django_unasyncify_cache"
 
     def __post_init__(self):
         # this IS_ASYNC rename is present even when we explicitly don't include
@@ -27,6 +63,26 @@ class Config:
     def codegen_template_path(self) -> Path:
         return self.project_base / self.unasync_helpers_path
 
+    def cache_path(self) -> Path:
+        return self.project_base / self.cache_dir
+
+    def fingerprint(self) -> str:
+        """
+        A digest of every setting that influences the generated code.
+
+        Two configs with the same fingerprint will transform any given
+        file in the same way.
+        """
+        settings = {
+            "attribute_renames": self.attribute_renames,
+            "constants": self.constants,
+            "lowerings": self.lowerings,
+            "function_fingerprints": self.function_fingerprints,
+            "unasync_helpers_import_path": self.unasync_helpers_import_path,
+        }
+        encoded = json.dumps(settings, sort_keys=True).encode("utf-8")
+        return hashlib.sha256(encoded).hexdigest()
+
 
 def load_config_from_project_path(project_path: str) -> Config:
     project_base = Path(project_path)
@@ -51,13 +107,81 @@ def load_config_from_project_path(project_path: str) -> Config:
             )
         )
 
+    constants = unasyncify_config.get("constants", {})
+    for name, value in constants.items():
+        if not isinstance(value, bool):
+            raise ValueError(
+                f"Constants can only be true or false, but {name} is set to {value!r}"
+            )
+
+    # lowerings are added to the defaults, which can be turned off with false
+    lowerings = dict(DEFAULT_LOWERINGS)
+    for name, lowering in unasyncify_config.get("lowerings", {}).items():
+        if lowering is False:
+            lowerings.pop(name, None)
+        elif isinstance(lowering, str) and lowering:
+            lowerings[name] = lowering
+        else:
+            raise ValueError(
+                f"Lowerings must be a function name, one of {LOWERING_STRATEGIES}"
+                f" or false, but {name} is set to {lowering!r}"
+            )
+
+    exclude = unasyncify_config.get("exclude", [])
+    if not isinstance(exclude, list) or not all(
+        isinstance(pattern, str) and pattern for pattern in exclude
+    ):
+        raise ValueError(f"exclude must be a list of glob patterns, not {exclude!r}")
+
     paths_to_visit_config = unasyncify_config.get("paths_to_visit", ["."])
     paths_to_visit = [str(project_base / path) for path in paths_to_visit_config]
 
     return Config(
         project_base=project_base,
         paths_to_visit=paths_to_visit,
+        exclude=exclude,
+        respect_gitignore=unasyncify_config.get("respect_gitignore", False),
         attribute_renames=unasyncify_config.get("attribute_renames", {}),
+        constants=constants,
+        lowerings=lowerings,
+        function_fingerprints=unasyncify_config.get("function_fingerprints", False),
         unasync_helpers_path=unasyncify_config["unasync_helpers_path"],
         unasync_helpers_import_path=unasyncify_config["unasync_helpers_import_path"],
+        cache_dir=unasyncify_config.get("cache_dir", ".django_unasyncify_cache"),
     )
+
+
+def has_config_section(pyproject_location: Path) -> bool:
+    try:
+        with pyproject_location.open("rb") as pyproject_file:
+            contents = pyproject_file.read()
+    except OSError:
+        return False
+    # most pyproject.toml files are not ours, and don't need parsing
+    if b"django_unasyncify" not in contents:
+        return False
+    pyproject = tomllib.loads(contents.decode("utf-8"))
+    return "django_unasyncify" in pyproject.get("tool", {})
+
+
+def find_project_paths(root: str) -> list[Path]:
+    """
+    Every directory under root (root included) with a pyproject.toml
+    holding a [tool.django_unasyncify] section
+
+    Hidden directories and virtual environments are not looked into.
+    """
+    found = []
+    for directory, subdirectories, files in os.walk(root):
+        if "pyproject.toml" in files and has_config_section(
+            Path(directory) / "pyproject.toml"
+        ):
+            found.append(Path(directory))
+        subdirectories[:] = [
+            name
+            for name in subdirectories
+            if not name.startswith(".")
+            and name not in SKIPPED_DIRECTORIES
+            and not os.path.exists(os.path.join(directory, name, "pyvenv.cfg"))
+        ]
+    return sorted(found)
@@ -0,0 +1,312 @@
+"""
+Figuring out which files might need transforming
+"""
+
+import mmap
+import os
+import re
+from collections.abc import Iterable, Sequence
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .config import Config
+
+# the codemod only ever acts on functions decorated by one of these
+# names, so a file without them will come out of the transform untouched
+MARKER_PATTERN = re.compile(
+    rb"^[ \t]*@[ \t]*(?:generate_unasynced|from_codegen)\b", re.MULTILINE
+)
+# regexes starting with a literal are much quicker to search with, so
+# we look for this first, and only then check for MARKER_PATTERN
+MARKER_HINT = re.compile(rb"@[ \t]*(?:generate_unasynced|from_codegen)\b")
+
+# past this size, we map the file into memory instead of reading it
+MMAP_THRESHOLD = 64 * 1024
+
+
+# the pieces of a glob: runs of stars, ?, [character classes], and the
+# literal text between them
+GLOB_TOKENS = re.compile(r"\*+|\?|\[!?\]?[^\]]*\]|[^*?\[]+|\[")
+
+
+def translate_segment(segment: str) -> str:
+    """
+    A regex for a glob matching a single file or directory name
+    """
+    parts = []
+    for token in GLOB_TOKENS.findall(segment):
+        if token.startswith("*"):
+            parts.append("[^/]*")
+        elif token == "?":
+            parts.append("[^/]")
+        elif token.startswith("[") and len(token) > 1:
+            body = token[1:-1].replace("\\", "\\\\").replace("[", "\\[")
+            if body.startswith("!"):
+                body = "^" + body[1:]
+            elif body.startswith("^"):
+                body = "\\" + body
+            # (character classes don't match slashes either)
+            parts.append(f"(?!/)[{body}]")
+        else:
+            parts.append(re.escape(token))
+    return "".join(parts)
+
+
+def translate_glob(pattern: str) -> str:
+    """
+    A regex for a glob, with the semantics of .gitignore files: `*`, `?`
+    and character classes only ever match within a name, `**` matches
+    any number of directories (`a/**/b` matches `a/b` and `a/x/y/b`)
+    """
+    segments = pattern.split("/")
+    parts = []
+    for index, segment in enumerate(segments):
+        last = index == len(segments) - 1
+        if segment == "**":
+            parts.append(".*" if last else "(?:.*/)?")
+        else:
+            parts.append(translate_segment(segment) + ("" if last else "/"))
+    return f"(?s:{''.join(parts)})\\Z"
+
+
+def compile_patterns(patterns: Iterable[str]) -> re.Pattern[str] | None:
+    translated = [translate_glob(pattern) for pattern in patterns]
+    if not translated:
+        return None
+    return re.compile("|".join(f"(?:{pattern})" for pattern in translated))
+
+
+class Exclusions:
+    """
+    Which files and directories of a project to leave out of discovery
+
+    Patterns are globs, like with .gitignore files: patterns without a slash
+    match the name of a file or directory anywhere in the project, others
+    match paths relative to the project base. Patterns ending with a slash
+    only match directories. Wildcards don't cross directories, except for
+    `**` (see translate_glob).
+    """
+
+    base: str
+    # (directories only?, pattern) for names and relative paths
+    name_patterns: dict[bool, re.Pattern[str] | None]
+    path_patterns: dict[bool, re.Pattern[str] | None]
+    # absolute paths of files and directories ignored by git
+    ignored: set[str]
+
+    def __init__(
+        self, base: str, patterns: Sequence[str], ignored: Iterable[str] = ()
+    ) -> None:
+        self.base = os.path.abspath(base)
+        self.name_patterns = {}
+        self.path_patterns = {}
+        for directories in (False, True):
+            # patterns for files apply to directories as well
+            applicable = [
+                pattern.rstrip("/")
+                for pattern in patterns
+                if directories or not pattern.endswith("/")
+            ]
+            self.name_patterns[directories] = compile_patterns(
+                pattern for pattern in applicable if "/" not in pattern
+            )
+            self.path_patterns[directories] = compile_patterns(
+                pattern.lstrip("/") for pattern in applicable if "/" in pattern
+            )
+        self.ignored = {os.path.join(self.base, path) for path in ignored}
+
+    @classmethod
+    def for_config(cls, config: "Config") -> "Exclusions":
+        base = str(config.project_base)
+        ignored: list[str] = []
+        if config.respect_gitignore:
+            try:
+                ignored = git_ignored_paths(base)
+            except ValueError:
+                # not a git checkout, nothing to ignore
+                pass
+        return cls(base, config.exclude, ignored)
+
+    def excludes_entry(self, path: str, is_dir: bool) -> bool:
+        """
+        Whether a file or directory is excluded, assuming that the
+        directory holding it is not
+        """
+        absolute = os.path.abspath(path)
+        if absolute in self.ignored:
+            return True
+        if absolute == self.base:
+            return False
+        name_pattern = self.name_patterns[is_dir]
+        if name_pattern is not None and name_pattern.match(os.path.basename(absolute)):
+            return True
+        path_pattern = self.path_patterns[is_dir]
+        if path_pattern is None:
+            return False
+        relative = os.path.relpath(absolute, self.base)
+        if relative.startswith(os.pardir):
+            return False
+        return path_pattern.match(relative.replace(os.sep, "/")) is not None
+
+    def excludes(self, filename: str) -> bool:
+        """
+        Whether a file, or any of the directories it is in, is excluded
+        """
+        if self.excludes_entry(filename, is_dir=False):
+            return True
+        directory = os.path.dirname(os.path.abspath(filename))
+        while directory.startswith(self.base + os.sep):
+            if self.excludes_entry(directory, is_dir=True):
+                return True
+            directory = os.path.dirname(directory)
+        return False
+
+
+def gather_python_files(
+    paths: Iterable[str], exclusions: Exclusions | None = None
+) -> list[str]:
+    """
+    Every Python file in paths (which can be files or directories)
+
+    Excluded directories are not walked into at all.
+    """
+    found = []
+    for path in paths:
+        if os.path.isfile(path):
+            if exclusions is None or not exclusions.excludes(path):
+                found.append(path)
+            continue
+        if exclusions is not None and exclusions.excludes_entry(path, is_dir=True):
+            continue
+        for root, directories, files in os.walk(path):
+            if exclusions is not None:
+                directories[:] = [
+                    name
+                    for name in directories
+                    if not exclusions.excludes_entry(
+                        os.path.join(root, name), is_dir=True
+                    )
+                ]
+            found.extend(
+                os.path.join(root, name)
+                for name in files
+                if name.endswith(".py")
+                and (
+                    exclusions is None
+                    or not exclusions.excludes_entry(
+                        os.path.join(root, name), is_dir=False
+                    )
+                )
+            )
+    return sorted(found)
+
+
+def has_unasync_markers(filename: str) -> bool:
+    """
+    Cheaply check whether a file could hold functions to unasyncify
+
+    This is a purely textual check, so it can have false positives (a
+    marker inside a string, say), but no false negatives.
+    """
+    with open(filename, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return False
+        if size < MMAP_THRESHOLD:
+            return contains_marker(f.read())
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as contents:
+            return contains_marker(contents)
+
+
+def contains_marker(contents: bytes | mmap.mmap) -> bool:
+    hint = MARKER_HINT.search(contents)
+    if hint is None:
+        return False
+    # search from the start of the line the hint is on
+    line_start = contents.rfind(b"\n", 0, hint.start()) + 1
+    return MARKER_PATTERN.search(contents, line_start) is not None
+
+
+def filter_marked_files(filenames: Iterable[str]) -> list[str]:
+    return [filename for filename in filenames if has_unasync_markers(filename)]
+
+
+def restrict_to_paths(
+    filenames: Iterable[str],
+    paths: Iterable[str],
+    exclusions: Exclusions | None = None,
+) -> list[str]:
+    """
+    Keep the existing (and not excluded) Python files that live under
+    one of paths
+
+    Files listed more than once (maybe as both relative and absolute
+    paths) are only kept the first time around, so that they don't get
+    transformed twice at the same time.
+    """
+    roots = [os.path.abspath(path) for path in paths]
+    kept = []
+    seen = set()
+    for filename in filenames:
+        if not filename.endswith(".py") or not os.path.isfile(filename):
+            continue
+        real = os.path.realpath(filename)
+        if real in seen:
+            continue
+        absolute = os.path.abspath(filename)
+        if exclusions is not None and exclusions.excludes(filename):
+            continue
+        if any(
+            absolute == root or absolute.startswith(root + os.sep) for root in roots
+        ):
+            seen.add(real)
+            kept.append(filename)
+    return kept
+
+
+def run_git(cwd: str, *args: str) -> str:
+    # only imported when needed, to keep startup quick
+    import subprocess
+
+    try:
+        completed = subprocess.run(
+            ["git", "-C", cwd, *args], capture_output=True, text=True, check=True
+        )
+    except FileNotFoundError:
+        raise ValueError("Could not find git, is it installed?")
+    except subprocess.CalledProcessError as e:
+        raise ValueError(f"git {' '.join(args)} failed: {e.stderr.strip()}")
+    return completed.stdout
+
+
+def git_changed_files(cwd: str, rev: str) -> list[str]:
+    """
+    Files added or modified since rev (committed or not), as well as
+    untracked files that aren't ignored
+    """
+    toplevel = run_git(cwd, "rev-parse", "--show-toplevel").strip()
+    changed = run_git(
+        toplevel, "diff", "--name-only", "--diff-filter=ACMR", "-z", rev, "--"
+    )
+    untracked = run_git(toplevel, "ls-files", "--others", "--exclude-standard", "-z")
+    names = dict.fromkeys(name for name in (changed + untracked).split("\0") if name)
+    return [os.path.join(toplevel, name) for name in names]
+
+
+def git_ignored_paths(cwd: str) -> list[str]:
+    """
+    Files and directories under cwd ignored by git, relative to cwd
+
+    Directories that are ignored as a whole are listed as such, without
+    the files they hold.
+    """
+    ignored = run_git(
+        cwd,
+        "ls-files",
+        "--others",
+        "--ignored",
+        "--exclude-standard",
+        "--directory",
+        "-z",
+    )
+    return [name.rstrip("/") for name in ignored.split("\0") if name]
@@ -0,0 +1,156 @@
+"""
+Finding redundant async_unsafe guards
+
+Functions generated from `@generate_unasynced(async_unsafe=True)` get
+Django's `async_unsafe` decorator, which checks that we are not running
+inside of an event loop on every call. When a generated function is only
+ever called from other guarded functions, that check already happened
+further up the call chain, and the function can be marked with
+`@generate_unasynced(async_unsafe=True, internal=True)` instead.
+
+Like the symbol index, this works off of the standard library's ast
+module, and matches functions up by name only. A name being used
+anywhere outside of a guarded function (at module level, in an async
+function, passed around as a callback...) counts as an unguarded caller,
+so we err on the side of keeping guards.
+"""
+
+import ast
+from collections.abc import Iterable
+from dataclasses import dataclass, field
+
+from .index import called_name
+
+GUARD_SNIPPET = b"async_unsafe"
+# the decorators of a guarded generated function
+GUARDED_CODEGEN = {"from_codegen", "async_unsafe"}
+
+
+@dataclass
+class RedundantGuard:
+    filename: str
+    function: str
+    line: int
+    # names of the (guarded) functions calling this one
+    callers: list[str] = field(default_factory=list)
+
+
+def decorator_names(node: ast.FunctionDef | ast.AsyncFunctionDef) -> set[str]:
+    names = set()
+    for decorator in node.decorator_list:
+        if isinstance(decorator, ast.Call):
+            decorator = decorator.func
+        name = called_name(decorator)
+        if name is not None:
+            names.add(name)
+    return names
+
+
+def is_guarded(node: ast.AST) -> bool:
+    return isinstance(node, ast.FunctionDef) and "async_unsafe" in decorator_names(node)
+
+
+def parse_file(filename: str, source: bytes) -> ast.Module | None:
+    try:
+        return ast.parse(source, filename=filename)
+    except (SyntaxError, ValueError):
+        # broken files are left for the codemod to complain about
+        return None
+
+
+class ReferenceCollector(ast.NodeVisitor):
+    """
+    Record, for every name of interest, the functions referring to it
+    and whether they are guarded
+    """
+
+    def __init__(self, names: set[str]) -> None:
+        self.names = names
+        # name -> [(referring function, guarded)]
+        self.references: dict[str, list[tuple[str | None, bool]]] = {}
+        # the innermost function we are in, if any
+        self.function: ast.FunctionDef | ast.AsyncFunctionDef | None = None
+
+    def visit_function(self, node: ast.FunctionDef | ast.AsyncFunctionDef) -> None:
+        # decorators and defaults are evaluated in the enclosing scope
+        for decorator in node.decorator_list:
+            self.visit(decorator)
+        self.visit(node.args)
+        outer, self.function = self.function, node
+        for statement in node.body:
+            self.visit(statement)
+        self.function = outer
+
+    visit_FunctionDef = visit_function
+    visit_AsyncFunctionDef = visit_function
+
+    def record(self, name: str) -> None:
+        if name not in self.names:
+            return
+        function = self.function
+        if function is not None and function.name == name:
+            # recursive calls don't need a guard of their own
+            return
+        self.references.setdefault(name, []).append(
+            (
+                function.name if function is not None else None,
+                function is not None and is_guarded(function),
+            )
+        )
+
+    def visit_Name(self, node: ast.Name) -> None:
+        self.record(node.id)
+
+    def visit_Attribute(self, node: ast.Attribute) -> None:
+        self.record(node.attr)
+        self.generic_visit(node)
+
+
+def find_redundant_guards(filenames: Iterable[str]) -> list[RedundantGuard]:
+    """
+    Find the guarded generated functions that are only called from
+    other guarded functions
+    """
+    sources: dict[str, bytes] = {}
+    for filename in filenames:
+        try:
+            with open(filename, "rb") as f:
+                sources[filename] = f.read()
+        except OSError:
+            continue
+
+    candidates: list[RedundantGuard] = []
+    for filename, source in sources.items():
+        if GUARD_SNIPPET not in source:
+            continue
+        module = parse_file(filename, source)
+        if module is None:
+            continue
+        for node in ast.walk(module):
+            if isinstance(node, ast.FunctionDef) and GUARDED_CODEGEN <= (
+                decorator_names(node)
+            ):
+                candidates.append(RedundantGuard(filename, node.name, node.lineno))
+    if not candidates:
+        return []
+
+    names = {candidate.function for candidate in candidates}
+    snippets = [name.encode("utf-8") for name in names]
+    collector = ReferenceCollector(names)
+    for filename, source in sources.items():
+        # most files won't mention any of the functions
+        if not any(snippet in source for snippet in snippets):
+            continue
+        module = parse_file(filename, source)
+        if module is not None:
+            collector.visit(module)
+
+    redundant = []
+    for candidate in candidates:
+        references = collector.references.get(candidate.function, [])
+        if references and all(guarded for _, guarded in references):
+            candidate.callers = sorted(
+                {caller for caller, _ in references if caller is not None}
+            )
+            redundant.append(candidate)
+    return redundant
@@ -0,0 +1,225 @@
+"""
+Generating sync variants at import time
+
+Instead of committing generated code, a project can install an import
+hook that transforms its modules as they get imported:
+
+    from django_unasyncify.config import Config
+    from django_unasyncify.importhook import install
+
+    install(Config.from_project_path("."), packages=["myproject"])
+
+Transformed code gets compiled and cached next to the regular bytecode
+caches (in __pycache__), keyed on a hash of the module source and the
+fingerprint of the config. Importing an unchanged module costs about as
+much as loading a regular .pyc file, only new or changed modules go
+through the transform.
+
+Transformed code keeps the line numbers of the file on disk, so that
+tracebacks, debuggers and coverage tools point at the right lines. Code
+the transform inserted (sync variants, imports) gets the line numbers of
+the code following it, so a sync variant lines up with the async function
+it was generated from.
+"""
+
+import ast
+import difflib
+import hashlib
+import marshal
+import os
+import sys
+from collections.abc import Sequence
+from importlib.machinery import ModuleSpec, PathFinder, SourceFileLoader
+from importlib.util import MAGIC_NUMBER, cache_from_source, decode_source, source_hash
+from types import CodeType
+from typing import TYPE_CHECKING
+
+from .cache import tool_fingerprint
+from .config import Config
+from .discovery import contains_marker
+
+if TYPE_CHECKING:
+    from .api import SourceTransformer
+
+# cached bytecode lives at __pycache__/<module>.<tag>.opt-unasyncify.pyc
+# (opt-unasyncify1.pyc and opt-unasyncify2.pyc when running with -O and -OO,
+# which leave out asserts and docstrings)
+CACHE_OPTIMIZATION = "unasyncify"
+
+
+def cache_optimization() -> str:
+    if sys.flags.optimize:
+        return f"{CACHE_OPTIMIZATION}{sys.flags.optimize}"
+    return CACHE_OPTIMIZATION
+
+
+class UnasyncifyFinder:
+    """
+    A meta path finder that hands modules from some packages
+    over to UnasyncifyLoader
+    """
+
+    config: Config
+    packages: list[str]
+    # identifies the transform, everything cached is only valid for it
+    key: bytes
+    _transformer: "SourceTransformer | None"
+
+    def __init__(self, config: Config, packages: Sequence[str]) -> None:
+        self.config = config
+        self.packages = list(packages)
+        self.key = hashlib.sha256(
+            f"{tool_fingerprint()}:{config.fingerprint()}".encode("utf-8")
+        ).digest()
+        self._transformer = None
+
+    def handles(self, fullname: str) -> bool:
+        return any(
+            fullname == package or fullname.startswith(package + ".")
+            for package in self.packages
+        )
+
+    def find_spec(self, fullname, path=None, target=None) -> ModuleSpec | None:
+        if not self.handles(fullname):
+            return None
+        spec = PathFinder.find_spec(fullname, path, target)
+        if spec is None or not isinstance(spec.loader, SourceFileLoader):
+            # leave namespace packages, extension modules... alone
+            return spec
+        spec.loader = UnasyncifyLoader(fullname, spec.loader.path, self)
+        return spec
+
+    def transform(self, source: bytes, path: str) -> str:
+        """
+        The transformed code of a module, decoded like Python would
+        (taking coding declarations into account)
+        """
+        code = decode_source(source)
+        if not contains_marker(source):
+            return code
+        if self._transformer is None:
+            # libcst is only needed once we find a module to transform
+            from .api import SourceTransformer
+
+            self._transformer = SourceTransformer(self.config)
+        return self._transformer.transform(code, filename=path)
+
+
+def original_line_numbers(original: bytes, transformed: bytes) -> list[int]:
+    """
+    For every line of transformed (1-based, so starting at index 1), the
+    line of original it corresponds to
+    """
+    original_lines = original.splitlines()
+    transformed_lines = transformed.splitlines()
+    last_line = max(len(original_lines), 1)
+    mapping = [0] * (len(transformed_lines) + 1)
+    matcher = difflib.SequenceMatcher(
+        None, original_lines, transformed_lines, autojunk=False
+    )
+    for _, i1, _, j1, j2 in matcher.get_opcodes():
+        # matching lines map onto each other, inserted (or replaced) lines
+        # onto the lines that follow them in the original
+        for offset in range(j2 - j1):
+            mapping[j1 + offset + 1] = min(i1 + offset + 1, last_line)
+    return mapping
+
+
+def compile_with_original_lines(original: str, transformed: str, path: str) -> CodeType:
+    """
+    Compile transformed code, with the line numbers of the original code
+    """
+    tree = ast.parse(transformed, path)
+    # (bytes get split on the same line endings Python counts lines with)
+    mapping = original_line_numbers(
+        original.encode("utf-8"), transformed.encode("utf-8")
+    )
+    for node in ast.walk(tree):
+        # (not every node has a position)
+        lineno = getattr(node, "lineno", None)
+        if lineno is None:
+            continue
+        start = mapping[lineno]
+        setattr(node, "lineno", start)
+        end_lineno = getattr(node, "end_lineno", None)
+        if end_lineno is None:
+            continue
+        end = max(mapping[end_lineno], start)
+        setattr(node, "end_lineno", end)
+        col_offset = getattr(node, "col_offset", None)
+        end_col_offset = getattr(node, "end_col_offset", None)
+        if end == start and col_offset is not None and end_col_offset is not None:
+            # lines past the end of the original can collapse together
+            setattr(node, "end_col_offset", max(end_col_offset, col_offset))
+    return compile(tree, path, "exec", dont_inherit=True)
+
+
+class UnasyncifyLoader(SourceFileLoader):
+    """
+    Loads modules with their sync variants generated
+
+    (get_source is left as-is, returning the file on disk: it's what the
+    line numbers of the compiled code refer to)
+    """
+
+    finder: UnasyncifyFinder
+
+    def __init__(self, fullname: str, path: str, finder: UnasyncifyFinder) -> None:
+        super().__init__(fullname, path)
+        self.finder = finder
+
+    def cache_path(self) -> str:
+        return cache_from_source(self.path, optimization=cache_optimization())
+
+    def cache_header(self, source: bytes) -> bytes:
+        return MAGIC_NUMBER + self.finder.key + source_hash(source)
+
+    def get_code(self, fullname: str) -> CodeType:
+        source = self.get_data(self.path)
+        header = self.cache_header(source)
+        cache_path = self.cache_path()
+        try:
+            with open(cache_path, "rb") as f:
+                cached = f.read()
+        except OSError:
+            pass
+        else:
+            if cached.startswith(header):
+                return marshal.loads(cached[len(header) :])
+
+        transformed = self.finder.transform(source, self.path)
+        code = compile_with_original_lines(
+            decode_source(source), transformed, self.path
+        )
+        if not sys.dont_write_bytecode:
+            self.write_cache(cache_path, header + marshal.dumps(code))
+        return code
+
+    def write_cache(self, cache_path: str, data: bytes) -> None:
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            # write to a temporary file first, so that a concurrent import
+            # never reads a partially written cache
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            # like regular bytecode caches, not being able to write one
+            # (on a read-only filesystem, say) is not an error
+            pass
+
+
+def install(config: Config, packages: Sequence[str]) -> UnasyncifyFinder:
+    """
+    Generate sync variants for modules in packages (and their subpackages)
+    as they get imported
+    """
+    finder = UnasyncifyFinder(config, packages)
+    sys.meta_path.insert(0, finder)
+    return finder
+
+
+def uninstall(finder: UnasyncifyFinder) -> None:
+    if finder in sys.meta_path:
+        sys.meta_path.remove(finder)
@@ -0,0 +1,391 @@
+"""
+A project-wide index of async functions and their sync counterparts
+
+Looking at a single file, the best we can do to find the sync version
+of `await self.afetch()` is to drop the `a`. The index looks at the
+whole project instead, recording for every async function the sync
+function that goes with it, when we can tell:
+
+- the function generated from it by @generate_unasynced
+- a sync function with the "unprefixed" name in the same class or module
+- the function it returns a `sync_to_async(...)` call of
+- the function returning an `async_to_sync(...)` call of it
+
+We also record which async functions each file awaits, so that when the
+counterpart of a function changes (or a new one shows up), we know which
+files need to be regenerated.
+
+Scanning is done with the standard library's ast module, and results
+are cached per file, keyed on the file's contents.
+"""
+
+import ast
+import json
+import os
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from .cache import content_digest, project_entry_name, tool_fingerprint
+from .config import Config
+
+INDEX_FILENAME = "index.json"
+
+# files without any of these can't contribute anything to the index
+INTERESTING_SNIPPETS = (b"async def", b"async_to_sync")
+
+
+def sync_function_name(async_name: str) -> str | None:
+    """
+    The name @generate_unasynced gives to the sync version of a function
+    (or None if it doesn't know how to name it)
+    """
+    if async_name.startswith("test_async_"):
+        # test_async_foo -> test_foo
+        return async_name.replace("test_async_", "test_", 1)
+    if async_name.startswith("_a"):
+        # _ainsert -> _insert
+        return async_name.replace("_a", "_", 1)
+    if async_name.startswith("a"):
+        # aget -> get
+        return async_name[1:]
+    return None
+
+
+@dataclass
+class FileSymbols:
+    digest: str
+    # (mtime, size) of the file when it was scanned, so that files
+    # that were not touched since don't even need to be read
+    stamp: list[int] = field(default_factory=list)
+    # async function name -> name of its sync counterpart (None if unknown)
+    async_functions: dict[str, str | None] = field(default_factory=dict)
+    # names of the functions awaited inside of @generate_unasynced functions
+    references: list[str] = field(default_factory=list)
+
+
+def called_name(node: ast.expr) -> str | None:
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Attribute):
+        return node.attr
+    return None
+
+
+def own_nodes(function: ast.FunctionDef | ast.AsyncFunctionDef) -> Iterator[ast.AST]:
+    """
+    Every node in the body of function, leaving out nested functions
+    and classes
+    """
+    pending: list[ast.AST] = list(function.body)
+    while pending:
+        node = pending.pop()
+        yield node
+        if not isinstance(
+            node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda, ast.ClassDef)
+        ):
+            pending.extend(ast.iter_child_nodes(node))
+
+
+def wrapped_function(
+    function: ast.FunctionDef | ast.AsyncFunctionDef, wrapper: str
+) -> str | None:
+    """
+    The name of f, when function returns `wrapper(f)(...)` (awaited or not)
+
+    Wrapper calls anywhere else (like `await sync_to_async(log)(...)`
+    before doing the actual work) don't tell us what function is the
+    counterpart of, and neither do returns wrapping different functions.
+    """
+    names = set()
+    for node in own_nodes(function):
+        if not isinstance(node, ast.Return) or node.value is None:
+            continue
+        value = node.value
+        if isinstance(value, ast.Await):
+            value = value.value
+        if (
+            isinstance(value, ast.Call)
+            and isinstance(value.func, ast.Call)
+            and called_name(value.func.func) == wrapper
+            and value.func.args
+        ):
+            names.add(called_name(value.func.args[0]))
+    if len(names) != 1:
+        return None
+    return names.pop()
+
+
+def is_generate_unasynced(node: ast.AsyncFunctionDef) -> bool:
+    # like the codemod, we only consider the top decorator
+    if not node.decorator_list:
+        return False
+    decorator = node.decorator_list[0]
+    if isinstance(decorator, ast.Call):
+        decorator = decorator.func
+    return isinstance(decorator, ast.Name) and decorator.id == "generate_unasynced"
+
+
+def nested_bodies(statement: ast.stmt) -> Iterator[list[ast.stmt]]:
+    for block in ("body", "orelse", "finalbody"):
+        value = getattr(statement, block, None)
+        if isinstance(value, list):
+            yield value
+    # except handlers and match cases hold bodies of their own
+    for child in [
+        *getattr(statement, "handlers", ()),
+        *getattr(statement, "cases", ()),
+    ]:
+        yield child.body
+
+
+def scope_definitions(
+    body: list[ast.stmt],
+) -> Iterator[ast.FunctionDef | ast.AsyncFunctionDef | ast.ClassDef]:
+    """
+    The functions and classes defined in a scope, including the ones
+    nested inside of if/try/with blocks
+    """
+    for statement in body:
+        if isinstance(statement, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            yield statement
+        else:
+            for nested in nested_bodies(statement):
+                yield from scope_definitions(nested)
+
+
+def awaited_names(node: ast.AST) -> set[str]:
+    """
+    The names of every function called inside of an await in node
+
+    These are the calls the transform might rewrite.
+    """
+    names = set()
+    for child in ast.walk(node):
+        if isinstance(child, ast.Await):
+            for call in ast.walk(child.value):
+                if isinstance(call, ast.Call):
+                    name = called_name(call.func)
+                    if name is not None:
+                        names.add(name)
+    return names
+
+
+def scan_source(source: bytes, digest: str) -> FileSymbols:
+    symbols = FileSymbols(digest)
+    if not any(snippet in source for snippet in INTERESTING_SNIPPETS):
+        return symbols
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError):
+        # the transform will complain about this file, not us
+        return symbols
+
+    references: set[str] = set()
+    scopes: list[list[ast.stmt]] = [tree.body]
+    while scopes:
+        definitions = list(scope_definitions(scopes.pop()))
+        sync_names = {d.name for d in definitions if isinstance(d, ast.FunctionDef)}
+        for definition in definitions:
+            scopes.append(definition.body)
+            if isinstance(definition, ast.FunctionDef):
+                # def get(self): return async_to_sync(self.aget)()
+                wrapped = wrapped_function(definition, "async_to_sync")
+                # (helpers like `return async_to_sync(notify)(self)` aren't
+                # the sync version of the function they wrap)
+                if wrapped is not None and sync_function_name(wrapped) is not None:
+                    symbols.async_functions.setdefault(wrapped, definition.name)
+            elif isinstance(definition, ast.AsyncFunctionDef):
+                name = definition.name
+                if is_generate_unasynced(definition):
+                    counterpart = sync_function_name(name)
+                    references |= awaited_names(definition)
+                elif sync_function_name(name) in sync_names:
+                    counterpart = sync_function_name(name)
+                else:
+                    # async def aget(self): return await sync_to_async(self.get)()
+                    counterpart = wrapped_function(definition, "sync_to_async")
+                if counterpart is not None or name not in symbols.async_functions:
+                    symbols.async_functions[name] = counterpart
+    symbols.references = sorted(references)
+    return symbols
+
+
+class SymbolIndex:
+    """
+    Maps the async functions of a project to their sync counterparts
+
+    Only functions whose counterpart we could determine (and that are not
+    ambiguous, like two classes with an `afetch` that go to different
+    sync functions) get resolved through the index. Everything else falls
+    back to the usual naming heuristics.
+    """
+
+    project_base: Path
+    index_file: Path | None
+    key: str
+    files: dict[str, FileSymbols]
+    counterparts: dict[str, str]
+    # whether files changed since they were loaded
+    modified: bool
+
+    def __init__(
+        self, project_base: Path, index_file: Path | None = None, key: str = ""
+    ) -> None:
+        self.project_base = project_base
+        self.index_file = index_file
+        self.key = key
+        self.files = {}
+        self.counterparts = {}
+        self.modified = False
+        self._absolute_base = str(project_base.absolute())
+
+    @classmethod
+    def for_config(cls, config: Config, persist: bool = True) -> "SymbolIndex":
+        """
+        Load the index for a project
+
+        With persist=False, the index starts out empty and never gets saved.
+        """
+        if not persist:
+            return cls(config.project_base)
+        # unlike the transform cache, the index doesn't depend on the config
+        index = cls(
+            config.project_base,
+            config.cache_path() / INDEX_FILENAME,
+            tool_fingerprint(),
+        )
+        index.load()
+        return index
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.counterparts
+
+    def __getitem__(self, name: str) -> str:
+        return self.counterparts[name]
+
+    def load(self) -> None:
+        if self.index_file is None:
+            return
+        try:
+            with self.index_file.open("rb") as f:
+                data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return
+        if data.get("key") != self.key:
+            return
+        self.files = {
+            name: FileSymbols(**symbols) for name, symbols in data["files"].items()
+        }
+        self.counterparts = self.resolve()
+
+    def save(self) -> None:
+        if self.index_file is None:
+            return
+        if not self.modified and self.index_file.exists():
+            return
+        self.index_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.index_file.with_suffix(".tmp")
+        with tmp_file.open("w") as f:
+            json.dump(
+                {
+                    "key": self.key,
+                    "files": {
+                        name: symbols.__dict__ for name, symbols in self.files.items()
+                    },
+                },
+                f,
+                sort_keys=True,
+            )
+        os.replace(tmp_file, self.index_file)
+        self.modified = False
+
+    def _entry_name(self, filename: str) -> str:
+        return project_entry_name(filename, self._absolute_base)
+
+    def resolve(self) -> dict[str, str]:
+        found: dict[str, set[str]] = {}
+        for symbols in self.files.values():
+            for name, counterpart in symbols.async_functions.items():
+                # a function we couldn't pair up in one place doesn't make
+                # the pairing found elsewhere any less valid
+                if counterpart is not None:
+                    found.setdefault(name, set()).add(counterpart)
+        return {
+            name: candidates.pop()
+            for name, candidates in found.items()
+            if len(candidates) == 1
+        }
+
+    def update(self, filenames: Iterable[str]) -> set[str]:
+        """
+        Rescan the given files (if they changed since we last saw them)
+
+        Returns the names whose counterpart changed as a result.
+        """
+        return self._update(
+            {self._entry_name(filename): filename for filename in filenames}
+        )
+
+    def refresh(self, filenames: Iterable[str]) -> set[str]:
+        """
+        Bring the index up to date with the (complete) list of project files
+
+        Returns the names whose counterpart changed as a result.
+        """
+        entries = {self._entry_name(filename): filename for filename in filenames}
+        removed = [name for name in self.files if name not in entries]
+        for name in removed:
+            del self.files[name]
+            self.modified = True
+        changed = self._update(entries)
+        if removed and not changed:
+            changed = self._refresh_counterparts()
+        return changed
+
+    def _update(self, entries: dict[str, str]) -> set[str]:
+        rescanned = False
+        for entry, filename in entries.items():
+            known = self.files.get(entry)
+            try:
+                stat = os.stat(filename)
+                stamp = [stat.st_mtime_ns, stat.st_size]
+                if known is not None and known.stamp == stamp:
+                    continue
+                with open(filename, "rb") as f:
+                    source = f.read()
+            except FileNotFoundError:
+                if self.files.pop(entry, None) is not None:
+                    self.modified = rescanned = True
+                continue
+            self.modified = True
+            digest = content_digest(source)
+            if known is not None and known.digest == digest:
+                known.stamp = stamp
+                continue
+            self.files[entry] = scan_source(source, digest)
+            self.files[entry].stamp = stamp
+            rescanned = True
+        if not rescanned:
+            return set()
+        return self._refresh_counterparts()
+
+    def _refresh_counterparts(self) -> set[str]:
+        old, self.counterparts = self.counterparts, self.resolve()
+        return {
+            name
+            for name in old.keys() | self.counterparts.keys()
+            if old.get(name) != self.counterparts.get(name)
+        }
+
+    def referencing(self, names: set[str]) -> list[str]:
+        """
+        The files that await any of the given names
+        """
+        if not names:
+            return []
+        return [
+            str(self.project_base / entry)
+            for entry, symbols in self.files.items()
+            if not names.isdisjoint(symbols.references)
+        ]
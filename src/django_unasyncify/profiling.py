@@ -0,0 +1,128 @@
+"""
+Measuring where the time goes during a transform run
+"""
+
+import json
+import time
+from collections.abc import Callable, Iterator, Sequence
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Any
+
+# cProfile and pstats only get imported when profiling, to keep startup quick
+if TYPE_CHECKING:
+    import pstats
+
+    from .runner import FileResult
+
+# the phases a single file goes through, in order
+FILE_PHASES = (
+    "read",
+    "parse",
+    "walk",
+    "leave_FunctionDef",
+    "imports",
+    "codegen",
+    "write",
+)
+
+
+class PhaseTimer:
+    """
+    Accumulates wall time spent in named phases
+    """
+
+    timings: dict[str, float]
+
+    def __init__(self) -> None:
+        self.timings = {}
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.timings[name] = self.timings.get(name, 0.0) + elapsed
+
+
+class CollectedStats:
+    """
+    Raw cProfile data, in a shape that pstats knows how to load
+    """
+
+    def __init__(self, stats: dict) -> None:
+        self.stats = stats
+
+    def create_stats(self) -> None:
+        pass
+
+
+def run_profiled[T](f: Callable[[], T]) -> tuple[T, dict]:
+    """
+    Call f under cProfile, returning its result and the (picklable) raw stats
+    """
+    import cProfile
+
+    profiler = cProfile.Profile()
+    result = profiler.runcall(f)
+    profiler.create_stats()
+    return result, profiler.stats  # type: ignore[attr-defined]
+
+
+def merge_profile_stats(all_stats: Sequence[dict]) -> "pstats.Stats | None":
+    import pstats
+
+    merged: pstats.Stats | None = None
+    for stats in all_stats:
+        if merged is None:
+            merged = pstats.Stats(CollectedStats(stats))  # type: ignore[arg-type]
+        else:
+            merged.add(CollectedStats(stats))  # type: ignore[arg-type]
+    return merged
+
+
+def build_report(
+    results: Sequence["FileResult"],
+    phase_timings: dict[str, float],
+    wall_time: float,
+    top: int,
+) -> dict[str, Any]:
+    """
+    Put together a JSON-friendly report of a run
+
+    phase_timings holds the timings of the phases that happen once per run
+    (like file discovery), file-level phases get summed up across files.
+    """
+    phases = dict(phase_timings)
+    for phase in FILE_PHASES:
+        phases[phase] = sum(result.timings.get(phase, 0.0) for result in results)
+
+    files: list[dict[str, Any]] = [
+        {
+            "filename": result.filename,
+            "total": sum(result.timings.values()),
+            "phases": result.timings,
+            "functions_generated": result.functions_generated,
+            "changed": result.changed,
+            "failed": result.error is not None,
+        }
+        for result in results
+    ]
+    slowest = sorted(files, key=lambda entry: entry["total"], reverse=True)[:top]
+    return {
+        "wall_time": wall_time,
+        "file_count": len(results),
+        "functions_generated": sum(result.functions_generated for result in results),
+        "phases": phases,
+        "slowest_files": [
+            {"filename": entry["filename"], "total": entry["total"]}
+            for entry in slowest
+        ],
+        "files": files,
+    }
+
+
+def write_report(report: dict[str, Any], path: str) -> None:
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
@@ -0,0 +1,84 @@
+"""
+Reporting on the progress of a run
+"""
+
+import sys
+import time
+from typing import TextIO
+
+# how often (in seconds) to update the progress line in a terminal,
+# and to log progress otherwise
+TERMINAL_INTERVAL = 0.2
+LOG_INTERVAL = 5.0
+
+
+class Progress:
+    """
+    Show how many files were transformed so far, and how fast we are going
+
+    In a terminal, this is a single line that keeps getting updated. Elsewhere
+    (like CI logs), we only print a line every few seconds when asked to (with
+    log=True). Either way, the overall throughput is reported at the end.
+    """
+
+    total: int
+    done: int
+    stream: TextIO
+    interactive: bool
+    # whether to report progress as we go
+    enabled: bool
+    interval: float
+
+    def __init__(
+        self, total: int, stream: TextIO | None = None, log: bool = False
+    ) -> None:
+        self.total = total
+        self.done = 0
+        self.stream = stream if stream is not None else sys.stderr
+        self.interactive = self.stream.isatty()
+        self.enabled = self.interactive or log
+        self.interval = TERMINAL_INTERVAL if self.interactive else LOG_INTERVAL
+        self.start = time.perf_counter()
+        self.last_shown = self.start
+        # whether the terminal currently shows our progress line
+        self.showing = False
+
+    def rate(self) -> float:
+        elapsed = time.perf_counter() - self.start
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    def status(self) -> str:
+        return f"[{self.done}/{self.total}] {self.rate():.1f} files/s"
+
+    def clear(self) -> None:
+        """
+        Get the progress line out of the way, before printing something else
+        """
+        if self.showing:
+            self.stream.write("\r\033[K")
+            self.stream.flush()
+            self.showing = False
+
+    def advance(self) -> None:
+        self.done += 1
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        if now - self.last_shown < self.interval and self.done < self.total:
+            return
+        self.last_shown = now
+        if self.interactive:
+            self.stream.write(f"\r\033[K{self.status()}")
+            self.showing = True
+        else:
+            self.stream.write(f"{self.status()}\n")
+        self.stream.flush()
+
+    def finish(self) -> None:
+        self.clear()
+        elapsed = time.perf_counter() - self.start
+        self.stream.write(
+            f"Transformed {self.done} file(s) in {elapsed:.2f}s "
+            f"({self.rate():.1f} files/s)\n"
+        )
+        self.stream.flush()
@@ -0,0 +1,402 @@
+"""
+Running the transform over files
+"""
+
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+import traceback
+import warnings
+from collections.abc import Iterator, Sequence
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from multiprocessing.context import BaseContext
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, field, replace
+
+import libcst as cst
+from libcst.codemod import CodemodContext, SkipFile
+from libcst.helpers import calculate_module_and_package
+
+from .codemod import UnasyncifyMethodCommand
+from .config import Config
+from .index import SymbolIndex
+from .profiling import PhaseTimer, run_profiled
+from .splice import transform_source
+
+# "libcst" runs the codemod over whole files, "fast" only over the marked
+# functions in them (see splice.py)
+ENGINES = ("libcst", "fast")
+
+# below this much code in total, starting up worker processes
+# costs more than it saves
+IN_PROCESS_MAX_BYTES = 256 * 1024
+# workers get replaced after this many files (or so), so that memory held
+# onto after transforming large files doesn't pile up
+MAX_FILES_PER_WORKER = 100
+# how many files to have queued up per worker, files only get handed out
+# as earlier ones complete so that results don't pile up in memory
+FILES_IN_FLIGHT_PER_WORKER = 2
+
+
+@dataclass
+class FileResult:
+    filename: str
+    # whether the transformed code differs from what was on disk
+    changed: bool
+    # a formatted traceback, if the transform failed
+    error: str | None = None
+    # time spent in each phase (only collected when profiling)
+    timings: dict[str, float] = field(default_factory=dict)
+    functions_generated: int = 0
+    # raw cProfile data (only collected when asked for)
+    profile_stats: dict | None = None
+    # whether the file was skipped for taking too long
+    timed_out: bool = False
+
+
+@dataclass
+class RunOptions:
+    repo_root: str = "."
+    # when False, we only report whether files would change
+    write: bool = True
+    # collect per-phase timings
+    profile: bool = False
+    # run each file under cProfile
+    cprofile: bool = False
+    # skip files that take longer than this many seconds to transform
+    timeout: float | None = None
+    # one of ENGINES
+    engine: str = "libcst"
+
+
+class FileTimeout(Exception):
+    pass
+
+
+@contextmanager
+def time_limit(seconds: float | None) -> Iterator[None]:
+    """
+    Raise FileTimeout if the block takes longer than seconds
+
+    This relies on SIGALRM, so it's only enforced in the main thread
+    (worker processes run files in theirs), on platforms that have it.
+    """
+    if (
+        not seconds
+        or not hasattr(signal, "SIGALRM")
+        or threading.current_thread() is not threading.main_thread()
+    ):
+        yield
+        return
+
+    def on_alarm(signum, frame):
+        raise FileTimeout()
+
+    previous = signal.signal(signal.SIGALRM, on_alarm)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def prepare_context(repo_root: str, filename: str) -> CodemodContext:
+    try:
+        module_and_package = calculate_module_and_package(repo_root, filename)
+    except ValueError:
+        return CodemodContext(filename=filename)
+    return CodemodContext(
+        filename=filename,
+        full_module_name=module_and_package.name,
+        full_package_name=module_and_package.package,
+    )
+
+
+def transform_code(
+    codemod: UnasyncifyMethodCommand,
+    code: bytes,
+    timer: PhaseTimer | None = None,
+    engine: str = "libcst",
+) -> bytes:
+    """
+    Run the codemod over some source code, returning the new source code
+
+    The codemod's context should already be set up.
+    """
+    if engine == "fast":
+        with timer.phase("splice") if timer is not None else nullcontext():
+            spliced = transform_source(codemod, code)
+        if spliced is not None:
+            new_code, codemod.functions_generated, codemod.functions_reused = spliced
+            return new_code
+        # not something the fast engine knows how to handle
+    # only have the codemod time itself if someone is looking
+    codemod.timer = timer
+    timer = timer or PhaseTimer()
+    with timer.phase("parse"):
+        input_tree = cst.parse_module(code)
+    try:
+        with timer.phase("walk"):
+            output_tree = codemod.transform_module(input_tree)
+    except SkipFile:
+        return code
+    finally:
+        codemod.timer = None
+    # the codemod's own phases happen during the walk, don't count them twice
+    for phase in ("leave_FunctionDef", "imports"):
+        timer.timings["walk"] -= timer.timings.get(phase, 0.0)
+    with timer.phase("codegen"):
+        return output_tree.bytes
+
+
+def transform_file(
+    codemod: UnasyncifyMethodCommand,
+    filename: str,
+    repo_root: str = ".",
+    write: bool = True,
+    profile: bool = False,
+    timeout: float | None = None,
+    engine: str = "libcst",
+) -> FileResult:
+    """
+    Transform a single file in place (only writing it if it changed)
+
+    With write=False, we only report whether the file would change. Files
+    that take longer than timeout seconds are left untouched.
+    """
+    timer = PhaseTimer()
+    try:
+        # the write isn't covered, we don't want to leave a file half-written
+        with time_limit(timeout):
+            with timer.phase("read"), open(filename, "rb") as f:
+                old_code = f.read()
+            codemod.context = prepare_context(repo_root, filename)
+            new_code = transform_code(
+                codemod, old_code, timer if profile else None, engine=engine
+            )
+    except FileTimeout:
+        return FileResult(
+            filename,
+            changed=False,
+            error=f"Took longer than {timeout:g}s to transform",
+            timed_out=True,
+        )
+    except Exception:
+        return FileResult(filename, changed=False, error=traceback.format_exc())
+
+    changed = new_code != old_code
+    if changed and write:
+        with timer.phase("write"), open(filename, "wb") as f:
+            f.write(new_code)
+    return FileResult(
+        filename,
+        changed=changed,
+        timings=timer.timings if profile else {},
+        functions_generated=codemod.functions_generated,
+    )
+
+
+def report_result(result: FileResult) -> None:
+    if result.timed_out:
+        print(f"Skipped {result.filename}: {result.error}", file=sys.stderr)
+    elif result.error is not None:
+        print(f"Failed to transform {result.filename}:", file=sys.stderr)
+        print(result.error, file=sys.stderr)
+    elif result.changed:
+        print(f"Regenerated {result.filename}")
+
+
+def transform_with_options(
+    codemod: UnasyncifyMethodCommand, filename: str, options: RunOptions
+) -> FileResult:
+    def run() -> FileResult:
+        return transform_file(
+            codemod,
+            filename,
+            repo_root=options.repo_root,
+            write=options.write,
+            profile=options.profile,
+            timeout=options.timeout,
+            engine=options.engine,
+        )
+
+    if not options.cprofile:
+        return run()
+    result, stats = run_profiled(run)
+    result.profile_stats = stats
+    return result
+
+
+@dataclass
+class ProjectBatch:
+    """
+    Files from one project, to be transformed with its config
+    """
+
+    config: Config
+    files: Sequence[str]
+    options: RunOptions
+    symbol_index: SymbolIndex | None = None
+
+    def codemod(self) -> UnasyncifyMethodCommand:
+        return UnasyncifyMethodCommand(
+            context=CodemodContext(), config=self.config, symbol_index=self.symbol_index
+        )
+
+
+# each worker process builds a codemod once per project (the first time it
+# gets one of its files), and reuses it for every file of that project
+_worker_projects: list[ProjectBatch] = []
+_worker_codemods: dict[int, UnasyncifyMethodCommand] = {}
+
+
+def _init_worker(projects: list[ProjectBatch]) -> None:
+    global _worker_projects
+    _worker_projects = projects
+    _worker_codemods.clear()
+
+
+def _transform_in_worker(filename: str, project: int = 0) -> FileResult:
+    assert _worker_projects, "Worker was not initialized"
+    batch = _worker_projects[project]
+    codemod = _worker_codemods.get(project)
+    if codemod is None:
+        codemod = _worker_codemods[project] = batch.codemod()
+    return transform_with_options(codemod, filename, batch.options)
+
+
+def file_size(filename: str) -> int:
+    try:
+        return os.path.getsize(filename)
+    except OSError:
+        # we'll report on this when trying to read the file
+        return 0
+
+
+def run_transforms(
+    config: Config,
+    files: Sequence[str],
+    options: RunOptions,
+    jobs: int | None = None,
+    symbol_index: SymbolIndex | None = None,
+) -> Iterator[FileResult]:
+    """
+    Transform files, yielding results as they come in (each file having
+    been written out already)
+
+    Small batches are transformed in this process, larger ones get spread
+    over (up to) `jobs` worker processes.
+    """
+    return run_batches([ProjectBatch(config, files, options, symbol_index)], jobs)
+
+
+def run_batches(
+    batches: Sequence[ProjectBatch], jobs: int | None = None
+) -> Iterator[FileResult]:
+    """
+    Like run_transforms, for files from several projects at once
+
+    Every project shares the same worker processes, so that a run over many
+    small projects doesn't pay for starting up workers over and over again.
+    """
+    jobs = jobs or os.cpu_count() or 1
+    # (project, filename) for every file
+    tasks = [
+        (project, filename)
+        for project, batch in enumerate(batches)
+        for filename in batch.files
+    ]
+    sizes = {task: file_size(task[1]) for task in tasks}
+    if jobs == 1 or len(tasks) <= 1 or sum(sizes.values()) <= IN_PROCESS_MAX_BYTES:
+        # not worth paying for process startup
+        for batch in batches:
+            if not batch.files:
+                continue
+            codemod = batch.codemod()
+            for filename in batch.files:
+                yield transform_with_options(codemod, filename, batch.options)
+        return
+
+    # Workers pick up files in the order they were submitted. Handing out
+    # the largest files first means we don't end up with every worker idle
+    # but one, still busy with a large file it only started at the end.
+    by_size = sorted(tasks, key=sizes.__getitem__, reverse=True)
+    # workers only need the settings, not the files of each project
+    projects = [replace(batch, files=[]) for batch in batches]
+    workers = min(jobs, len(tasks))
+    # Workers get replaced by starting a new pool every so often, rather
+    # than with max_tasks_per_child, which only works with the "spawn"
+    # start method (see pool_context)
+    files_per_pool = workers * MAX_FILES_PER_WORKER
+    for start in range(0, len(by_size), files_per_pool):
+        yield from run_pool(
+            by_size[start : start + files_per_pool],
+            projects,
+            workers,
+            replacing=start > 0,
+        )
+
+
+def pool_context() -> BaseContext | None:
+    """
+    The multiprocessing context workers get started with
+
+    We fork where we can: workers start out with libcst already imported,
+    and scripts calling into us don't need an `if __name__ == "__main__"`
+    guard (which "spawn" needs, to import the script in every worker).
+    """
+    if "fork" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("fork")
+    return None
+
+
+def run_pool(
+    tasks: Sequence[tuple[int, str]],
+    projects: list[ProjectBatch],
+    workers: int,
+    replacing: bool = False,
+) -> Iterator[FileResult]:
+    """
+    Transform (project, filename) tasks with a new pool of worker processes,
+    handing them out in order
+
+    replacing is set when this pool replaces the workers of a previous one.
+    """
+    with ProcessPoolExecutor(
+        max_workers=min(workers, len(tasks)),
+        mp_context=pool_context(),
+        initializer=_init_worker,
+        initargs=(projects,),
+    ) as executor:
+        queued = iter(tasks)
+        pending: set[Future[FileResult]] = set()
+
+        def submit_next() -> None:
+            task = next(queued, None)
+            if task is not None:
+                project, filename = task
+                pending.add(
+                    executor.submit(_transform_in_worker, filename, project=project)
+                )
+
+        with warnings.catch_warnings():
+            if replacing:
+                # Forked workers get started on the first submit. The threads
+                # of the previous pool are done by then, but might not have
+                # exited yet, which makes fork() warn about threads that
+                # aren't there anymore.
+                warnings.filterwarnings(
+                    "ignore", "This process .* is multi-threaded", DeprecationWarning
+                )
+            for _ in range(min(workers, len(tasks)) * FILES_IN_FLIGHT_PER_WORKER):
+                submit_next()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                pending.remove(future)
+                # keep the workers busy before handing the result over
+                submit_next()
+                yield future.result()
@@ -1,10 +1,28 @@
 from pathlib import Path
-from shutil import copyfile
+
+codegen_location = Path(__file__).parent / "_codegen.py"
+
+
+def codegen_template_is_current(target_location) -> bool:
+    """
+    Check whether the codegen template is already in place, as-is
+    """
+    try:
+        with open(target_location, "rb") as f:
+            return f.read() == codegen_location.read_bytes()
+    except FileNotFoundError:
+        return False
 
 
 def ensure_codegen_template(target_location):
     """
     Insert the codegen template to where it's needed
     """
-    codegen_location = Path(__file__).parent / "_codegen.py"
+    # leave an identical file alone, so that its mtime doesn't change
+    # (and things like bytecode caches or autoreloaders aren't disturbed)
+    if codegen_template_is_current(target_location):
+        return
+    # only imported when needed, to keep startup quick
+    from shutil import copyfile
+
     copyfile(src=codegen_location, dst=target_location)
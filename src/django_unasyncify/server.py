@@ -0,0 +1,265 @@
+"""
+A long-running server transforming code on request
+
+Editors (and other tools) wanting to preview the sync variants of the code
+being edited can't afford to start up the command line every time, most of
+which goes into importing libcst and setting up the codemod. Instead, they
+can start `django-unasyncify --server` once, and send it requests.
+
+Requests and responses are JSON-RPC 2.0 messages, one per line, over
+stdin and stdout:
+
+    --> {"jsonrpc": "2.0", "id": 1, "method": "transform",
+         "params": {"code": "...", "filename": "app/models.py"}}
+    <-- {"jsonrpc": "2.0", "id": 1,
+         "result": {"code": "...", "changed": true, "functions_generated": 2}}
+
+Supported methods are:
+
+- transform (code, filename=None): the code, with its sync variants
+  (re)generated
+- transform_function (code, function, filename=None): only the sync variant
+  of function (a qualified name, like "QuerySet.aget"), along with the line
+  it starts on in the transformed code
+- shutdown: stop the server
+
+Nothing is ever written to disk.
+"""
+
+import ast
+import json
+import sys
+import traceback
+from collections.abc import Callable
+from typing import Any, TextIO
+
+import libcst as cst
+from libcst.codemod import CodemodContext
+
+from .codemod import UnasyncifyMethodCommand
+from .config import Config
+from .discovery import contains_marker
+from .index import SymbolIndex, nested_bodies, sync_function_name
+from .runner import transform_code
+from .splice import statement_start
+
+# standard JSON-RPC error codes
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+# code that couldn't be transformed
+TRANSFORM_ERROR = -32000
+
+# transformed once on startup, so that the first request doesn't have
+# to pay for loading the parser and compiling matchers
+WARMUP_CODE = b"""\
+class Warmup:
+    @generate_unasynced
+    async def awarm(self):
+        await self.aup()
+"""
+
+
+class RequestError(Exception):
+    def __init__(self, code: int, message: str) -> None:
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+def find_function(
+    module: ast.Module, qualified_name: str
+) -> ast.FunctionDef | ast.AsyncFunctionDef | None:
+    """
+    Find a function by its qualified name (classes and functions it is
+    nested in, separated by dots)
+    """
+    *parents, name = qualified_name.split(".")
+    bodies = [module.body]
+    for parent in parents:
+        bodies = [
+            list(statement.body)
+            for statement in all_statements(bodies)
+            if isinstance(
+                statement, (ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)
+            )
+            and statement.name == parent
+        ]
+    for statement in all_statements(bodies):
+        if (
+            isinstance(statement, (ast.FunctionDef, ast.AsyncFunctionDef))
+            and statement.name == name
+        ):
+            return statement
+    return None
+
+
+def all_statements(bodies: list[list[ast.stmt]]) -> list[ast.stmt]:
+    """
+    Statements of bodies, including the ones in if/try... blocks
+    (but not in classes or functions)
+    """
+    statements = []
+    for body in bodies:
+        for statement in body:
+            statements.append(statement)
+            if not isinstance(
+                statement, (ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)
+            ):
+                statements.extend(all_statements(list(nested_bodies(statement))))
+    return statements
+
+
+class TransformServer:
+    """
+    Answers transform requests with a codemod that stays loaded
+    """
+
+    codemod: UnasyncifyMethodCommand
+    engine: str
+    methods: dict[str, Callable[[dict[str, Any]], Any]]
+    running: bool
+
+    def __init__(
+        self,
+        config: Config,
+        symbol_index: SymbolIndex | None = None,
+        engine: str = "fast",
+    ) -> None:
+        self.codemod = UnasyncifyMethodCommand(
+            context=CodemodContext(), config=config, symbol_index=symbol_index
+        )
+        self.engine = engine
+        self.methods = {
+            "transform": self.rpc_transform,
+            "transform_function": self.rpc_transform_function,
+            "shutdown": self.rpc_shutdown,
+        }
+        self.running = True
+        self.transform(WARMUP_CODE, None)
+
+    def transform(self, code: bytes, filename: str | None) -> bytes:
+        if not contains_marker(code):
+            self.codemod.functions_generated = 0
+            return code
+        self.codemod.context = CodemodContext(filename=filename)
+        try:
+            return transform_code(self.codemod, code, engine=self.engine)
+        except cst.ParserSyntaxError as e:
+            raise RequestError(TRANSFORM_ERROR, f"Could not parse code: {e}")
+
+    def rpc_transform(self, params: dict[str, Any]) -> dict[str, Any]:
+        code = string_param(params, "code")
+        new_code = self.transform(code.encode("utf-8"), optional_filename(params))
+        return {
+            "code": new_code.decode("utf-8"),
+            "changed": new_code != code.encode("utf-8"),
+            "functions_generated": self.codemod.functions_generated,
+        }
+
+    def rpc_transform_function(self, params: dict[str, Any]) -> dict[str, Any]:
+        code = string_param(params, "code")
+        function = string_param(params, "function")
+        *parents, name = function.split(".")
+        sync_name = sync_function_name(name)
+        if sync_name is None:
+            raise RequestError(
+                INVALID_PARAMS, f"{name} is not named like an async function"
+            )
+        new_code = self.transform(
+            code.encode("utf-8"), optional_filename(params)
+        ).decode("utf-8")
+        node = find_function(ast.parse(new_code), ".".join([*parents, sync_name]))
+        if node is None:
+            raise RequestError(
+                TRANSFORM_ERROR, f"No sync variant was generated for {function}"
+            )
+        start = statement_start(node)
+        lines = new_code.splitlines(keepends=True)
+        return {
+            "name": sync_name,
+            "code": "".join(lines[start - 1 : node.end_lineno]),
+            "line": start,
+        }
+
+    def rpc_shutdown(self, params: dict[str, Any]) -> None:
+        self.running = False
+
+    def handle(self, message: str) -> dict[str, Any] | None:
+        """
+        Answer a single request, returning the response (or None for
+        notifications, which don't get one, even when they fail)
+
+        Messages that can't be told apart from notifications, because they
+        aren't valid requests to begin with, still get an error back.
+        """
+        request_id = None
+        notification = False
+        try:
+            try:
+                request = json.loads(message)
+            except ValueError as e:
+                raise RequestError(PARSE_ERROR, f"Invalid JSON: {e}")
+            if not isinstance(request, dict) or not isinstance(
+                request.get("method"), str
+            ):
+                raise RequestError(INVALID_REQUEST, "Not a JSON-RPC request")
+            request_id = request.get("id")
+            notification = "id" not in request
+            method = self.methods.get(request["method"])
+            if method is None:
+                raise RequestError(
+                    METHOD_NOT_FOUND, f"Unknown method {request['method']}"
+                )
+            params = request.get("params", {})
+            if not isinstance(params, dict):
+                raise RequestError(INVALID_PARAMS, "params must be an object")
+            result = method(params)
+        except RequestError as e:
+            error = {"code": e.code, "message": e.message}
+        except Exception:
+            error = {"code": TRANSFORM_ERROR, "message": traceback.format_exc()}
+        else:
+            if notification:
+                return None
+            return {"jsonrpc": "2.0", "id": request_id, "result": result}
+        if notification:
+            return None
+        return {"jsonrpc": "2.0", "id": request_id, "error": error}
+
+    def serve(self, input: TextIO, output: TextIO) -> None:
+        """
+        Answer requests until shut down, or until input is closed
+        """
+        for line in input:
+            if not line.strip():
+                continue
+            response = self.handle(line)
+            if response is not None:
+                output.write(json.dumps(response) + "\n")
+                output.flush()
+            if not self.running:
+                break
+
+
+def string_param(params: dict[str, Any], name: str) -> str:
+    value = params.get(name)
+    if not isinstance(value, str):
+        raise RequestError(INVALID_PARAMS, f"{name} must be a string")
+    return value
+
+
+def optional_filename(params: dict[str, Any]) -> str | None:
+    if params.get("filename") is None:
+        return None
+    return string_param(params, "filename")
+
+
+def serve(config: Config, symbol_index: SymbolIndex | None = None) -> None:
+    """
+    Answer requests over stdin and stdout
+    """
+    server = TransformServer(config, symbol_index)
+    print("django-unasyncify server ready", file=sys.stderr, flush=True)
+    server.serve(sys.stdin, sys.stdout)
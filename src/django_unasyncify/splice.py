@@ -0,0 +1,303 @@
+"""
+A faster way of running the codemod over a file
+
+Most of the time spent on a file goes into libcst parsing (and printing
+back out) all of it, when we only ever touch the functions marked with
+our decorators. Here, we find those functions with the standard library's
+ast module instead, run the codemod over just their source code, and
+splice the results back into the file.
+
+Runs of sibling marked functions get handled together, as the codemod
+pairs up generated functions with the async function they come from.
+Indented functions are wrapped in an `if 1:` block, so that their source
+code can be used as is, and top-level ones come after a `pass` statement,
+so that comments above them aren't taken for the module's header.
+
+Anything this doesn't know how to handle exactly the way the codemod
+would (missing imports, marked functions nested in one another, odd
+comment placement, unusual encodings...) returns None, meaning the file
+should go through the codemod as usual.
+"""
+
+import ast
+import re
+from collections.abc import Iterator
+from dataclasses import replace
+
+import libcst as cst
+from libcst.metadata import MetadataWrapper
+
+from .codemod import UnasyncifyMethodCommand
+from .index import nested_bodies, sync_function_name
+
+MARKERS = ("generate_unasynced", "from_codegen")
+CODING_COOKIE = re.compile(rb"^[ \t\f]*#.*?coding[:=]", re.MULTILINE)
+# what goes in front of indented snippets, and top-level ones
+INDENTED_WRAPPER = "if 1:\n"
+TOP_LEVEL_WRAPPER = "pass\n"
+
+
+def run_on_snippet(codemod: UnasyncifyMethodCommand, snippet: cst.Module) -> str:
+    """
+    Run the codemod over a freshly parsed snippet
+
+    Unlike Codemod.transform_module, this doesn't copy the tree first (no
+    one else holds on to it), nor run AddImportsVisitor.
+    """
+    wrapper = MetadataWrapper(snippet, unsafe_skip_copy=True)
+    old_context = codemod.context
+    with codemod.resolve(wrapper):
+        codemod.context = replace(old_context, wrapper=wrapper)
+        try:
+            return codemod.transform_module_impl(wrapper.module).code
+        finally:
+            codemod.context = old_context
+
+
+def marker(node: ast.stmt) -> str | None:
+    """
+    The marker decorator (see is_marked_function) on a function, if any
+    """
+    if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+        return None
+    if not node.decorator_list:
+        return None
+    decorator = node.decorator_list[0]
+    if isinstance(decorator, ast.Call):
+        decorator = decorator.func
+    if isinstance(decorator, ast.Name) and decorator.id in MARKERS:
+        return decorator.id
+    return None
+
+
+def module_imports(module: ast.Module) -> dict[str, set[str | None]]:
+    """
+    Like codemod.find_existing_imports, but from the ast
+    """
+    imports: dict[str, set[str | None]] = {}
+    for statement in module.body:
+        if isinstance(statement, ast.Import):
+            for alias in statement.names:
+                if alias.asname is None:
+                    imports.setdefault(alias.name, set()).add(None)
+        elif (
+            isinstance(statement, ast.ImportFrom)
+            and not statement.level
+            and statement.module is not None
+        ):
+            imports.setdefault(statement.module, set()).update(
+                alias.name
+                for alias in statement.names
+                if alias.asname is None and alias.name != "*"
+            )
+    return imports
+
+
+def header_end(node: ast.AST) -> int:
+    """
+    The last line of a compound statement that comes before its body
+    """
+    if isinstance(node, ast.Module):
+        return 0
+    end = getattr(node, "lineno", 0)
+    for child in ast.iter_child_nodes(node):
+        if isinstance(child, (ast.expr, ast.arguments, ast.keyword, ast.withitem)):
+            end = max(end, getattr(child, "end_lineno", None) or 0)
+    return end
+
+
+def statement_start(statement: ast.stmt) -> int:
+    """
+    The first line of a statement, decorators included
+    """
+    decorators = getattr(statement, "decorator_list", None)
+    if decorators:
+        return min(statement.lineno, decorators[0].lineno)
+    return statement.lineno
+
+
+def marked_runs(
+    parent: ast.AST, body: list[ast.stmt]
+) -> Iterator[tuple[ast.AST, list[ast.stmt], int, int]]:
+    """
+    Every run of consecutive marked functions, as (parent, body, first
+    index, last index), in source order
+    """
+    index = 0
+    while index < len(body):
+        statement = body[index]
+        if marker(statement) is None:
+            for nested in nested_bodies(statement):
+                yield from marked_runs(statement, nested)
+            index += 1
+            continue
+        last = index
+        while last + 1 < len(body) and marker(body[last + 1]) is not None:
+            last += 1
+        yield parent, body, index, last
+        index = last + 1
+
+
+def is_blank(line: str) -> bool:
+    return not line.strip()
+
+
+def is_comment(line: str, prefix: str) -> bool:
+    return line.startswith(prefix) and line[len(prefix) :].startswith("#")
+
+
+def is_deeper_comment(line: str, prefix: str) -> bool:
+    rest = line[len(prefix) :]
+    return (
+        line.startswith(prefix)
+        and rest[:1] in (" ", "\t")
+        and rest.lstrip().startswith("#")
+    )
+
+
+def pairings(runs: list[list[ast.stmt]], per_run: bool) -> dict[int, int | None]:
+    """
+    Which generated function each async function takes the place of
+    (see UnasyncifyMethodCommand.unasyncify_function), by line
+    """
+    paired: dict[int, int | None] = {}
+    removed: dict[str, int] = {}
+    for run in runs:
+        if per_run:
+            removed = {}
+        for function in run:
+            assert isinstance(function, (ast.FunctionDef, ast.AsyncFunctionDef))
+            if marker(function) == "from_codegen":
+                removed[function.name] = function.lineno
+            else:
+                new_name = sync_function_name(function.name)
+                paired[function.lineno] = (
+                    removed.pop(new_name, None) if new_name is not None else None
+                )
+    return paired
+
+
+def transform_source(
+    codemod: UnasyncifyMethodCommand, code: bytes
+) -> tuple[bytes, int, int] | None:
+    """
+    Transform code like the codemod would, returning the new code along
+    with the number of functions generated and reused
+
+    Returns None when the codemod should be used the usual way instead.
+    """
+    if code.startswith(b"\xef\xbb\xbf") or CODING_COOKIE.search(code, 0, 200):
+        return None
+    if b"\r" in code or b"\f" in code:
+        return None
+    try:
+        text = code.decode("utf-8")
+        module = ast.parse(code)
+    except (SyntaxError, ValueError):
+        # let the codemod report on it
+        return None
+
+    # (str.splitlines also splits on characters that aren't line breaks
+    # as far as python is concerned)
+    lines = text.split("\n")
+    if lines[-1]:
+        lines = [line + "\n" for line in lines[:-1]] + [lines[-1]]
+    else:
+        lines = [line + "\n" for line in lines[:-1]]
+    runs = list(marked_runs(module, module.body))
+    if not runs:
+        return code, 0, 0
+    run_functions = [body[first : last + 1] for _, body, first, last in runs]
+    for functions in run_functions:
+        for function in functions:
+            if any(
+                marker(child) is not None
+                for child in ast.walk(function)
+                if child is not function and isinstance(child, ast.stmt)
+            ):
+                # the codemod handles nested marked functions inside out
+                return None
+    if pairings(run_functions, per_run=True) != pairings(run_functions, per_run=False):
+        # generated functions are paired up across runs
+        return None
+
+    # imports are checked against the whole module, and rather than adding
+    # missing ones (to the snippet), the codemod records them
+    codemod.module_imports = module_imports(module)
+    codemod.missing_imports = set()
+    try:
+        return splice_runs(codemod, lines, runs)
+    finally:
+        codemod.module_imports = None
+
+
+def splice_runs(
+    codemod: UnasyncifyMethodCommand,
+    lines: list[str],
+    runs: list[tuple[ast.AST, list[ast.stmt], int, int]],
+) -> tuple[bytes, int, int] | None:
+    generated = reused = 0
+    # (start, end) line indexes to replace, and what to replace them with
+    replacements: list[tuple[int, int, str]] = []
+    for parent, body, first, last in runs:
+        if isinstance(parent, ast.Module) and first == 0:
+            # comments above might be the module's header
+            return None
+        start = statement_start(body[first]) - 1
+        decorator_line = lines[start]
+        prefix = decorator_line[: len(decorator_line) - len(decorator_line.lstrip())]
+        if not decorator_line[len(prefix) :].startswith("@"):
+            return None
+
+        # blank lines and comments right above belong to the first function
+        lower_bound = (
+            body[first - 1].end_lineno or 0 if first > 0 else header_end(parent)
+        )
+        while start > lower_bound and (
+            is_blank(lines[start - 1]) or is_comment(lines[start - 1], prefix)
+        ):
+            start -= 1
+        if start > lower_bound and lines[start - 1].lstrip().startswith("#"):
+            # comments at another indentation level are laid out in ways
+            # we don't want to second-guess
+            return None
+
+        # comments indented further down belong to the last function
+        end = body[last].end_lineno or 0
+        upper_bound = (
+            statement_start(body[last + 1]) - 1 if last + 1 < len(body) else len(lines)
+        )
+        scan = end
+        while scan < upper_bound and (
+            is_blank(lines[scan]) or is_deeper_comment(lines[scan], prefix)
+        ):
+            scan += 1
+            if not is_blank(lines[scan - 1]):
+                end = scan
+        if not lines[end - 1].endswith("\n"):
+            return None
+
+        wrapper = INDENTED_WRAPPER if prefix else TOP_LEVEL_WRAPPER
+        snippet = wrapper + "".join(lines[start:end])
+        try:
+            result = run_on_snippet(codemod, cst.parse_module(snippet))
+        except cst.ParserSyntaxError:
+            return None
+        generated += codemod.functions_generated
+        reused += codemod.functions_reused
+        if not result.startswith(wrapper):
+            return None
+        replacements.append((start, end, result[len(wrapper) :]))
+
+    if codemod.missing_imports:
+        # the codemod would add these to the top of the module
+        return None
+
+    parts = []
+    position = 0
+    for start, end, replacement in replacements:
+        parts.extend(lines[position:start])
+        parts.append(replacement)
+        position = end
+    parts.extend(lines[position:])
+    return "".join(parts).encode("utf-8"), generated, reused
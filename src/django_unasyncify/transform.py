@@ -1,6 +1,161 @@
+from collections.abc import Sequence
+
 import libcst as cst
 
-from django_unasyncify.config import Config
+from django_unasyncify.config import LOWERING_STRATEGIES, Config
+from django_unasyncify.index import SymbolIndex
+
+# renames to these names give us expressions with a known value
+CONSTANT_NAMES = {"True": True, "False": False}
+
+# wrappers running a sync function in a thread, so that async code can
+# await it: `await sync_to_async(f)(*args)`
+SYNC_TO_ASYNC_WRAPPERS = {
+    "sync_to_async",
+    "asgiref.sync.sync_to_async",
+    "SyncToAsync",
+    "asgiref.sync.SyncToAsync",
+    "database_sync_to_async",
+    "channels.db.database_sync_to_async",
+}
+# like the above, but taking the arguments directly: `await to_thread(f, *args)`
+TO_THREAD_WRAPPERS = {"to_thread", "asyncio.to_thread"}
+# receivers of method calls resolved through the symbol index
+INDEXED_RECEIVERS = {"self", "cls"}
+# expressions that can be called without wrapping them in parentheses
+CALLABLE_EXPRESSIONS = (cst.Name, cst.Attribute, cst.Call, cst.Subscript)
+
+
+def dotted_name(node: cst.BaseExpression) -> str | None:
+    """
+    The dotted name for an expression like `a.b.c` (None for anything else)
+    """
+    if isinstance(node, cst.Name):
+        return node.value
+    if isinstance(node, cst.Attribute):
+        prefix = dotted_name(node.value)
+        if prefix is not None:
+            return f"{prefix}.{node.attr.value}"
+    return None
+
+
+def block_statements(block: cst.BaseSuite) -> list[cst.BaseStatement]:
+    """
+    The statements of a block, as statements that can stand on their own
+    """
+    if isinstance(block, cst.IndentedBlock):
+        return list(block.body)
+    # if x: a; b
+    assert isinstance(block, cst.SimpleStatementSuite)
+    return [
+        cst.SimpleStatementLine(
+            body=block.body, trailing_whitespace=block.trailing_whitespace
+        )
+    ]
+
+
+def with_leading_lines(
+    statements: list[cst.BaseStatement], leading_lines: Sequence[cst.EmptyLine]
+) -> list[cst.BaseStatement]:
+    """
+    Add leading lines (blank lines and comments) in front of statements
+    """
+    if not statements or not leading_lines:
+        return statements
+    first = statements[0]
+    assert isinstance(first, (cst.SimpleStatementLine, cst.BaseCompoundStatement))
+    return [
+        first.with_changes(leading_lines=[*leading_lines, *first.leading_lines]),
+        *statements[1:],
+    ]
+
+
+def keep_parentheses(
+    original: cst.BaseExpression, replacement: cst.BaseExpression
+) -> cst.BaseExpression:
+    """
+    Have replacement take the place of original, parentheses included
+    """
+    if original.lpar and not replacement.lpar:
+        return replacement.with_changes(lpar=original.lpar, rpar=original.rpar)
+    return replacement
+
+
+def direct_call(call: cst.Call) -> cst.Call | None:
+    """
+    For a call going through a sync_to_async-style wrapper, the direct
+    call to the wrapped function (None for any other call)
+    """
+    func = call.func
+    if isinstance(func, cst.Call) and dotted_name(func.func) in SYNC_TO_ASYNC_WRAPPERS:
+        # sync_to_async(f, thread_sensitive=False)(*args) -> f(*args)
+        wrapped_args, args = func.args, call.args
+    elif dotted_name(func) in TO_THREAD_WRAPPERS:
+        # to_thread(f, *args) -> f(*args)
+        wrapped_args, args = call.args[:1], call.args[1:]
+    else:
+        return None
+    if not wrapped_args or wrapped_args[0].keyword or wrapped_args[0].star:
+        return None
+    wrapped = wrapped_args[0].value
+    if not isinstance(wrapped, CALLABLE_EXPRESSIONS) and not wrapped.lpar:
+        # (lambda: ...)()
+        wrapped = wrapped.with_changes(lpar=[cst.LeftParen()], rpar=[cst.RightParen()])
+    return cst.Call(func=wrapped, args=args, lpar=call.lpar, rpar=call.rpar)
+
+
+def gathered_tuple(call: cst.Call) -> cst.Tuple | None:
+    """
+    gather(a, b, *rest) -> (a, b, *rest)
+    """
+    elements: list[cst.BaseElement] = []
+    for arg in call.args:
+        if arg.keyword is not None or arg.star == "**":
+            # options like return_exceptions=True have no sync equivalent
+            return None
+        if arg.star == "*":
+            elements.append(cst.StarredElement(value=arg.value))
+        else:
+            elements.append(cst.Element(value=arg.value))
+    return cst.Tuple(elements=elements)
+
+
+def is_zero(node: cst.BaseExpression) -> bool:
+    return isinstance(node, (cst.Integer, cst.Float)) and node.evaluated_value == 0
+
+
+def is_indexed_call(func: cst.BaseExpression) -> bool:
+    """
+    Whether a called function is one the symbol index can pair up: a
+    plain function, or a method of self (or cls)
+
+    The index goes by name, so `await self.client.afetch()` (likely
+    some third-party object) doesn't get to use the `afetch` counterpart
+    found in the project.
+    """
+    if isinstance(func, cst.Name):
+        return True
+    return (
+        isinstance(func, cst.Attribute)
+        and isinstance(func.value, cst.Name)
+        and func.value.value in INDEXED_RECEIVERS
+    )
+
+
+class CallFinder(cst.CSTVisitor):
+    """
+    Find the calls out of a set of calls (by id) that are in a tree, holding
+    on to what we know about them
+    """
+
+    def __init__(self, calls: dict[int, tuple[cst.Call, str]]) -> None:
+        self.calls = calls
+        self.found: list[str] = []
+
+    def visit_Call(self, node: cst.Call) -> None:
+        known = self.calls.get(id(node))
+        if known is not None and known[0] is node:
+            self.found.append(known[1])
 
 
 class UnasyncifyMethod(cst.CSTTransformer):
@@ -9,12 +164,80 @@ class UnasyncifyMethod(cst.CSTTransformer):
     """
 
     config: Config
+    # when present, used to find the sync counterparts of async functions
+    symbol_index: SymbolIndex | None
     is_async_seen: bool
+    # expressions whose value we know, by id (holding on to the nodes
+    # themselves, so that ids don't get reused)
+    constants: dict[int, tuple[cst.BaseExpression, bool]]
+    # (ids of) the original If nodes that are elif branches
+    elifs: set[int]
+    # (ids of) names that aren't expressions on their own, like the
+    # `y` in `x.y`, or keywords in calls
+    non_expression_names: set[int]
+    # (ids of) expressions standing in for calls that do nothing in sync
+    # code (like asyncio.sleep(0)), removed when used as statements
+    dropped: dict[int, cst.BaseExpression]
+    # modules the generated code needs imported
+    needed_imports: set[str]
+    # (ids of) awaited calls a lowering strategy can't handle, with the
+    # error to raise if they make it into the generated code
+    unlowerable: dict[int, tuple[cst.Call, str]]
+    # how deep into the tree we are
+    depth: int
 
-    def __init__(self, config):
+    def __init__(self, config, symbol_index: SymbolIndex | None = None):
         self.config = config
+        self.symbol_index = symbol_index
         self.await_depth = 0
         self.is_async_seen = False
+        self.constants = {}
+        self.elifs = set()
+        self.non_expression_names = set()
+        self.dropped = {}
+        self.needed_imports = set()
+        self.unlowerable = {}
+        self.depth = 0
+
+    def on_visit(self, node: cst.CSTNode) -> bool:
+        self.depth += 1
+        return super().on_visit(node)
+
+    def on_leave(self, original_node, updated_node):
+        self.depth -= 1
+        result = super().on_leave(original_node, updated_node)
+        if self.depth == 0 and isinstance(result, cst.CSTNode):
+            # only now do we know which branches are gone (like the ones
+            # only taken when IS_ASYNC)
+            self.check_lowerings(result)
+        return result
+
+    def check_lowerings(self, node: cst.CSTNode) -> None:
+        if not self.unlowerable:
+            return
+        finder = CallFinder(self.unlowerable)
+        node.visit(finder)
+        if finder.found:
+            raise ValueError(finder.found[0])
+
+    def constant_value(self, node: cst.CSTNode) -> bool | None:
+        """
+        The value of node, if it's an expression we know the value of
+        """
+        known = self.constants.get(id(node))
+        if known is None or known[0] is not node:
+            return None
+        return known[1]
+
+    def constant(self, original_node: cst.BaseExpression, value: bool):
+        """
+        Build an expression for value, to replace original_node with
+        """
+        node = cst.Name(
+            value=str(value), lpar=original_node.lpar, rpar=original_node.rpar
+        )
+        self.constants[id(node)] = (node, value)
+        return node
 
     def visit_Await(self, node):
         self.await_depth += 1
@@ -22,25 +245,147 @@ class UnasyncifyMethod(cst.CSTTransformer):
     def leave_Await(self, original_node, updated_node):
         self.await_depth -= 1
         # we just remove the actual await
-        return updated_node.expression
+        expression = updated_node.expression
+        if isinstance(expression, cst.Call):
+            # and call functions run in a thread by async code directly
+            direct = direct_call(expression)
+            if direct is not None:
+                return keep_parentheses(updated_node, direct)
+            lowered = self.lowered_call(expression)
+            if lowered is not None:
+                return keep_parentheses(updated_node, lowered)
+        return expression
+
+    def lowering(self, call: cst.Call) -> str | None:
+        name = dotted_name(call.func)
+        return self.config.lowerings.get(name) if name is not None else None
+
+    def lowered_call(self, call: cst.Call) -> cst.BaseExpression | None:
+        """
+        The sync equivalent of an awaited call using one of the lowering
+        strategies, if it has one
+
+        Calls the strategy can't handle (like `gather(...,
+        return_exceptions=True)`) are recorded in unlowerable, to raise a
+        ValueError rather than leave them for sync code to call.
+        """
+        strategy = self.lowering(call)
+        if strategy not in LOWERING_STRATEGIES:
+            return None
+        positional = [arg for arg in call.args if arg.keyword is None]
+        if strategy == "tuple":
+            gathered = gathered_tuple(call)
+            if gathered is not None:
+                return gathered
+        elif strategy == "unwrap":
+            if call.args and call.args[0].keyword is None and not call.args[0].star:
+                # wait_for(aw, timeout) -> aw
+                return call.args[0].value
+        elif len(call.args) == 1 and len(positional) == 1 and not positional[0].star:
+            # strategy == "sleep"
+            if is_zero(positional[0].value):
+                # a yield point to the event loop, nothing to do in sync code
+                node = cst.Name("None")
+                self.dropped[id(node)] = node
+                return node
+            self.needed_imports.add("time")
+            return call.with_changes(
+                func=cst.Attribute(value=cst.Name("time"), attr=cst.Name("sleep"))
+            )
+        code = cst.Module(body=[]).code_for_node(call)
+        self.unlowerable[id(call)] = (
+            call,
+            f"Can't lower `await {code}` to sync code (with the {strategy!r} "
+            "lowering), use a form it supports or handle it with IS_ASYNC",
+        )
+        return None
+
+    def leave_Expr(self, original_node, updated_node):
+        dropped = self.dropped.get(id(updated_node.value))
+        if dropped is updated_node.value:
+            return cst.RemovalSentinel.REMOVE
+        return updated_node
+
+    def visit_Attribute(self, node):
+        self.non_expression_names.add(id(node.attr))
+
+    def visit_Arg(self, node):
+        if node.keyword is not None:
+            self.non_expression_names.add(id(node.keyword))
+
+    def leave_Attribute(self, original_node, updated_node):
+        # configured constants can be dotted paths
+        name = dotted_name(original_node)
+        if name is not None and name in self.config.constants:
+            return self.constant(updated_node, self.config.constants[name])
+        return updated_node
 
     def leave_Name(self, original_node, updated_node):
         # IS_ASYNC is a bit of a special case
         if updated_node.value == "IS_ASYNC":
             self.is_async_seen = True
+        if (
+            updated_node.value in self.config.constants
+            and id(original_node) not in self.non_expression_names
+        ):
+            return self.constant(
+                updated_node, self.config.constants[updated_node.value]
+            )
         # some names will get rewritten because we know
         # about them
         if updated_node.value in self.config.attribute_renames:
-            return updated_node.with_changes(
-                value=self.config.attribute_renames[updated_node.value]
-            )
+            new_name = self.config.attribute_renames[updated_node.value]
+            if new_name in CONSTANT_NAMES:
+                return self.constant(updated_node, CONSTANT_NAMES[new_name])
+            return updated_node.with_changes(value=new_name)
+        return updated_node
+
+    def leave_UnaryOperation(self, original_node, updated_node):
+        if isinstance(updated_node.operator, cst.Not):
+            value = self.constant_value(updated_node.expression)
+            if value is not None:
+                return self.constant(updated_node, not value)
         return updated_node
 
-    def unasynced_function_name(self, func_name: str) -> str | None:
+    def leave_BooleanOperation(self, original_node, updated_node):
+        # only the left side can be folded away, `x and False` still needs
+        # to evaluate x (and has the value of x when it's falsy)
+        value = self.constant_value(updated_node.left)
+        if value is None:
+            return updated_node
+        if isinstance(updated_node.operator, cst.And):
+            # True and x -> x, False and x -> False
+            short_circuits = not value
+        else:
+            # True or x -> True, False or x -> x
+            short_circuits = value
+        if short_circuits:
+            return self.constant(updated_node, value)
+        return keep_parentheses(updated_node, updated_node.right)
+
+    def leave_IfExp(self, original_node, updated_node):
+        value = self.constant_value(updated_node.test)
+        if value is None:
+            return updated_node
+        branch = updated_node.body if value else updated_node.orelse
+        return keep_parentheses(updated_node, branch)
+
+    def unasynced_function_name(
+        self, func_name: str, indexed: bool = True
+    ) -> str | None:
         """
         Return the function name for an unasync version of this
         function (or None if there is no unasync version)
+
+        The index is only used for calls it can tell something about
+        (indexed, see is_indexed_call), others go by the name alone.
         """
+        if (
+            indexed
+            and self.symbol_index is not None
+            and func_name in self.symbol_index
+        ):
+            return self.symbol_index[func_name]
         # XXX bit embarassing but...
         if func_name == "all":
             return None
@@ -52,6 +397,22 @@ class UnasyncifyMethod(cst.CSTTransformer):
             return None
 
     def leave_Call(self, original_node, updated_node):
+        lowering = self.lowering(updated_node)
+        if lowering is not None:
+            if lowering in LOWERING_STRATEGIES:
+                # handled once we get to the await
+                return updated_node
+            # a sync function to call instead, awaited or not
+            # (like aiter(x) -> iter(x))
+            module, _, _ = lowering.rpartition(".")
+            if module:
+                self.needed_imports.add(module)
+            return updated_node.with_changes(
+                func=cst.parse_expression(lowering).with_changes(
+                    lpar=updated_node.func.lpar, rpar=updated_node.func.rpar
+                )
+            )
+
         if self.await_depth == 0:
             # we only transform calls that are part of
             # an await expression
@@ -60,7 +421,9 @@ class UnasyncifyMethod(cst.CSTTransformer):
         func_name: cst.Name
         if isinstance(updated_node.func, cst.Name):
             func_name = updated_node.func
-            unasync_name = self.unasynced_function_name(updated_node.func.value)
+            unasync_name = self.unasynced_function_name(
+                updated_node.func.value, is_indexed_call(updated_node.func)
+            )
             if unasync_name is not None:
                 # let's transform it by removing the a
                 unasync_func_name = func_name.with_changes(value=unasync_name)
@@ -68,7 +431,9 @@ class UnasyncifyMethod(cst.CSTTransformer):
 
         elif isinstance(updated_node.func, cst.Attribute):
             func_name = updated_node.func.attr
-            unasync_name = self.unasynced_function_name(updated_node.func.attr.value)
+            unasync_name = self.unasynced_function_name(
+                updated_node.func.attr.value, is_indexed_call(updated_node.func)
+            )
             if unasync_name is not None:
                 # let's transform it by removing the a
                 return updated_node.with_changes(
@@ -78,23 +443,94 @@ class UnasyncifyMethod(cst.CSTTransformer):
                 )
         return updated_node
 
+    def visit_If(self, node):
+        if isinstance(node.orelse, cst.If):
+            self.elifs.add(id(node.orelse))
+
     def leave_If(self, original_node, updated_node):
-        # checking if the original if was "if IS_ASYNC"
-        # (the updated node would have turned this to if False)
-        if (
-            isinstance(original_node.test, cst.Name)
-            and original_node.test.value == "IS_ASYNC"
-        ):
-            if updated_node.orelse is not None:
-                if isinstance(updated_node.orelse, cst.Else):
-                    # unindent
-                    return cst.FlattenSentinel(updated_node.orelse.body.body)
-                else:
-                    # we seem to have elif continuations so use that
-                    return updated_node.orelse
-            else:
-                # if there's no else branch we just remove the node
-                return cst.RemovalSentinel.REMOVE
+        # branches on a known value (like `if IS_ASYNC`, which turned
+        # into `if False`) get replaced with the branch that is taken
+        value = self.constant_value(updated_node.test)
+        if value is None:
+            return updated_node
+        is_elif = id(original_node) in self.elifs
+
+        if value:
+            if is_elif:
+                # if x: ... elif True: body ... -> if x: ... else: body
+                return cst.Else(
+                    body=updated_node.body,
+                    leading_lines=updated_node.leading_lines,
+                    whitespace_before_colon=updated_node.whitespace_after_test,
+                )
+            # unindent
+            return cst.FlattenSentinel(
+                with_leading_lines(
+                    block_statements(updated_node.body), updated_node.leading_lines
+                )
+            )
+
+        orelse = updated_node.orelse
+        if orelse is None:
+            # if there's no else branch we just remove the node
+            return cst.RemovalSentinel.REMOVE
+        if is_elif:
+            # the elif/else continuations take the place of this branch
+            return orelse.with_changes(leading_lines=updated_node.leading_lines)
+        if isinstance(orelse, cst.If):
+            # we seem to have elif continuations so use that
+            return orelse.with_changes(leading_lines=updated_node.leading_lines)
+        # unindent
+        return cst.FlattenSentinel(
+            with_leading_lines(
+                block_statements(orelse.body),
+                [*updated_node.leading_lines, *orelse.leading_lines],
+            )
+        )
+
+    def leave_While(self, original_node, updated_node):
+        if self.constant_value(updated_node.test) is not False:
+            return updated_node
+        # while False: ... else: body -> body
+        if updated_node.orelse is None:
+            return cst.RemovalSentinel.REMOVE
+        return cst.FlattenSentinel(
+            with_leading_lines(
+                block_statements(updated_node.orelse.body),
+                [*updated_node.leading_lines, *updated_node.orelse.leading_lines],
+            )
+        )
+
+    def leave_SimpleStatementLine(self, original_node, updated_node):
+        # assert True never does anything
+        body = [
+            statement
+            for statement in updated_node.body
+            if not (
+                isinstance(statement, cst.Assert)
+                and self.constant_value(statement.test) is True
+            )
+        ]
+        if len(body) == len(updated_node.body):
+            return updated_node
+        if not body:
+            return cst.RemovalSentinel.REMOVE
+        # don't leave a dangling semicolon behind
+        body[-1] = body[-1].with_changes(semicolon=updated_node.body[-1].semicolon)
+        return updated_node.with_changes(body=body)
+
+    def leave_IndentedBlock(self, original_node, updated_node):
+        # we might have removed every statement of a block
+        if not updated_node.body:
+            return updated_node.with_changes(
+                body=[cst.SimpleStatementLine(body=[cst.Pass()])]
+            )
+        return updated_node
+
+    def leave_SimpleStatementSuite(self, original_node, updated_node):
+        # if x: await asyncio.sleep(0)
+        if not updated_node.body:
+            return updated_node.with_changes(body=[cst.Pass()])
         return updated_node
 
     def leave_CompFor(self, original_node, updated_node):
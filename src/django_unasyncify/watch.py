@@ -0,0 +1,168 @@
+"""
+Regenerating sync code as files get saved
+
+We poll file metadata instead of relying on platform-specific
+notification APIs. Checking a few thousand files for changes
+takes a handful of milliseconds, which keeps the latency between
+saving a file and getting the regenerated code well under a second.
+"""
+
+import os
+import time
+from collections.abc import Callable
+
+from .cache import TransformCache
+from .codemod import UnasyncifyMethodCommand
+from .config import Config
+from .discovery import Exclusions, gather_python_files, has_unasync_markers
+from .index import SymbolIndex
+from .runner import FileResult, report_result, transform_file
+
+# (mtime, size) of a file
+FileStamp = tuple[int, int]
+
+
+def file_stamp(filename: str) -> FileStamp | None:
+    try:
+        stat = os.stat(filename)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+class Watcher:
+    """
+    Keeps a codemod around and reruns it on files as they change
+    """
+
+    config: Config
+    codemod: UnasyncifyMethodCommand
+    cache: TransformCache | None
+    # shared with the codemod, kept up to date as files change
+    symbol_index: SymbolIndex | None
+    # how often we check for modified files
+    poll_interval: float
+    # how long a file has to stay untouched before we act on it
+    debounce: float
+    # how often we walk the project directories to find new files
+    rescan_interval: float
+    on_result: Callable[[FileResult], None]
+    exclusions: Exclusions
+    stamps: dict[str, FileStamp]
+
+    def __init__(
+        self,
+        config: Config,
+        codemod: UnasyncifyMethodCommand,
+        cache: TransformCache | None = None,
+        symbol_index: SymbolIndex | None = None,
+        poll_interval: float = 0.1,
+        debounce: float = 0.05,
+        rescan_interval: float = 2.0,
+        on_result: Callable[[FileResult], None] = report_result,
+    ) -> None:
+        self.config = config
+        self.codemod = codemod
+        self.cache = cache
+        self.symbol_index = symbol_index
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self.rescan_interval = rescan_interval
+        self.on_result = on_result
+        self.exclusions = Exclusions.for_config(config)
+        self.stamps = {}
+        self.last_scan = 0.0
+        self.scan()
+
+    def scan(self) -> None:
+        """
+        Pick up files that were added to the project since the last scan
+        """
+        for filename in gather_python_files(
+            self.config.paths_to_visit, self.exclusions
+        ):
+            if filename not in self.stamps:
+                stamp = file_stamp(filename)
+                if stamp is not None:
+                    self.stamps[filename] = stamp
+        self.last_scan = time.monotonic()
+
+    def poll_changes(self) -> list[str]:
+        """
+        Return the files that were modified since we last looked
+        """
+        changed = []
+        for filename, stamp in list(self.stamps.items()):
+            new_stamp = file_stamp(filename)
+            if new_stamp is None:
+                del self.stamps[filename]
+            elif new_stamp != stamp:
+                self.stamps[filename] = new_stamp
+                changed.append(filename)
+        return changed
+
+    def wait_until_settled(self, filenames: list[str]) -> list[str]:
+        """
+        Wait for writes to stop, returning every file that changed meanwhile
+        """
+        # editors often save in several steps (truncate, then write),
+        # so wait for things to quiet down before reading the files
+        while True:
+            time.sleep(self.debounce)
+            more_changes = self.poll_changes()
+            if not more_changes:
+                return filenames
+            filenames += [f for f in more_changes if f not in filenames]
+
+    def process(self, filenames: list[str]) -> list[FileResult]:
+        if self.symbol_index is not None:
+            # files awaiting a function whose counterpart just changed
+            # need to be regenerated too
+            changed_names = self.symbol_index.update(filenames)
+            for filename in self.symbol_index.referencing(changed_names):
+                if filename not in filenames:
+                    filenames.append(filename)
+        results = []
+        for filename in filenames:
+            if not has_unasync_markers(filename):
+                continue
+            result = transform_file(
+                self.codemod, filename, repo_root=str(self.config.project_base)
+            )
+            # our own write shouldn't trigger another round
+            stamp = file_stamp(filename)
+            if stamp is not None:
+                self.stamps[filename] = stamp
+            if self.cache is not None:
+                if result.error is None:
+                    self.cache.record(filename)
+                else:
+                    self.cache.forget(filename)
+            self.on_result(result)
+            results.append(result)
+        if results and self.cache is not None:
+            self.cache.save()
+        if self.symbol_index is not None:
+            self.symbol_index.save()
+        return results
+
+    def run_once(self) -> list[FileResult]:
+        if time.monotonic() - self.last_scan > self.rescan_interval:
+            known = set(self.stamps)
+            self.scan()
+            new_files = [f for f in self.stamps if f not in known]
+        else:
+            new_files = []
+        changed = self.poll_changes() + new_files
+        if not changed:
+            return []
+        return self.process(self.wait_until_settled(changed))
+
+    def run(self) -> None:
+        print("Watching for changes (press Ctrl-C to stop)...")
+        try:
+            while True:
+                self.run_once()
+                time.sleep(self.poll_interval)
+        except KeyboardInterrupt:
+            print("Stopped watching.")
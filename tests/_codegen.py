@@ -5,11 +5,16 @@ likely overwrite any changes you make to this file.
 """
 
 
-def from_codegen(f):
+def from_codegen(f=None, src_hash=None):
     """
     This indicates that the function was gotten from codegen, and
     should not be directly modified
+
+    src_hash is a fingerprint of the code it was generated from
     """
+    # @from_codegen(src_hash=...)
+    if f is None:
+        return lambda f: f
     return f
 
 
@@ -32,8 +37,10 @@ def generate_unasynced(*args, **kwargs):
         ), "Invalid calling convention for generate_unasynced"
         return args[0]
 
-    if kwargs:
-        raise NotImplementedError("Handling kwargs...")
+    # @generate_unasynced(async_unsafe=True, internal=True)
+    unknown = set(kwargs) - {"async_unsafe", "internal"}
+    assert not unknown, f"Unknown arguments to generate_unasynced: {unknown}"
+    return wrapper
 
 
 # this marker gets replaced by False when unasyncifying a function
@@ -0,0 +1,21 @@
+import shutil
+import tempfile
+from pathlib import Path
+
+import pytest
+
+original_sample_project = Path(__file__).parent / "proj"
+
+
+@pytest.fixture
+def sample_project():
+    """
+    A copy of the sample project, in
+    a temporary directory
+
+    yields the Path of the project
+    """
+    with tempfile.TemporaryDirectory() as dirpath:
+        projpath = dirpath + "/proj"
+        shutil.copytree(src=original_sample_project, dst=projpath)
+        yield Path(projpath)
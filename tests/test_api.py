@@ -0,0 +1,47 @@
+from textwrap import dedent
+
+import pytest
+from libcst import ParserSyntaxError
+
+from django_unasyncify.api import unasyncify_many, unasyncify_source
+from django_unasyncify.config import Config
+
+CONFIG = Config(unasync_helpers_import_path="helpers")
+
+
+def test_unasyncify_source():
+    before = dedent("""
+        @generate_unasynced()
+        async def aoperation(self):
+            await self.afoo()
+        """)
+
+    after = dedent("""
+        from helpers import from_codegen, generate_unasynced
+
+        @from_codegen
+        def operation(self):
+            self.foo()
+
+        @generate_unasynced()
+        async def aoperation(self):
+            await self.afoo()
+        """)
+
+    assert unasyncify_source(before, CONFIG) == after
+    assert unasyncify_source(after, CONFIG) == after
+
+
+def test_unasyncify_many():
+    marked = "@generate_unasynced\nasync def afoo():\n    await abar()\n"
+    plain = "async def afoo():\n    await abar()\n"
+
+    first, second, third = unasyncify_many([marked, plain, marked], CONFIG)
+    assert "def foo():\n    bar()\n" in first
+    assert second == plain
+    assert third == first
+
+
+def test_syntax_errors_are_raised():
+    with pytest.raises(ParserSyntaxError):
+        unasyncify_source("@generate_unasynced\nasync def afoo(:\n", CONFIG)
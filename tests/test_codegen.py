@@ -2,11 +2,13 @@ import asyncio
 from pathlib import Path
 from textwrap import dedent
 
-from libcst.codemod import CodemodTest
+from libcst import parse_module
+from libcst.codemod import CodemodContext, CodemodTest
 from django_unasyncify.scaffolding import ensure_codegen_template
 
 from django_unasyncify.codemod import UnasyncifyMethodCommand
 from django_unasyncify.config import Config
+from django_unasyncify.index import SymbolIndex
 
 
 class TestTranforms(CodemodTest):
@@ -93,6 +95,140 @@ class TestTranforms(CodemodTest):
 
         self.assertCodemod(before, after, config=Config())
 
+    def test_rerun_is_idempotent(self):
+        before = """
+        class Manager:
+            @generate_unasynced
+            async def aget(self):
+                return await self.aconnection()
+        """
+
+        after = """
+        from MISSING_IMPORT_PATH import from_codegen, generate_unasynced
+
+        class Manager:
+            @from_codegen
+            def get(self):
+                return self.connection()
+
+            @generate_unasynced
+            async def aget(self):
+                return await self.aconnection()
+        """
+
+        self.assertCodemod(before, after, config=Config())
+        # running things again leaves the code untouched, layout included
+        self.assertCodemod(after, after, config=Config())
+
+    def test_nested_functions_are_found(self):
+        before = """
+        from MISSING_IMPORT_PATH import from_codegen, generate_unasynced
+
+        async def untouched():
+            await IS_ASYNC
+
+        if True:
+            class Manager:
+                try:
+                    @generate_unasynced
+                    async def aget(self):
+                        return await self.aconnection()
+                except ImportError:
+                    pass
+        """
+
+        after = """
+        from MISSING_IMPORT_PATH import from_codegen, generate_unasynced
+
+        async def untouched():
+            await IS_ASYNC
+
+        if True:
+            class Manager:
+                try:
+                    @from_codegen
+                    def get(self):
+                        return self.connection()
+
+                    @generate_unasynced
+                    async def aget(self):
+                        return await self.aconnection()
+                except ImportError:
+                    pass
+        """
+
+        self.assertCodemod(before, after, config=Config())
+
+    def test_internal_functions_are_not_guarded(self):
+        before = """
+        @generate_unasynced(async_unsafe=True)
+        async def aget(self):
+          return await self._afetch()
+
+        @generate_unasynced(internal=True, async_unsafe=True)
+        async def _afetch(self):
+          return await self.connection.aexecute()
+        """
+
+        after = """
+        from MISSING_IMPORT_PATH import from_codegen, generate_unasynced
+        from django.utils.asyncio import async_unsafe
+
+        @from_codegen
+        @async_unsafe
+        def get(self):
+          return self._fetch()
+
+        @generate_unasynced(async_unsafe=True)
+        async def aget(self):
+          return await self._afetch()
+
+        @from_codegen
+        def _fetch(self):
+          return self.connection.execute()
+
+        @generate_unasynced(internal=True, async_unsafe=True)
+        async def _afetch(self):
+          return await self.connection.aexecute()
+        """
+
+        self.assertCodemod(before, after, config=Config())
+
+    def test_lowerings_add_imports(self):
+        before = """
+        import asyncio
+
+        @generate_unasynced
+        async def aretry(self):
+          await asyncio.sleep(1)
+        """
+
+        after = """
+        import asyncio
+        import time
+        from MISSING_IMPORT_PATH import from_codegen, generate_unasynced
+
+        @from_codegen
+        def retry(self):
+          time.sleep(1)
+
+        @generate_unasynced
+        async def aretry(self):
+          await asyncio.sleep(1)
+        """
+
+        self.assertCodemod(before, after, config=Config())
+
+    def test_unknown_arguments_are_rejected(self):
+        before = """
+        @generate_unasynced(private=True)
+        async def aget(self):
+          pass
+        """
+
+        with self.assertRaisesRegex(ValueError, "Unknown generate_unasynced"):
+            self.assertCodemod(before, before, config=Config())
+
 
 class TestRuns(CodemodTest):
     TRANSFORM = UnasyncifyMethodCommand
@@ -140,3 +276,93 @@ class TestRuns(CodemodTest):
         assert after_globals["do_thing"]() == 2
         loop = asyncio.new_event_loop()
         assert loop.run_until_complete(after_globals["ado_thing"]()) == 1
+
+
+FINGERPRINTS_CONFIG = Config(function_fingerprints=True)
+
+
+def run_codemod(code: str, codemod: UnasyncifyMethodCommand | None = None) -> str:
+    codemod = codemod or UnasyncifyMethodCommand(CodemodContext(), FINGERPRINTS_CONFIG)
+    return codemod.transform_module(parse_module(dedent(code))).code
+
+
+def test_up_to_date_functions_are_reused():
+    generated = run_codemod("""
+        @generate_unasynced
+        async def aoperation(self):
+          await self.afoo()
+        """)
+    assert '@from_codegen(src_hash="' in generated
+
+    codemod = UnasyncifyMethodCommand(CodemodContext(), FINGERPRINTS_CONFIG)
+    assert run_codemod(generated, codemod) == generated
+    assert (codemod.functions_generated, codemod.functions_reused) == (0, 1)
+
+
+def test_changes_to_fingerprinted_functions_are_picked_up():
+    generated = run_codemod("""
+        @generate_unasynced
+        async def aoperation(self):
+          await self.afoo()
+        """)
+
+    # the async function changed
+    edited = generated.replace("await self.afoo()", "await self.abar()")
+    assert "\n  self.bar()" in run_codemod(edited)
+
+    # the generated code was edited by hand
+    edited = generated.replace("\n  self.foo()", "\n  self.baz()")
+    assert run_codemod(edited) == generated
+
+
+def test_reused_functions_keep_their_imports():
+    generated = run_codemod("""
+        import asyncio
+
+        @generate_unasynced(async_unsafe=True)
+        async def aoperation(self):
+          if IS_ASYNC:
+            await asyncio.sleep(1)
+          await asyncio.sleep(2)
+        """)
+    assert "import time\n" in generated
+    assert "async_unsafe\n" in generated
+
+    # the imports only the generated function needed are gone
+    edited = "".join(
+        line
+        for line in generated.splitlines(keepends=True)
+        if line != "import time\n" and not line.startswith("from ")
+    )
+    codemod = UnasyncifyMethodCommand(CodemodContext(), FINGERPRINTS_CONFIG)
+    assert run_codemod(edited, codemod) == generated
+    assert (codemod.functions_generated, codemod.functions_reused) == (0, 1)
+
+
+def test_index_changes_invalidate_fingerprints(tmp_path: Path):
+    models = tmp_path / "models.py"
+    models.write_text(
+        "class Manager:\n"
+        "    async def afetch_rows(self):\n"
+        "        return await sync_to_async(self.load_rows)()\n"
+    )
+    index = SymbolIndex.for_config(Config(project_base=tmp_path), persist=False)
+    index.refresh([str(models)])
+    code = """
+        class Reports(Manager):
+          @generate_unasynced
+          async def aload(self):
+            return await self.afetch_rows()
+        """
+    generated = run_codemod(
+        code, UnasyncifyMethodCommand(CodemodContext(), FINGERPRINTS_CONFIG, index)
+    )
+    assert "return self.load_rows()" in generated
+
+    # the counterpart got renamed
+    models.write_text(models.read_text().replace("load_rows", "fetch_rows"))
+    index.refresh([str(models)])
+    codemod = UnasyncifyMethodCommand(CodemodContext(), FINGERPRINTS_CONFIG, index)
+    regenerated = run_codemod(generated, codemod)
+    assert "return self.fetch_rows()" in regenerated
+    assert (codemod.functions_generated, codemod.functions_reused) == (1, 0)
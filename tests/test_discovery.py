@@ -0,0 +1,212 @@
+import subprocess
+from pathlib import Path
+
+import pytest
+
+from django_unasyncify import discovery
+from django_unasyncify.config import Config
+from django_unasyncify.discovery import (
+    Exclusions,
+    filter_marked_files,
+    gather_python_files,
+    git_changed_files,
+    has_unasync_markers,
+    restrict_to_paths,
+)
+
+
+def test_marker_detection(tmp_path: Path):
+    marked = tmp_path / "marked.py"
+    marked.write_text("@generate_unasynced()\nasync def afoo():\n    pass\n")
+    codegenned = tmp_path / "codegenned.py"
+    codegenned.write_text("@from_codegen\ndef foo():\n    pass\n")
+    plain = tmp_path / "plain.py"
+    plain.write_text("def generate_unasynced():\n    pass\n")
+    commented = tmp_path / "commented.py"
+    commented.write_text("# @generate_unasynced()\n")
+    empty = tmp_path / "empty.py"
+    empty.write_text("")
+
+    assert has_unasync_markers(str(marked))
+    assert has_unasync_markers(str(codegenned))
+    assert not has_unasync_markers(str(plain))
+    assert not has_unasync_markers(str(commented))
+    assert not has_unasync_markers(str(empty))
+
+    assert filter_marked_files(
+        [str(marked), str(plain), str(codegenned), str(empty)]
+    ) == [str(marked), str(codegenned)]
+
+
+def test_marker_detection_large_files(tmp_path: Path, monkeypatch):
+    monkeypatch.setattr(discovery, "MMAP_THRESHOLD", 16)
+    padding = "x = 1\n" * 100
+
+    marked = tmp_path / "marked.py"
+    marked.write_text(padding + "@generate_unasynced\nasync def afoo(): ...\n")
+    plain = tmp_path / "plain.py"
+    plain.write_text(padding)
+
+    assert has_unasync_markers(str(marked))
+    assert not has_unasync_markers(str(plain))
+
+
+def test_restrict_to_paths(tmp_path: Path):
+    (tmp_path / "app").mkdir()
+    (tmp_path / "app_extra").mkdir()
+    inside = tmp_path / "app" / "models.py"
+    sibling = tmp_path / "app_extra" / "models.py"
+    not_python = tmp_path / "app" / "README.md"
+    for path in (inside, sibling, not_python):
+        path.write_text("")
+
+    assert restrict_to_paths(
+        [str(inside), str(sibling), str(not_python), str(tmp_path / "app" / "gone.py")],
+        [str(tmp_path / "app")],
+    ) == [str(inside)]
+
+
+def test_restrict_to_paths_drops_duplicates(tmp_path: Path, monkeypatch):
+    (tmp_path / "app").mkdir()
+    models = tmp_path / "app" / "models.py"
+    views = tmp_path / "app" / "views.py"
+    models.write_text("")
+    views.write_text("")
+    monkeypatch.chdir(tmp_path)
+
+    # like a file passed on the command line, and also changed since a commit
+    assert restrict_to_paths(
+        ["app/models.py", str(views), str(models), "app/../app/views.py"],
+        [str(tmp_path / "app")],
+    ) == ["app/models.py", str(views)]
+
+
+def make_files(base: Path, *names: str) -> None:
+    for name in names:
+        path = base / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text("")
+
+
+def relative_names(base: Path, filenames: list[str]) -> list[str]:
+    return [Path(filename).relative_to(base).as_posix() for filename in filenames]
+
+
+def test_excluded_directories_are_pruned(tmp_path: Path, monkeypatch):
+    make_files(
+        tmp_path,
+        "app/models.py",
+        "app/migrations/0001_initial.py",
+        "app/settings_local.py",
+        "build/lib/app/models.py",
+        "node_modules/pkg/setup.py",
+        "docs/build/conf.py",
+        "migrations.py",
+    )
+    exclusions = Exclusions(
+        str(tmp_path), ["migrations/", "settings_*.py", "/build", "node_modules"]
+    )
+    walked = []
+    real_walk = discovery.os.walk
+
+    def recording_walk(path):
+        for root, directories, files in real_walk(path):
+            walked.append(Path(root).relative_to(tmp_path).as_posix())
+            yield root, directories, files
+
+    monkeypatch.setattr(discovery.os, "walk", recording_walk)
+    found = gather_python_files([str(tmp_path)], exclusions)
+
+    assert relative_names(tmp_path, found) == [
+        "app/models.py",
+        "docs/build/conf.py",
+        "migrations.py",
+    ]
+    # excluded directories are not looked into
+    assert sorted(walked) == [".", "app", "docs", "docs/build"]
+
+    # explicitly listed files are excluded just the same
+    assert (
+        restrict_to_paths(
+            [str(tmp_path / "app" / "migrations" / "0001_initial.py")],
+            [str(tmp_path)],
+            exclusions,
+        )
+        == []
+    )
+
+
+def git(cwd: Path, *args: str) -> None:
+    subprocess.run(
+        ["git", "-c", "user.name=test", "-c", "user.email=test@example.com", *args],
+        cwd=cwd,
+        check=True,
+        capture_output=True,
+    )
+
+
+def test_wildcards_stay_within_directories(tmp_path: Path):
+    make_files(
+        tmp_path,
+        "src/generated.py",
+        "src/app/generated.py",
+        "src/app/models.py",
+        "src/app/deep/models_old.py",
+        "lib/app/models_old.py",
+    )
+    exclusions = Exclusions(str(tmp_path), ["src/*.py", "src/**/*_old.py"])
+
+    assert relative_names(
+        tmp_path, gather_python_files([str(tmp_path)], exclusions)
+    ) == [
+        "lib/app/models_old.py",
+        "src/app/generated.py",
+        "src/app/models.py",
+    ]
+
+
+def test_git_changed_files(tmp_path: Path):
+    git(tmp_path, "init")
+    (tmp_path / ".gitignore").write_text("ignored.py\n")
+    (tmp_path / "committed.py").write_text("")
+    (tmp_path / "modified.py").write_text("")
+    (tmp_path / "deleted.py").write_text("")
+    git(tmp_path, "add", ".")
+    git(tmp_path, "commit", "-m", "initial")
+
+    (tmp_path / "modified.py").write_text("x = 1\n")
+    (tmp_path / "deleted.py").unlink()
+    (tmp_path / "untracked.py").write_text("")
+    (tmp_path / "ignored.py").write_text("")
+
+    changed = git_changed_files(str(tmp_path), "HEAD")
+    assert sorted(Path(f).name for f in changed) == ["modified.py", "untracked.py"]
+
+    with pytest.raises(ValueError):
+        git_changed_files(str(tmp_path), "not-a-revision")
+
+
+def test_gitignored_files_are_excluded(tmp_path: Path):
+    git(tmp_path, "init")
+    (tmp_path / ".gitignore").write_text("generated/\n*_local.py\n")
+    make_files(
+        tmp_path,
+        "app/models.py",
+        "app/settings_local.py",
+        "generated/deep/module.py",
+    )
+    config = Config(project_base=tmp_path, paths_to_visit=[str(tmp_path)])
+    assert (
+        len(gather_python_files(config.paths_to_visit, Exclusions.for_config(config)))
+        == 3
+    )
+
+    config.respect_gitignore = True
+    exclusions = Exclusions.for_config(config)
+    # ignored directories are listed as a whole
+    assert exclusions.ignored == {
+        str(tmp_path / "generated"),
+        str(tmp_path / "app" / "settings_local.py"),
+    }
+    found = gather_python_files(config.paths_to_visit, exclusions)
+    assert relative_names(tmp_path, found) == ["app/models.py"]
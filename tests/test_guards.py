@@ -0,0 +1,70 @@
+from pathlib import Path
+from textwrap import dedent
+
+from django_unasyncify.guards import find_redundant_guards
+
+
+def write(path: Path, code: str) -> str:
+    path.write_text(dedent(code))
+    return str(path)
+
+
+def test_redundant_guards_are_found(tmp_path: Path):
+    models = write(
+        tmp_path / "models.py",
+        """
+        class QuerySet:
+            @from_codegen
+            @async_unsafe
+            def get(self):
+                return self._fetch()
+
+            @from_codegen
+            @async_unsafe
+            def _fetch(self):
+                return self._fetch_rows() or self.count()
+
+            @from_codegen
+            @async_unsafe
+            def _fetch_rows(self, retry=True):
+                return self._fetch_rows(retry=False) if retry else []
+
+            @from_codegen
+            @async_unsafe
+            def count(self):
+                return 0
+        """,
+    )
+    views = write(
+        tmp_path / "views.py",
+        """
+        def view(request):
+            return QuerySet().get()
+
+        async def aview(request):
+            # calling into the sync code from an event loop is exactly
+            # what the guard is there for
+            return QuerySet().count()
+        """,
+    )
+
+    fetch, fetch_rows = find_redundant_guards([models, views])
+    assert (fetch.filename, fetch.function, fetch.line) == (models, "_fetch", 10)
+    assert fetch.callers == ["get"]
+    # recursive calls don't count
+    assert fetch_rows.function == "_fetch_rows"
+    assert fetch_rows.callers == ["_fetch"]
+    # get and count have unguarded callers
+
+
+def test_uncalled_functions_keep_their_guard(tmp_path: Path):
+    module = write(
+        tmp_path / "module.py",
+        """
+        @from_codegen
+        @async_unsafe
+        def get():
+            pass
+        """,
+    )
+    assert find_redundant_guards([module]) == []
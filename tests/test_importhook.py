@@ -0,0 +1,141 @@
+import importlib
+import os
+import subprocess
+import sys
+import traceback
+from pathlib import Path
+
+import pytest
+
+from django_unasyncify import api
+from django_unasyncify.config import Config
+from django_unasyncify.importhook import UnasyncifyLoader, install, uninstall
+from django_unasyncify.scaffolding import ensure_codegen_template
+
+MODULE = """\
+from hooked_pkg._codegen import generate_unasynced
+
+
+@generate_unasynced
+async def aget_value(source):
+    return await source.aget()
+"""
+
+
+class Source:
+    def get(self):
+        return 1
+
+
+@pytest.fixture
+def hooked_package(tmp_path: Path, monkeypatch):
+    package = tmp_path / "hooked_pkg"
+    package.mkdir()
+    (package / "__init__.py").write_text("")
+    ensure_codegen_template(package / "_codegen.py")
+    (package / "values.py").write_text(MODULE)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.setattr(sys, "dont_write_bytecode", False)
+
+    config = Config(unasync_helpers_import_path="hooked_pkg._codegen")
+    finder = install(config, packages=["hooked_pkg"])
+    yield package
+    uninstall(finder)
+    for name in list(sys.modules):
+        if name.startswith("hooked_pkg"):
+            del sys.modules[name]
+
+
+def import_values():
+    sys.modules.pop("hooked_pkg.values", None)
+    return importlib.import_module("hooked_pkg.values")
+
+
+def test_modules_are_transformed_on_import(hooked_package: Path, monkeypatch):
+    values = import_values()
+    assert values.get_value(Source()) == 1
+    # nothing got written next to the source
+    assert "def get_value" not in (hooked_package / "values.py").read_text()
+
+    cache_files = list((hooked_package / "__pycache__").glob("values.*unasyncify*"))
+    assert [path.name.split(".")[-2] for path in cache_files] == ["opt-unasyncify"]
+
+    # warm imports come straight from the cache
+    transform = api.SourceTransformer.transform
+    transformed = []
+
+    def recording_transform(self, code, filename=None):
+        transformed.append(filename)
+        return transform(self, code, filename)
+
+    monkeypatch.setattr(api.SourceTransformer, "transform", recording_transform)
+    assert import_values().get_value(Source()) == 1
+    assert transformed == []
+
+    # ... until the module changes
+    (hooked_package / "values.py").write_text(
+        MODULE.replace("return await", "return 1 + await")
+    )
+    assert import_values().get_value(Source()) == 2
+    assert transformed == [str(hooked_package / "values.py")]
+
+
+def test_coding_declarations_are_honored(hooked_package: Path):
+    (hooked_package / "values.py").write_bytes(
+        ("# -*- coding: latin-1 -*-\n" + MODULE + '\nNAME = "café"\n').encode("latin-1")
+    )
+    values = import_values()
+    assert values.NAME == "café"
+    assert values.get_value(Source()) == 1
+
+
+def test_line_numbers_match_the_source(hooked_package: Path):
+    (hooked_package / "failing.py").write_text(
+        MODULE + '\n\ndef fail():\n    raise RuntimeError("boom")\n'
+    )
+    failing = importlib.import_module("hooked_pkg.failing")
+
+    with pytest.raises(RuntimeError) as excinfo:
+        failing.fail()
+    frame = traceback.extract_tb(excinfo.tb)[-1]
+    assert (frame.lineno, frame.line) == (10, 'raise RuntimeError("boom")')
+
+    # sync variants line up with the async function they come from
+    with pytest.raises(AttributeError) as missing:
+        failing.get_value(None)
+    frame = traceback.extract_tb(missing.tb)[-1]
+    assert (frame.lineno, frame.line) == (6, "return await source.aget()")
+
+    # the source the line numbers refer to
+    loader = failing.__loader__
+    assert isinstance(loader, UnasyncifyLoader)
+    assert (
+        loader.get_source("hooked_pkg.failing")
+        == (hooked_package / "failing.py").read_text()
+    )
+
+
+def test_optimized_runs_have_their_own_cache(hooked_package: Path):
+    # __debug__ is False in code compiled with -O
+    (hooked_package / "values.py").write_text(MODULE + "\nDEBUG = __debug__\n")
+    assert import_values().DEBUG is True
+
+    completed = subprocess.run(
+        [
+            sys.executable,
+            "-O",
+            "-c",
+            "from django_unasyncify.config import Config\n"
+            "from django_unasyncify.importhook import install\n"
+            "install(Config(unasync_helpers_import_path='hooked_pkg._codegen'),"
+            " packages=['hooked_pkg'])\n"
+            "import hooked_pkg.values\n"
+            "print(hooked_pkg.values.DEBUG)\n",
+        ],
+        env={**os.environ, "PYTHONPATH": os.pathsep.join(sys.path)},
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert completed.stdout == "False\n"
+    assert import_values().DEBUG is True
@@ -0,0 +1,152 @@
+from pathlib import Path
+from textwrap import dedent
+
+from django_unasyncify.api import unasyncify_source
+from django_unasyncify.config import Config
+from django_unasyncify.index import SymbolIndex, scan_source
+
+
+def scan(code: str):
+    return scan_source(dedent(code).encode("utf-8"), digest="")
+
+
+def test_counterparts_are_found():
+    symbols = scan("""
+        class QuerySet:
+            def get(self):
+                pass
+
+            async def aget(self):
+                pass
+
+            async def acount(self):
+                return await sync_to_async(self.count_rows)()
+
+            def iterate(self):
+                return async_to_sync(self.aiterate_rows)()
+
+            @generate_unasynced()
+            async def _afetch(self):
+                await self.aget()
+                await self.connection.aclose(await self.acount())
+
+            async def aorphan(self):
+                pass
+        """)
+
+    assert symbols.async_functions == {
+        "aget": "get",
+        "acount": "count_rows",
+        "aiterate_rows": "iterate",
+        "_afetch": "_fetch",
+        "aorphan": None,
+    }
+    assert symbols.references == ["aclose", "acount", "aget"]
+
+
+def test_only_returned_wrappers_are_counterparts():
+    symbols = scan("""
+        async def notify(instance):
+            pass
+
+        class Model:
+            def save(self):
+                pass
+
+            async def asave(self):
+                await sync_to_async(log_event)("saving")
+                await sync_to_async(self.save)()
+
+            async def adelete(self):
+                await sync_to_async(log_event)("deleting")
+                return await sync_to_async(self.delete_rows)()
+
+            def refresh(self):
+                return async_to_sync(notify)(self)
+
+            def reload(self):
+                async_to_sync(self.aclear)()
+                return async_to_sync(self.afetch)()
+        """)
+
+    assert symbols.async_functions == {
+        # the sync function of the same name wins over wrapped calls
+        "asave": "save",
+        "adelete": "delete_rows",
+        # refresh is not the sync version of notify
+        "notify": None,
+        "afetch": "reload",
+    }
+
+
+def test_files_without_async_code_are_not_parsed():
+    # not even valid python, but never looked at
+    assert scan("def f(:\n").async_functions == {}
+    # broken files are ignored
+    assert scan("async def f(:\n").async_functions == {}
+
+
+def test_ambiguous_counterparts_are_not_resolved(tmp_path: Path):
+    one = tmp_path / "one.py"
+    one.write_text(
+        "class A:\n"
+        "    def fetch(self): pass\n"
+        "    async def afetch(self): pass\n"
+        "    async def aclose(self): pass\n"
+    )
+    two = tmp_path / "two.py"
+    two.write_text("async def afetch():\n    return await sync_to_async(load)()\n")
+
+    index = SymbolIndex.for_config(Config(project_base=tmp_path), persist=False)
+    index.refresh([str(one), str(two)])
+    assert "afetch" not in index
+    # not knowing about a counterpart means we leave it to the heuristics
+    assert "aclose" not in index
+
+    two.unlink()
+    assert index.refresh([str(one)]) == {"afetch"}
+    assert index["afetch"] == "fetch"
+
+
+def test_index_is_persisted(tmp_path: Path):
+    config = Config(project_base=tmp_path)
+    module = tmp_path / "module.py"
+    module.write_text("async def aload():\n    return await sync_to_async(read)()\n")
+
+    index = SymbolIndex.for_config(config)
+    assert index.refresh([str(module)]) == {"aload"}
+    index.save()
+
+    index = SymbolIndex.for_config(config)
+    assert index["aload"] == "read"
+    # nothing changed since last time
+    assert index.refresh([str(module)]) == set()
+
+
+def test_only_attributable_calls_use_the_index(tmp_path: Path):
+    module = tmp_path / "module.py"
+    module.write_text(
+        "class Client:\n"
+        "    async def afetch(self):\n"
+        "        return await sync_to_async(self.load)()\n"
+    )
+    config = Config(project_base=tmp_path)
+    index = SymbolIndex.for_config(config, persist=False)
+    index.refresh([str(module)])
+
+    generated = unasyncify_source(
+        dedent("""
+            class Client:
+                @generate_unasynced
+                async def aget(self):
+                    await self.afetch()
+                    # not necessarily the Client above
+                    await self.client.afetch()
+                    await afetch()
+            """),
+        config,
+        symbol_index=index,
+    )
+    assert "        self.load()\n" in generated
+    assert "        self.client.fetch()\n" in generated
+    assert "        load()\n" in generated
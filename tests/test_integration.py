@@ -1,9 +1,13 @@
-import pytest
-
-from pathlib import Path
+import json
+import pstats
 import shutil
-import tempfile
+import subprocess
+import sys
+from pathlib import Path
 
+import pytest
+
+from django_unasyncify import runner
 from django_unasyncify.cmd import main as cli_main
 from django_unasyncify.config import Config
 
@@ -11,20 +15,6 @@ from django_unasyncify.config import Config
 original_sample_project = Path(__file__).parent / "proj"
 
 
-@pytest.fixture
-def sample_project():
-    """
-    A copy of the sample project, in
-    a temporary directory
-
-    yields the Path of the project
-    """
-    with tempfile.TemporaryDirectory() as dirpath:
-        projpath = dirpath + "/proj"
-        shutil.copytree(src=original_sample_project, dst=projpath)
-        yield Path(projpath)
-
-
 def assert_matching_file_contents(left: Path, right: Path):
     try:
         with left.open("r") as f:
@@ -78,3 +68,224 @@ def test_sample_project_config_loading():
         config.codegen_template_path()
         == Path(__file__).parent / "proj" / "unasync_utils.py"
     )
+
+
+def test_constants_config(sample_project):
+    pyproject = sample_project / "pyproject.toml"
+    base_config = pyproject.read_text()
+    pyproject.write_text(
+        base_config + "\n[tool.django_unasyncify.constants]\nDEBUG = false\n"
+    )
+    assert Config.from_project_path(sample_project).constants == {"DEBUG": False}
+
+    pyproject.write_text(
+        base_config + '\n[tool.django_unasyncify.constants]\nDEBUG = "no"\n'
+    )
+    with pytest.raises(ValueError):
+        Config.from_project_path(sample_project)
+
+
+def test_unchanged_files_are_skipped(sample_project, capsys):
+    config = Config.from_project_path(sample_project)
+    cli_main(config)
+    assert "1 file(s) to transform." in capsys.readouterr().out
+
+    # everything is up to date, so there's nothing left to do
+    cli_main(config)
+    assert "0 file(s) to transform." in capsys.readouterr().out
+
+    # touching the file means we'll look at it again
+    one_py = sample_project / "one.py"
+    one_py.write_text(one_py.read_text() + "\n\nvalue = 1\n")
+    cli_main(config)
+    assert "1 file(s) to transform." in capsys.readouterr().out
+
+    # ... unless we're told to ignore the cache entirely
+    cli_main(config, ["--no-cache"])
+    assert "to transform." not in capsys.readouterr().out
+
+
+def test_config_changes_invalidate_cache(sample_project, capsys):
+    config = Config.from_project_path(sample_project)
+    cli_main(config)
+    capsys.readouterr()
+
+    config.attribute_renames["aconnection"] = "connection"
+    cli_main(config)
+    assert "1 file(s) to transform." in capsys.readouterr().out
+
+
+def test_check_mode(sample_project, capsys):
+    one_py = sample_project / "one.py"
+    original_contents = one_py.read_text()
+
+    # nothing has been generated yet, so everything is out of date
+    assert cli_main(Config.from_project_path(sample_project), ["--check"]) == 1
+    output = capsys.readouterr().out
+    assert f"Would regenerate {one_py}" in output
+    assert f"Would regenerate {sample_project / 'unasync_utils.py'}" in output
+    assert "Regenerated" not in output
+
+    # ... and nothing was written
+    assert one_py.read_text() == original_contents
+    assert not (sample_project / "unasync_utils.py").exists()
+    assert not (sample_project / ".django_unasyncify_cache").exists()
+
+    # once we've run things, the check passes
+    assert cli_main(Config.from_project_path(sample_project)) == 0
+    assert cli_main(Config.from_project_path(sample_project), ["--check"]) == 0
+    config = Config.from_project_path(sample_project)
+    assert cli_main(config, ["--check", "--no-cache"]) == 0
+    assert "Would regenerate" not in capsys.readouterr().out
+
+
+def test_up_to_date_files_are_not_rewritten(sample_project):
+    config = Config.from_project_path(sample_project)
+    cli_main(config, ["--no-cache"])
+
+    template = sample_project / "unasync_utils.py"
+    one_py = sample_project / "one.py"
+    template_mtime = template.stat().st_mtime_ns
+    one_py_mtime = one_py.stat().st_mtime_ns
+
+    cli_main(config, ["--no-cache"])
+    assert template.stat().st_mtime_ns == template_mtime
+    assert one_py.stat().st_mtime_ns == one_py_mtime
+
+
+def test_profiling_report(sample_project, tmp_path, monkeypatch):
+    # a second file, and no in-process shortcut for small batches,
+    # so that work gets spread over worker processes
+    monkeypatch.setattr(runner, "IN_PROCESS_MAX_BYTES", 0)
+    (sample_project / "two.py").write_text(
+        "@generate_unasynced\nasync def afoo():\n    await abar()\n"
+    )
+    report_path = tmp_path / "report.json"
+    stats_path = tmp_path / "run.pstats"
+
+    config = Config.from_project_path(sample_project)
+    cli_main(
+        config,
+        [
+            "--profile",
+            str(report_path),
+            "--profile-top",
+            "1",
+            "--cprofile",
+            str(stats_path),
+        ],
+    )
+
+    report = json.loads(report_path.read_text())
+    assert report["file_count"] == 2
+    assert report["functions_generated"] == 3
+    assert {"discovery", "parse", "leave_FunctionDef", "imports", "codegen"} <= set(
+        report["phases"]
+    )
+    assert len(report["slowest_files"]) == 1
+    assert {entry["filename"] for entry in report["files"]} == {
+        str(sample_project / "one.py"),
+        str(sample_project / "two.py"),
+    }
+
+    # the cProfile data from the workers got merged together
+    stats = pstats.Stats(str(stats_path))
+    assert any(
+        function_name == "leave_FunctionDef"
+        for (_, _, function_name) in stats.stats  # type: ignore[attr-defined]
+    )
+
+
+def test_calls_are_resolved_through_the_index(sample_project, capsys):
+    (sample_project / "models.py").write_text(
+        "class Manager:\n"
+        "    def load_rows(self):\n"
+        "        pass\n\n"
+        "    async def afetch_rows(self):\n"
+        "        return await sync_to_async(self.load_rows)()\n"
+    )
+    (sample_project / "two.py").write_text(
+        "class Reports(Manager):\n"
+        "    @generate_unasynced\n"
+        "    async def aload(self):\n"
+        "        return await self.afetch_rows()\n"
+    )
+    config = Config.from_project_path(sample_project)
+    cli_main(config)
+    capsys.readouterr()
+    assert "return self.load_rows()" in (sample_project / "two.py").read_text()
+
+    # renaming the sync counterpart regenerates the files that use it...
+    (sample_project / "models.py").write_text(
+        "class Manager:\n"
+        "    def fetch_rows(self):\n"
+        "        pass\n\n"
+        "    async def afetch_rows(self):\n"
+        "        return await sync_to_async(self.fetch_rows)()\n"
+    )
+    cli_main(config)
+    assert "1 file(s) to transform." in capsys.readouterr().out
+    assert "return self.fetch_rows()" in (sample_project / "two.py").read_text()
+
+    # ... and only those
+    cli_main(config)
+    assert "0 file(s) to transform." in capsys.readouterr().out
+
+
+def test_explicit_files(sample_project, capsys):
+    two_py = sample_project / "two.py"
+    two_py.write_text("@generate_unasynced\nasync def afoo():\n    await abar()\n")
+    config = Config.from_project_path(sample_project)
+
+    cli_main(config, [str(two_py), str(sample_project / "unasync_utils.py")])
+    assert "1 file(s) to transform." in capsys.readouterr().out
+    assert "def foo():" in two_py.read_text()
+    # one.py was left alone
+    assert "def get_thing(" not in (sample_project / "one.py").read_text()
+
+    # files outside of paths_to_visit are ignored
+    config.paths_to_visit = [str(sample_project / "elsewhere")]
+    cli_main(config, [str(sample_project / "one.py")])
+    assert "0 file(s) to transform." in capsys.readouterr().out
+
+
+def test_up_to_date_runs_do_not_load_libcst(sample_project):
+    cli_main(Config.from_project_path(sample_project))
+
+    # checked in a fresh interpreter, as the test suite itself uses libcst
+    script = (
+        "import sys\n"
+        "from django_unasyncify.cmd import main\n"
+        "assert main(argv=['--project', sys.argv[1]]) == 0\n"
+        "assert 'libcst' not in sys.modules, 'libcst was imported'\n"
+    )
+    completed = subprocess.run(
+        [sys.executable, "-c", script, str(sample_project)],
+        capture_output=True,
+        text=True,
+    )
+    assert completed.returncode == 0, completed.stderr
+    assert "0 file(s) to transform." in completed.stdout
+
+
+def test_monorepo_run(sample_project, monkeypatch, capsys):
+    # spread the files of every project over the same workers
+    monkeypatch.setattr(runner, "IN_PROCESS_MAX_BYTES", 0)
+    root = sample_project.parent
+    other_project = root / "packages" / "other"
+    nested_project = sample_project / "nested"
+    ignored_project = root / ".tox" / "copy"
+    for path in (other_project, nested_project, ignored_project):
+        shutil.copytree(original_sample_project, path)
+
+    assert cli_main(argv=["--all-projects", str(root), "-j", "2"]) == 0
+
+    output = capsys.readouterr().out
+    for project in (sample_project, other_project, nested_project):
+        assert_matching_file_contents(project / "one.py", project / "one.py.expected")
+        assert f"{project}: 1 file(s) transformed, 1 changed, 0 failed" in output
+    # files of nested projects are only transformed once, with their own config
+    assert output.count(f"Regenerated {nested_project / 'one.py'}") == 1
+    assert not (ignored_project / "unasync_utils.py").exists()
+
+    assert cli_main(argv=["--all-projects", str(root), "--check"]) == 0
@@ -0,0 +1,25 @@
+import io
+
+from django_unasyncify.progress import Progress
+
+
+def test_progress_is_logged():
+    stream = io.StringIO()
+    progress = Progress(2, stream=stream, log=True)
+    progress.interval = 0
+    progress.advance()
+    progress.advance()
+    progress.finish()
+
+    first, second, summary = stream.getvalue().splitlines()
+    assert first.startswith("[1/2] ") and first.endswith(" files/s")
+    assert second.startswith("[2/2] ")
+    assert summary.startswith("Transformed 2 file(s) in ")
+
+
+def test_progress_is_quiet_outside_of_terminals():
+    stream = io.StringIO()
+    progress = Progress(2, stream=stream)
+    progress.advance()
+    progress.advance()
+    assert stream.getvalue() == ""
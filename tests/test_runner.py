@@ -0,0 +1,117 @@
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+from django_unasyncify import runner
+from django_unasyncify.config import Config
+from django_unasyncify.runner import RunOptions, run_transforms
+
+MARKED_MODULE = "@generate_unasynced\nasync def afoo{index}():\n    await abar()\n"
+
+
+def write_modules(tmp_path: Path, count: int) -> list[str]:
+    filenames = []
+    for index in range(count):
+        module = tmp_path / f"module_{index}.py"
+        # make later modules larger
+        module.write_text(MARKED_MODULE.format(index=index) + "\n" * index)
+        filenames.append(str(module))
+    return filenames
+
+
+def test_small_batches_run_in_process(tmp_path: Path, monkeypatch):
+    def no_pool(*args, **kwargs):
+        pytest.fail("Started a process pool for a handful of small files")
+
+    monkeypatch.setattr(runner, "ProcessPoolExecutor", no_pool)
+    files = write_modules(tmp_path, 3)
+    results = list(run_transforms(Config(), files, RunOptions(), jobs=4))
+    assert sorted(result.filename for result in results) == files
+    assert all(result.changed and result.error is None for result in results)
+
+
+def test_large_batches_use_workers(tmp_path: Path, monkeypatch):
+    monkeypatch.setattr(runner, "IN_PROCESS_MAX_BYTES", 0)
+    submitted: list[str] = []
+    real_pool = runner.ProcessPoolExecutor
+
+    class RecordingPool(real_pool):  # type: ignore[valid-type, misc]
+        def submit(self, fn, *args, **kwargs):
+            submitted.extend(args)
+            return super().submit(fn, *args, **kwargs)
+
+    monkeypatch.setattr(runner, "ProcessPoolExecutor", RecordingPool)
+    files = write_modules(tmp_path, 4)
+    results = list(run_transforms(Config(), files, RunOptions(), jobs=2))
+
+    # largest files go first
+    assert submitted == files[::-1]
+    assert sorted(result.filename for result in results) == files
+    assert all(result.changed and result.error is None for result in results)
+
+
+def test_workers_get_replaced(tmp_path: Path, monkeypatch):
+    monkeypatch.setattr(runner, "IN_PROCESS_MAX_BYTES", 0)
+    monkeypatch.setattr(runner, "MAX_FILES_PER_WORKER", 1)
+    pools: list[int | None] = []
+    real_pool = runner.ProcessPoolExecutor
+
+    class RecordingPool(real_pool):  # type: ignore[valid-type, misc]
+        def __init__(self, max_workers=None, **kwargs):
+            pools.append(max_workers)
+            super().__init__(max_workers, **kwargs)
+
+    monkeypatch.setattr(runner, "ProcessPoolExecutor", RecordingPool)
+    files = write_modules(tmp_path, 5)
+    results = list(run_transforms(Config(), files, RunOptions(), jobs=2))
+
+    # a new pool (with new workers) every 2 files
+    assert pools == [2, 2, 1]
+    assert sorted(result.filename for result in results) == files
+
+
+@pytest.mark.skipif(
+    "fork" not in multiprocessing.get_all_start_methods(),
+    reason="workers can only be forked on some platforms",
+)
+def test_scripts_do_not_need_a_main_guard(tmp_path: Path):
+    files = write_modules(tmp_path, 3)
+    script = tmp_path / "script.py"
+    script.write_text(
+        "from django_unasyncify import runner\n"
+        "from django_unasyncify.config import Config\n"
+        "runner.IN_PROCESS_MAX_BYTES = 0\n"
+        f"files = {files!r}\n"
+        "results = runner.run_transforms(\n"
+        "    Config(), files, runner.RunOptions(), jobs=2\n"
+        ")\n"
+        "print(sum(result.changed for result in results))\n"
+    )
+    completed = subprocess.run(
+        [sys.executable, str(script)],
+        env={**os.environ, "PYTHONPATH": os.pathsep.join(sys.path)},
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert completed.stdout == "3\n"
+
+
+def test_slow_files_are_skipped(tmp_path: Path, monkeypatch):
+    def slow_transform(*args, **kwargs):
+        time.sleep(5)
+
+    monkeypatch.setattr(runner, "transform_code", slow_transform)
+    (filename,) = write_modules(tmp_path, 1)
+    start = time.perf_counter()
+    (result,) = run_transforms(Config(), [filename], RunOptions(timeout=0.1))
+    assert time.perf_counter() - start < 1
+
+    assert result.timed_out and result.error is not None
+    assert not result.changed
+    assert Path(filename).read_text() == MARKED_MODULE.format(index=0)
@@ -0,0 +1,122 @@
+import io
+import json
+import subprocess
+import sys
+
+from django_unasyncify.config import Config
+from django_unasyncify.server import (
+    INVALID_PARAMS,
+    INVALID_REQUEST,
+    METHOD_NOT_FOUND,
+    PARSE_ERROR,
+    TRANSFORM_ERROR,
+    TransformServer,
+)
+
+CODE = """\
+from helpers import from_codegen, generate_unasynced
+
+
+class QuerySet:
+    @generate_unasynced
+    async def aget(self, pk):
+        return await self.afilter(pk=pk).afirst()
+"""
+
+
+def request(id, method, **params) -> str:
+    return json.dumps({"jsonrpc": "2.0", "id": id, "method": method, "params": params})
+
+
+def test_requests_are_answered():
+    server = TransformServer(Config(unasync_helpers_import_path="helpers"))
+    requests = [
+        request(1, "transform", code=CODE, filename="app/models.py"),
+        request(2, "transform_function", code=CODE, function="QuerySet.aget"),
+        request(3, "transform", code="x = 1\n"),
+        request(4, "transform", code="@generate_unasynced\nasync def a(:\n"),
+        request(5, "transform_function", code=CODE, function="QuerySet.get"),
+        request(6, "rename"),
+        "{not json",
+        json.dumps({"jsonrpc": "2.0", "method": "transform", "params": {"code": ""}}),
+        request(7, "shutdown"),
+        request(8, "transform", code=CODE),
+    ]
+    output = io.StringIO()
+    server.serve(io.StringIO("\n".join(requests) + "\n"), output)
+    responses = [json.loads(line) for line in output.getvalue().splitlines()]
+
+    # notifications don't get a response, and nothing is read after a shutdown
+    assert [response["id"] for response in responses] == [1, 2, 3, 4, 5, 6, None, 7]
+    transformed, function, untouched, broken, not_async, unknown, invalid, _ = responses
+    assert transformed["result"]["changed"]
+    assert transformed["result"]["functions_generated"] == 1
+    assert "    def get(self, pk):\n" in transformed["result"]["code"]
+    assert function["result"] == {
+        "name": "get",
+        "code": (
+            "    @from_codegen\n"
+            "    def get(self, pk):\n"
+            "        return self.filter(pk=pk).first()\n"
+        ),
+        "line": 5,
+    }
+    assert untouched["result"] == {
+        "code": "x = 1\n",
+        "changed": False,
+        "functions_generated": 0,
+    }
+    assert broken["error"]["code"] == TRANSFORM_ERROR
+    assert not_async["error"]["code"] == INVALID_PARAMS
+    assert unknown["error"]["code"] == METHOD_NOT_FOUND
+    assert invalid["error"]["code"] == PARSE_ERROR
+
+
+def notification(method, **params) -> str:
+    return json.dumps({"jsonrpc": "2.0", "method": method, "params": params})
+
+
+def test_failed_notifications_are_not_answered():
+    server = TransformServer(Config(unasync_helpers_import_path="helpers"))
+    requests = [
+        notification("rename"),
+        notification("transform_function", code=CODE),
+        notification("transform", code="@generate_unasynced\nasync def a(:\n"),
+        # (not a request, so it can't be a notification either)
+        json.dumps({"jsonrpc": "2.0", "params": {}}),
+        request(1, "shutdown"),
+    ]
+    output = io.StringIO()
+    server.serve(io.StringIO("\n".join(requests) + "\n"), output)
+    responses = [json.loads(line) for line in output.getvalue().splitlines()]
+
+    invalid, shutdown = responses
+    assert invalid["id"] is None
+    assert invalid["error"]["code"] == INVALID_REQUEST
+    assert shutdown == {"jsonrpc": "2.0", "id": 1, "result": None}
+
+
+def test_server_mode_does_not_write_anything(sample_project):
+    before = sorted(sample_project.rglob("*"))
+    completed = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys\n"
+            "from django_unasyncify.cmd import main\n"
+            "sys.exit(main(argv=sys.argv[1:]))\n",
+            "--project",
+            str(sample_project),
+            "--server",
+        ],
+        input=request(1, "transform", code=(sample_project / "one.py").read_text())
+        + "\n",
+        capture_output=True,
+        text=True,
+    )
+    assert completed.returncode == 0, completed.stderr
+    (response,) = [json.loads(line) for line in completed.stdout.splitlines()]
+    assert (
+        response["result"]["code"] == (sample_project / "one.py.expected").read_text()
+    )
+    assert sorted(sample_project.rglob("*")) == before
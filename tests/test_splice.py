@@ -0,0 +1,173 @@
+"""
+The fast engine has to produce exactly what the codemod does, these
+tests run both over the same code and compare the results
+"""
+
+import sys
+from pathlib import Path
+from textwrap import dedent
+
+import pytest
+from libcst.codemod import CodemodContext
+
+from django_unasyncify.codemod import UnasyncifyMethodCommand
+from django_unasyncify.config import Config
+from django_unasyncify.discovery import gather_python_files, has_unasync_markers
+from django_unasyncify.runner import transform_code
+from django_unasyncify.splice import transform_source
+
+HEADER = """\
+import asyncio
+
+from django.utils.asyncio import async_unsafe
+from helpers import IS_ASYNC, from_codegen, generate_unasynced
+"""
+
+SAMPLES = {
+    "methods": """
+        class QuerySet:
+            limit = 10
+
+            # fetches a row
+            @generate_unasynced
+            async def aget(self, pk):
+                \"\"\"
+                # not a comment
+                \"\"\"
+                return await self.afilter(pk=pk).afirst()
+
+            def plain(self):
+                pass
+            @generate_unasynced(async_unsafe=True)
+            async def _afetch(self):
+                if IS_ASYNC:
+                    await asyncio.sleep(0)
+                async with self.alock():
+                    rows = [row async for row in self.arows()]
+                return rows
+                # trailing comment of _afetch
+
+            # a comment before the end of the class
+        """,
+    "top_level": """
+        CONSTANT = 1
+
+
+        @generate_unasynced
+        async def aload(path):  # same line comment
+            return await aread(path)
+        @generate_unasynced()
+        async def asave(path, data): await awrite(path, data)
+        """,
+    "nested": """
+        try:
+            class Manager:
+                class Inner:
+                    @generate_unasynced
+                    async def acount(self):
+                        return await self.aaggregate()
+        except ImportError:
+            pass
+
+        def factory():
+            @generate_unasynced
+            async def ado():
+                pass
+
+            return ado
+        """,
+    "odd_comments": """
+        class Model:
+            def save(self):
+                pass
+        # a comment at the wrong indentation
+            @generate_unasynced
+            async def asave(self):
+                await self.aupdate()
+        """,
+    "split_pairs": """
+        class Model:
+            @from_codegen
+            def refresh(self):
+                self.stale()
+
+            def unrelated(self):
+                pass
+
+            @generate_unasynced
+            async def arefresh(self):
+                await self.areload()
+        """,
+    "nested_marked": """
+        @generate_unasynced
+        async def aouter():
+            @generate_unasynced
+            async def ainner():
+                await asleep()
+            await ainner()
+        """,
+    "missing_imports": """
+        @generate_unasynced
+        async def aretry():
+            await asyncio.sleep(1)
+        """,
+}
+
+
+def assert_equivalent(codemod: UnasyncifyMethodCommand, code: bytes) -> bytes:
+    expected = transform_code(codemod, code)
+    assert transform_code(codemod, code, engine="fast") == expected
+    return expected
+
+
+@pytest.mark.parametrize("function_fingerprints", [False, True])
+@pytest.mark.parametrize("sample", sorted(SAMPLES))
+def test_engines_are_equivalent(sample, function_fingerprints):
+    config = Config(
+        unasync_helpers_import_path="helpers",
+        function_fingerprints=function_fingerprints,
+    )
+    codemod = UnasyncifyMethodCommand(CodemodContext(), config)
+    code = (HEADER + dedent(SAMPLES[sample])).encode("utf-8")
+    generated = assert_equivalent(codemod, code)
+    # and once more, with the generated code in place
+    assert assert_equivalent(codemod, generated) == generated
+
+
+def test_fast_engine_handles_regular_code():
+    codemod = UnasyncifyMethodCommand(
+        CodemodContext(), Config(unasync_helpers_import_path="helpers")
+    )
+    for sample in ("methods", "top_level", "nested"):
+        code = (HEADER + dedent(SAMPLES[sample])).encode("utf-8")
+        assert transform_source(codemod, code) is not None, sample
+    # but leaves anything else to libcst
+    for sample in ("odd_comments", "split_pairs", "nested_marked", "missing_imports"):
+        code = (HEADER + dedent(SAMPLES[sample])).encode("utf-8")
+        assert transform_source(codemod, code) is None, sample
+
+
+def test_engines_are_equivalent_on_the_benchmark_corpus(tmp_path: Path):
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+    try:
+        from benchmarks.corpus import CorpusSpec, generate_corpus
+    finally:
+        sys.path.pop(0)
+
+    spec = CorpusSpec(
+        modules=6, marked_share=0.5, large_modules=1, large_module_methods=4
+    )
+    config = Config.from_project_path(generate_corpus(tmp_path, spec))
+    marked = [
+        filename
+        for filename in gather_python_files(config.paths_to_visit)
+        if has_unasync_markers(filename)
+    ]
+    assert marked
+    codemod = UnasyncifyMethodCommand(CodemodContext(), config)
+    for filename in marked:
+        code = Path(filename).read_bytes()
+        generated = assert_equivalent(codemod, code)
+        assert assert_equivalent(codemod, generated) == generated
+        # once the imports are in place, everything goes through the fast engine
+        assert transform_source(codemod, generated) is not None
@@ -1,6 +1,7 @@
 from textwrap import dedent
 
 import libcst as cst
+import pytest
 
 from django_unasyncify.config import Config
 from django_unasyncify.transform import UnasyncifyMethod
@@ -30,3 +31,202 @@ def test_name_transform():
 
     config = Config(attribute_renames={"aconnection": "connection"})
     assert_transforms(before, config, expected)
+
+
+def test_is_async_folding():
+    before = """
+    a = not IS_ASYNC
+    b = IS_ASYNC and x
+    c = (IS_ASYNC or x)
+    d = x and IS_ASYNC
+    e = x if IS_ASYNC else y
+    f = (x if not IS_ASYNC else y)
+    assert not IS_ASYNC; g = 1
+    assert IS_ASYNC
+    while IS_ASYNC:
+        wait()
+    """
+
+    expected = """
+    a = True
+    b = False
+    c = (x)
+    d = x and False
+    e = y
+    f = (x)
+    g = 1
+    assert False
+    """
+
+    assert_transforms(before, Config(), expected)
+
+
+def test_is_async_branch_folding():
+    before = """
+    # before the branch
+    if not IS_ASYNC:
+        a()
+    if x:
+        b()
+    elif IS_ASYNC:
+        c()
+    elif y:
+        d()
+    if x:
+        e()
+    elif not IS_ASYNC and y:
+        f()
+    else:
+        g()
+    if x:
+        h()
+    elif not IS_ASYNC:
+        i()
+    else:
+        j()
+    if IS_ASYNC: k()
+    else: l()
+    def only_async():
+        if IS_ASYNC:
+            m()
+    """
+
+    expected = """
+    # before the branch
+    a()
+    if x:
+        b()
+    elif y:
+        d()
+    if x:
+        e()
+    elif y:
+        f()
+    else:
+        g()
+    if x:
+        h()
+    else:
+        i()
+    l()
+    def only_async():
+        pass
+    """
+
+    assert_transforms(before, Config(), expected)
+
+
+def test_constants():
+    before = """
+    if connection.features.supports_x and not DEBUG:
+        fast_path()
+    else:
+        slow_path(DEBUG=DEBUG)
+    y = settings.DEBUG or make_connection().features.supports_x
+    """
+
+    expected = """
+    slow_path(DEBUG=True)
+    y = settings.DEBUG or make_connection().features.supports_x
+    """
+
+    config = Config(constants={"connection.features.supports_x": True, "DEBUG": True})
+    assert_transforms(before, config, expected)
+
+
+def test_sync_wrappers_are_lowered():
+    before = """
+    await sync_to_async(self._fetch)(1, key="a")
+    await sync_to_async(load, thread_sensitive=False)()
+    await asgiref.sync.sync_to_async(self.cache.get)(key)
+    await database_sync_to_async(lambda: x)()
+    await asyncio.to_thread(self._fetch, 1)
+    (await sync_to_async(self._fetch)()).rows
+    sync_to_async(self._fetch)
+    await sync_to_async(*args)()
+    """
+
+    expected = """
+    self._fetch(1, key="a")
+    load()
+    self.cache.get(key)
+    (lambda: x)()
+    self._fetch(1)
+    (self._fetch()).rows
+    sync_to_async(self._fetch)
+    sync_to_async(*args)()
+    """
+
+    assert_transforms(before, Config(), expected)
+
+
+def test_asyncio_combinators_are_lowered():
+    before = """
+    a, b = await asyncio.gather(self.afoo(), self.abar())
+    rows = await asyncio.gather(*[self.afetch(i) for i in ids])
+    row = await asyncio.wait_for(self.afetch(1), timeout=5)
+    await asyncio.sleep(0)
+    if ready: await asyncio.sleep(0)
+    await asyncio.sleep(delay)
+    items = aiter(queryset)
+    item = await anext(items)
+    """
+
+    expected = """
+    a, b = (self.foo(), self.bar())
+    rows = (*[self.fetch(i) for i in ids],)
+    row = self.fetch(1)
+    if ready: pass
+    time.sleep(delay)
+    items = iter(queryset)
+    item = next(items)
+    """
+
+    code_cst = cst.parse_module(dedent(before))
+    transformer = UnasyncifyMethod(Config())
+    assert code_cst.visit(transformer).code == dedent(expected)
+    assert transformer.needed_imports == {"time"}
+
+
+@pytest.mark.parametrize(
+    "code",
+    [
+        "await asyncio.gather(self.afoo(), return_exceptions=True)",
+        "await asyncio.wait_for(fut=self.afetch(), timeout=5)",
+        "await asyncio.sleep(1, result=5)",
+        "await asyncio.sleep(delay=1)",
+    ],
+)
+def test_unsupported_lowerings_are_errors(code):
+    with pytest.raises(ValueError, match="Can't lower"):
+        cst.parse_module(code).visit(UnasyncifyMethod(Config()))
+
+
+def test_unsupported_lowerings_can_stay_async():
+    before = """
+    if IS_ASYNC:
+        results = await asyncio.gather(self.afoo(), return_exceptions=True)
+    else:
+        results = [self.foo()]
+    """
+
+    expected = """
+    results = [self.foo()]
+    """
+
+    assert_transforms(before, Config(), expected)
+
+
+def test_lowerings_are_configurable():
+    before = """
+    await trio.sleep(1)
+    await asyncio.wait_for(self.afetch(), 1)
+    """
+
+    expected = """
+    time.sleep(1)
+    asyncio.wait_for(self.fetch(), 1)
+    """
+
+    config = Config(lowerings={"trio.sleep": "sleep"})
+    assert_transforms(before, config, expected)
@@ -0,0 +1,51 @@
+from pathlib import Path
+
+from libcst.codemod import CodemodContext
+
+from django_unasyncify.codemod import UnasyncifyMethodCommand
+from django_unasyncify.config import Config
+from django_unasyncify.watch import Watcher
+
+
+def make_watcher(project: Path, results: list) -> Watcher:
+    config = Config.from_project_path(project)
+    codemod = UnasyncifyMethodCommand(config=config, context=CodemodContext())
+    return Watcher(config, codemod, debounce=0.01, on_result=results.append)
+
+
+def test_nothing_to_do_without_changes(sample_project):
+    results: list = []
+    watcher = make_watcher(sample_project, results)
+    assert watcher.run_once() == []
+    assert results == []
+
+
+def test_saved_file_gets_regenerated(sample_project):
+    results: list = []
+    watcher = make_watcher(sample_project, results)
+
+    one_py = sample_project / "one.py"
+    # make sure the modification is visible even on coarse mtimes
+    one_py.write_text(one_py.read_text() + "\n")
+
+    [result] = watcher.run_once()
+    assert result.filename == str(one_py)
+    assert result.changed
+    assert result.error is None
+    assert "def get_thing(qs):" in one_py.read_text()
+
+    # our own write does not trigger another round
+    assert watcher.run_once() == []
+
+
+def test_new_files_are_picked_up(sample_project):
+    results: list = []
+    watcher = make_watcher(sample_project, results)
+    watcher.rescan_interval = 0
+
+    two_py = sample_project / "two.py"
+    two_py.write_text("@generate_unasynced\nasync def afoo():\n    await abar()\n")
+
+    [result] = watcher.run_once()
+    assert result.filename == str(two_py)
+    assert "def foo():\n    bar()" in two_py.read_text()